@@ -15,7 +15,7 @@ from datetime import datetime
 from functools import lru_cache
 
 from ebi_eva_common_pyutils.logger import logging_config
-from ebi_eva_common_pyutils.network_utils import json_request
+from ebi_eva_common_pyutils.network_utils import json_request, json_request_iter
 from ebi_eva_common_pyutils.taxonomy.taxonomy import get_normalized_scientific_name_from_ensembl
 
 logger = logging_config.get_logger(__name__)
@@ -39,9 +39,8 @@ def get_taxonomy_to_assembly_mapping_from_ensembl_rapid_release():
     Returns a dict mapping taxonomy ID to assembly accession, choosing the most recently released,
     lexicographically last, non-alternate haplotype assembly when multiple are present.
     """
-    list_data = json_request('https://ftp.ensembl.org/pub/rapid-release/species_metadata.json')
     results = {}
-    for asm_data in list_data:
+    for asm_data in json_request_iter('https://ftp.ensembl.org/pub/rapid-release/species_metadata.json'):
         tax_id = asm_data['taxonomy_id']
         asm_accession = asm_data['assembly_accession']
         strain = asm_data['strain']
@@ -17,12 +17,12 @@ import requests
 from requests import HTTPError
 
 from ebi_eva_common_pyutils.assembly import NCBIAssembly
-from ebi_eva_common_pyutils.ena_utils import download_xml_from_ena
+from ebi_eva_common_pyutils.ena_utils import ena_record_cache
 from ebi_eva_common_pyutils.logger import logging_config as log_cfg
+from ebi_eva_common_pyutils.ncbi_assembly_summary import ncbi_assembly_summary_index
+from ebi_eva_common_pyutils.ncbi_utils import iter_ncbi_assembly_dicts_from_term
 
 EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-ESEARCH_URL = EUTILS_URL + 'esearch.fcgi'
-ESUMMARY_URL = EUTILS_URL + 'esummary.fcgi'
 EFETCH_URL = EUTILS_URL + 'efetch.fcgi'
 
 
@@ -35,14 +35,12 @@ def is_patch_assembly(assembly_accession: str) -> bool:
     Please see: https://www.ncbi.nlm.nih.gov/grc/help/patches/
     """
     try:
-        xml_root = download_xml_from_ena(f'https://www.ebi.ac.uk/ena/browser/api/xml/{assembly_accession}')
+        return ena_record_cache.assembly_patch_count(assembly_accession) > 0
     except HTTPError as e:
         logger.warning(f'Failed to download assembly {assembly_accession} from ENA: {str(e)}')
         return False
-    xml_assembly = xml_root.xpath("//ASSEMBLY_ATTRIBUTE[TAG='count-patches']/VALUE")
-    if len(xml_assembly) == 0:
+    except ValueError:
         return False
-    return int(xml_assembly[0].text) > 0
 
 
 def retrieve_genbank_assembly_accessions_from_ncbi(assembly_txt, api_key=None):
@@ -50,26 +48,18 @@ def retrieve_genbank_assembly_accessions_from_ncbi(assembly_txt, api_key=None):
     Attempt to find any assembly genebank accession base on a free text search.
     """
     assembly_accessions = set()
-    payload = {'db': 'Assembly', 'term': '"{}"'.format(assembly_txt), 'retmode': 'JSON'}
-    if api_key:
-        payload['api_key'] = api_key
-    data = requests.get(ESEARCH_URL, params=payload).json()
-    if data and data.get('esearchresult', {}).get('idlist'):
-        assembly_id_list = data.get('esearchresult').get('idlist')
-        payload = {'db': 'Assembly', 'id': ','.join(assembly_id_list), 'retmode': 'JSON'}
-        if api_key:
-            payload['api_key'] = api_key
-        summary_list = requests.get(ESUMMARY_URL, params=payload).json()
-        for assembly_id in summary_list.get('result', {}).get('uids', []):
-            assembly_info = summary_list.get('result').get(assembly_id)
-            if 'genbank' in assembly_info['synonym']:
-                assembly_accessions.add(assembly_info['synonym']['genbank'])
+    for assembly_info in iter_ncbi_assembly_dicts_from_term(assembly_txt, api_key=api_key):
+        if 'genbank' in assembly_info['synonym']:
+            assembly_accessions.add(assembly_info['synonym']['genbank'])
     if len(assembly_accessions) != 1:
         logger.warning('%s Genbank synonyms found for assembly %s ', len(assembly_accessions), assembly_txt)
     return list(assembly_accessions)
 
 
 def retrieve_genbank_equivalent_for_GCF_accession(assembly_accession, ncbi_api_key=None):
+    paired_accession = ncbi_assembly_summary_index.get_paired_accession(assembly_accession)
+    if paired_accession and paired_accession.startswith('GCA_'):
+        return paired_accession
     genbank_synonyms = retrieve_genbank_assembly_accessions_from_ncbi(assembly_accession, api_key=ncbi_api_key)
     if len(genbank_synonyms) != 1:
         raise ValueError('%s Genbank synonyms found for assembly %s ' % (len(genbank_synonyms), assembly_accession))
@@ -0,0 +1,259 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Asyncio counterparts of the communicators in biosamples_communicators.
+They require aiohttp which can be installed with the "async" extra.
+"""
+import asyncio
+import base64
+import random
+import time
+
+import aiohttp
+
+from ebi_eva_common_pyutils.biosamples_communicators import HALCommunicator, HttpErrorRetry
+from ebi_eva_common_pyutils.logger import AppLogger
+
+
+class AsyncHALCommunicator(AppLogger):
+    """
+    This class helps navigate through REST API that uses the HAL standard using asyncio.
+    All the requests share the same connection pool and the number of requests in flight is limited by
+    max_concurrency. It should be used as an asynchronous context manager:
+
+        async with AsyncHALCommunicator(auth_url, bsd_url, username, password) as communicator:
+            sample = await communicator.follows_link('samples', join_url='SAMEA1')
+    """
+    acceptable_code = HALCommunicator.acceptable_code
+    no_retry_code = HALCommunicator.no_retry_code
+    token_refresh_margin = HALCommunicator.token_refresh_margin
+    # Same retry policy as HALCommunicator._req
+    tries = 3
+    delay = 2
+    backoff = 1.2
+    jitter = (1, 3)
+
+    def __init__(self, auth_url, bsd_url, username, password, max_concurrency=50):
+        self.auth_url = auth_url
+        self.bsd_url = bsd_url
+        self.username = username
+        self.password = password
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._semaphore = None
+        self._token = None
+        self._token_expiry = None
+        self._token_lock = None
+        self._root = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        """Create the session and synchronisation objects in the running event loop."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _retrieve_token(self):
+        """Retrieve the token from the REST API"""
+        credentials = base64.b64encode(f'{self.username}:{self.password}'.encode('utf-8')).decode('ascii')
+        auth_header = 'Basic ' + credentials
+        async with self._session.get(self.auth_url, headers={'Authorization': auth_header}) as response:
+            text = await response.text()
+            self._validate_response(response, text)
+            return text
+
+    def _token_needs_refresh(self):
+        return self._token is None or (
+            self._token_expiry is not None and time.time() > self._token_expiry - self.token_refresh_margin
+        )
+
+    async def get_token(self):
+        """
+        Retrieve the token from the REST API then cache it for further querying until shortly before it expires.
+        Only one task retrieves a new token, the others wait for it.
+        """
+        if self._token_needs_refresh():
+            async with self._token_lock:
+                if self._token_needs_refresh():
+                    token = await self._retrieve_token()
+                    self._token_expiry = HALCommunicator._get_token_expiry(token)
+                    self._token = token
+        return self._token
+
+    def _validate_response(self, response, text):
+        """Check that the response has an acceptable code and raise if it does not"""
+        if response.status not in self.acceptable_code:
+            self.error(response.method + ': ' + str(response.url))
+            self.error("<{}>: {}".format(response.status, text))
+            error_msg = 'The HTTP status code ({}) is not one of the acceptable codes ({})'.format(
+                str(response.status), str(self.acceptable_code))
+            if response.status in self.no_retry_code:
+                raise ValueError(error_msg)
+            else:
+                raise HttpErrorRetry(error_msg)
+
+    async def _req(self, method, url, text_only=False, **kwargs):
+        """
+        Private method that sends a request using the specified method and returns the json response or the text
+        if text_only is set. It adds the headers required by bsd and retries on server and connection errors.
+        """
+        if self._session is None:
+            raise RuntimeError(f'{self.__class__.__name__} needs to be opened before sending requests')
+        delay = self.delay
+        for attempt in range(1, self.tries + 1):
+            try:
+                return await self._send(method, url, text_only, **kwargs)
+            except (HttpErrorRetry, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.tries:
+                    raise
+                self.warning('%s, retrying in %s seconds...', str(e) or e.__class__.__name__, delay)
+                await asyncio.sleep(delay)
+                delay = delay * self.backoff + random.uniform(*self.jitter)
+
+    async def _send(self, method, url, text_only=False, **kwargs):
+        headers = dict(kwargs.pop('headers', {}))
+        headers.update({'Accept': 'application/hal+json'})
+        token = await self.get_token()
+        if token is not None:
+            headers.update({'Authorization': 'Bearer ' + token})
+        if 'json' in kwargs:
+            headers['Content-Type'] = 'application/json'
+        async with self._semaphore:
+            async with self._session.request(method, url, headers=headers, **kwargs) as response:
+                text = await response.text()
+                if response.status == 401 and token is not None:
+                    # The token was rejected: make sure the retry uses a new one
+                    async with self._token_lock:
+                        if self._token == token:
+                            self._token = None
+                self._validate_response(response, text)
+                if text_only:
+                    return text
+                return await response.json(content_type=None)
+
+    async def get_root(self):
+        if self._root is None:
+            self._root = await self._req('GET', self.bsd_url)
+        return self._root
+
+    async def _follows_url(self, query, json_obj=None, url_template_values=None, join_url=None):
+        if json_obj is None:
+            json_obj = await self.get_root()
+        return HALCommunicator._build_url(json_obj, query, url_template_values, join_url)
+
+    async def _follows_pages(self, url, method='GET', **kwargs):
+        content = await self._req(method, url, **kwargs)
+        yield content
+        while 'next' in content.get('_links', {}):
+            content = await self._req(method, content.get('_links').get('next').get('href'), **kwargs)
+            yield content
+
+    async def follows(self, query, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                      **kwargs):
+        """
+        Finds a link within the json_obj using a query string or list, modify the link using the
+        url_template_values dictionary then query the link using the method and any additional keyword argument.
+        If the json_obj is not specified then it will use the root query defined by the base url.
+        Supports all_pages and text_only like HALCommunicator.follows.
+        """
+        all_pages = kwargs.pop('all_pages', False)
+        text_only = kwargs.pop('text_only', False)
+        url = await self._follows_url(query, json_obj, url_template_values, join_url)
+        if text_only:
+            return await self._req(method, url, text_only=True, **kwargs)
+        if not all_pages:
+            return await self._req(method, url, **kwargs)
+        json_response = None
+        async for content in self._follows_pages(url, method, **kwargs):
+            if json_response is None:
+                json_response = content
+                continue
+            for key, elements in content.get('_embedded', {}).items():
+                json_response.setdefault('_embedded', {}).setdefault(key, []).extend(elements)
+        # Remove the pagination information as it is not relevant to the depaginated response
+        json_response.pop('page', None)
+        for link in ('first', 'last', 'next'):
+            json_response.get('_links', {}).pop(link, None)
+        return json_response
+
+    async def follows_link(self, key, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                           **kwargs):
+        """
+        Same function as follows but construct the query_string from a single keyword surrounded by '_links' and 'href'.
+        """
+        return await self.follows(('_links', key, 'href'),
+                                  json_obj=json_obj, method=method, url_template_values=url_template_values,
+                                  join_url=join_url, **kwargs)
+
+    async def follows_iter(self, query, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                           embedded_key=None, **kwargs):
+        """
+        Same function as follows with all_pages=True but yields the embedded elements as each page is retrieved.
+        """
+        url = await self._follows_url(query, json_obj, url_template_values, join_url)
+        async for content in self._follows_pages(url, method, **kwargs):
+            for key, elements in content.get('_embedded', {}).items():
+                if embedded_key is None or key == embedded_key:
+                    for element in elements:
+                        yield element
+
+    def follows_link_iter(self, key, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                          embedded_key=None, **kwargs):
+        """
+        Same function as follows_iter but construct the query_string from a single keyword surrounded by '_links'
+        and 'href'.
+        """
+        return self.follows_iter(('_links', key, 'href'),
+                                 json_obj=json_obj, method=method, url_template_values=url_template_values,
+                                 join_url=join_url, embedded_key=embedded_key, **kwargs)
+
+
+class AsyncWebinHALCommunicator(AsyncHALCommunicator):
+    """Class to navigate BioSamples API using Webin authentication."""
+
+    async def _retrieve_token(self):
+        """Retrieve the token from the ENA Webin REST API"""
+        async with self._session.post(self.auth_url,
+                                      json={"authRealms": ["ENA"], "password": self.password,
+                                            "username": self.username}) as response:
+            text = await response.text()
+            self._validate_response(response, text)
+            return text
+
+    @property
+    def communicator_attributes(self):
+        return {'webinSubmissionAccountId': self.username}
+
+
+class AsyncNoAuthHALCommunicator(AsyncHALCommunicator):
+    """Class to navigate BioSamples API without authentication."""
+
+    def __init__(self, bsd_url, max_concurrency=50):
+        super().__init__(None, bsd_url, None, None, max_concurrency=max_concurrency)
+
+    async def get_token(self):
+        """No auth token, so errors will be raised if auth is required for requests"""
+        return None
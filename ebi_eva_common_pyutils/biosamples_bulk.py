@@ -0,0 +1,125 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+# Result of the operation on a single item: result is set on success and error on failure
+BulkOutcome = namedtuple('BulkOutcome', ['item', 'success', 'result', 'error'])
+
+
+class BulkStats:
+    """Counts the outcomes of a bulk run and the throughput achieved."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.end_time = None
+        self.succeeded = 0
+        self.failed = 0
+
+    def add(self, outcome):
+        if outcome.success:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    @property
+    def processed(self):
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def throughput(self):
+        """Number of items processed per second"""
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.processed} processed ({self.succeeded} succeeded, {self.failed} failed) '
+                f'in {self.elapsed:.1f}s: {self.throughput:.1f} items/s')
+
+
+class BioSamplesBulkProcessor(AppLogger):
+    """
+    Run the same BioSamples operation on many samples through a HALCommunicator with a bounded number of
+    concurrent requests. The input is consumed lazily so only a limited number of samples are in flight at any time
+    and the outcomes are returned as soon as they complete, in completion order.
+    The retries are handled independently for each sample by the communicator and a failure is reported in the
+    sample's outcome without interrupting the others.
+    """
+
+    def __init__(self, communicator, max_workers=10, max_in_flight=None, progress_interval=1000):
+        self.communicator = communicator
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or max_workers * 2
+        self.progress_interval = progress_interval
+        self.stats = BulkStats()
+
+    def run(self, items, function):
+        """
+        Apply the function to each item concurrently and yield a BulkOutcome for each of them.
+        The statistics of the run are available in the stats attribute.
+        """
+        self.stats = BulkStats()
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+
+            def submit(nb_items):
+                for item in islice(items, nb_items):
+                    pending[executor.submit(function, item)] = item
+
+            submit(self.max_in_flight)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    try:
+                        outcome = BulkOutcome(item, True, future.result(), None)
+                    except Exception as e:
+                        self.warning('Failed to process %s: %s', item, str(e))
+                        outcome = BulkOutcome(item, False, None, e)
+                    self.stats.add(outcome)
+                    if self.progress_interval and self.stats.processed % self.progress_interval == 0:
+                        self.info(str(self.stats))
+                    yield outcome
+                # Only pull new items from the input once the previous ones are completed
+                submit(len(done))
+        self.stats.end_time = time.time()
+        self.info(str(self.stats))
+
+    def fetch_samples(self, accessions):
+        """Retrieve the sample documents for each accession."""
+        return self.run(accessions, lambda accession: self.communicator.follows_link('samples', join_url=accession))
+
+    def update_samples(self, samples):
+        """Replace each sample document in BioSamples using the accession they contain."""
+        return self.run(samples, lambda sample: self.communicator.follows_link(
+            'samples', method='PUT', join_url=sample.get('accession'), json=sample
+        ))
+
+    def submit_samples(self, samples):
+        """Create each sample document in BioSamples."""
+        return self.run(samples, lambda sample: self.communicator.follows_link('samples', method='POST', json=sample))
+
+    def curate_samples(self, curation_objects):
+        """Add each curation object to the sample it refers to in its 'sample' attribute."""
+        return self.run(curation_objects, lambda curation_object: self.communicator.follows_link(
+            'samples', method='POST', join_url=curation_object.get('sample') + '/curationlinks', json=curation_object
+        ))
@@ -13,10 +13,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
+import json
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlsplit, parse_qsl, urlencode, urlunsplit
 
 import requests
 from functools import cached_property
+from requests.adapters import HTTPAdapter
 from ebi_eva_common_pyutils.logger import AppLogger
 from retry import retry
 
@@ -37,12 +46,21 @@ class HALCommunicator(AppLogger):
     """
     acceptable_code = [200, 201]
     no_retry_code = [404]
+    # Maximum number of connections kept open to the same host
+    max_pool_size = 20
+    # Number of seconds before the token expires when it will be renewed
+    token_refresh_margin = 300
 
-    def __init__(self, auth_url, bsd_url, username, password):
+    def __init__(self, auth_url, bsd_url, username, password, response_cache=None):
         self.auth_url = auth_url
         self.bsd_url = bsd_url
         self.username = username
         self.password = password
+        # Optional HTTPResponseCache used to store and revalidate the documents retrieved with GET
+        self.response_cache = response_cache
+        self._token = None
+        self._token_expiry = None
+        self._token_lock = threading.Lock()
 
     def _validate_response(self, response):
         """Check that the response has an acceptable code and raise if it does not"""
@@ -59,40 +77,109 @@ class HALCommunicator(AppLogger):
         return response
 
     @cached_property
-    def token(self):
-        """Retrieve the token from the REST API then cache it for further querying"""
+    def session(self):
+        """Session shared by all the requests so the connections to the server are reused"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.max_pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _retrieve_token(self):
+        """Retrieve the token from the REST API"""
         response = requests.get(self.auth_url, auth=(self.username, self.password))
         self._validate_response(response)
         return response.text
 
+    @staticmethod
+    def _get_token_expiry(token):
+        """Decode the expiry time of a JWT without verifying it. Returns None if it cannot be decoded."""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            expiry = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+            return float(expiry) if expiry is not None else None
+        except (AttributeError, IndexError, TypeError, ValueError):
+            return None
+
+    def _token_needs_refresh(self):
+        return self._token is None or (
+            self._token_expiry is not None and time.time() > self._token_expiry - self.token_refresh_margin
+        )
+
+    @property
+    def token(self):
+        """
+        Retrieve the token from the REST API then cache it for further querying until shortly before it expires.
+        Only one thread retrieves a new token, the others wait for it.
+        """
+        if self._token_needs_refresh():
+            with self._token_lock:
+                if self._token_needs_refresh():
+                    token = self._retrieve_token()
+                    self._token_expiry = self._get_token_expiry(token)
+                    self._token = token
+        return self._token
+
+    def _invalidate_token(self, token):
+        """Discard the token so that it is retrieved again unless another thread has already renewed it"""
+        with self._token_lock:
+            if self._token == token:
+                self._token = None
+
+    @property
+    def cache_identity(self):
+        """Identity used to make sure cached responses are only served to the user that retrieved them"""
+        return f'{self.__class__.__name__}:{self.auth_url}:{self.username}'
+
     @retry(exceptions=(HttpErrorRetry, requests.RequestException), tries=3, delay=2, backoff=1.2, jitter=(1, 3))
     def _req(self, method, url, **kwargs):
         """Private method that sends a request using the specified method. It adds the headers required by bsd"""
         headers = kwargs.pop('headers', {})
         headers.update({'Accept': 'application/hal+json'})
-        if self.token is not None:
-            headers.update({'Authorization': 'Bearer ' + self.token})
+        token = self.token
+        if token is not None:
+            headers.update({'Authorization': 'Bearer ' + token})
         if 'json' in kwargs:
             headers['Content-Type'] = 'application/json'
-        response = requests.request(
+        cache_url = None
+        cached_response = None
+        if self.response_cache and method == 'GET' and 'json' not in kwargs and 'data' not in kwargs:
+            cache_url = requests.Request(method, url, params=kwargs.get('params')).prepare().url
+            cached_response = self.response_cache.get(self.cache_identity, cache_url)
+            if cached_response:
+                if self.response_cache.is_fresh(cached_response):
+                    return self.response_cache.to_response(cached_response)
+                headers.update(self.response_cache.conditional_headers(cached_response))
+        response = self.session.request(
             method=method,
             url=url,
             headers=headers,
             **kwargs
         )
+        if response.status_code == 401 and token is not None:
+            # The token was rejected: make sure the retry uses a new one
+            self._invalidate_token(token)
+        if cached_response and response.status_code == 304:
+            self.response_cache.touch(self.cache_identity, cache_url)
+            return self.response_cache.to_response(cached_response)
         self._validate_response(response)
+        if cache_url:
+            self.response_cache.put(self.cache_identity, cache_url, response)
         return response
 
-    def follows(self, query, json_obj=None, method='GET', url_template_values=None, join_url=None, **kwargs):
+    def _follows_url(self, query, json_obj=None, url_template_values=None, join_url=None):
         """
-        Finds a link within the json_obj using a query string or list, modify the link using the
-        url_template_values dictionary then query the link using the method and any additional keyword argument.
+        Finds a link within the json_obj using a query string or list and modify the link using the
+        url_template_values dictionary.
         If the json_obj is not specified then it will use the root query defined by the base url.
         """
-        all_pages = kwargs.pop('all_pages', False)
-
         if json_obj is None:
             json_obj = self.root
+        return self._build_url(json_obj, query, url_template_values, join_url)
+
+    @staticmethod
+    def _build_url(json_obj, query, url_template_values=None, join_url=None):
         # Drill down into a dict using dot notation
         _json_obj = json_obj
         if isinstance(query, str):
@@ -113,30 +200,90 @@ class HALCommunicator(AppLogger):
                 url = re.sub('{(' + k + ')(:.*)?}', v, url)
         if join_url:
             url += '/' + join_url
+        return url
+
+    @staticmethod
+    def _remaining_page_urls(content):
+        """
+        Build the urls of all the pages following this one using the next link as a template and the total number of
+        pages. Returns None if the pages cannot be addressed by their number.
+        """
+        total_pages = content.get('page', {}).get('totalPages')
+        next_url = content.get('_links', {}).get('next', {}).get('href')
+        if not total_pages or not next_url:
+            return None
+        split_url = urlsplit(next_url)
+        query = parse_qsl(split_url.query, keep_blank_values=True)
+        page_numbers = [value for key, value in query if key == 'page']
+        if len(page_numbers) != 1 or not page_numbers[0].isdigit():
+            return None
+        return [
+            urlunsplit(split_url._replace(query=urlencode(
+                [(key, str(page) if key == 'page' else value) for key, value in query]
+            )))
+            for page in range(int(page_numbers[0]), total_pages)
+        ]
+
+    def _follows_pages(self, url, method='GET', concurrent_pages=1, **kwargs):
+        """
+        Query the url and yield the json response of each page one at a time, following the next link until
+        the page comes back without one.
+        When concurrent_pages is greater than 1 and the response provides the total number of pages, up to
+        concurrent_pages pages are retrieved in parallel but still yielded in order.
+        """
+        content = self._req(method, url, **kwargs).json()
+        yield content
+        page_urls = self._remaining_page_urls(content) if concurrent_pages > 1 else None
+        if page_urls is None:
+            while 'next' in content.get('_links', {}):
+                content = self._req(method, content.get('_links').get('next').get('href'), **kwargs).json()
+                yield content
+            return
+        page_urls = iter(page_urls)
+        with ThreadPoolExecutor(max_workers=concurrent_pages) as executor:
+            futures = deque(executor.submit(self._req, method, page_url, **kwargs)
+                            for page_url in islice(page_urls, concurrent_pages))
+            while futures:
+                response = futures.popleft().result()
+                # Keep the window of pending pages full
+                for page_url in islice(page_urls, 1):
+                    futures.append(executor.submit(self._req, method, page_url, **kwargs))
+                yield response.json()
+
+    def follows(self, query, json_obj=None, method='GET', url_template_values=None, join_url=None, **kwargs):
+        """
+        Finds a link within the json_obj using a query string or list, modify the link using the
+        url_template_values dictionary then query the link using the method and any additional keyword argument.
+        If the json_obj is not specified then it will use the root query defined by the base url.
+        Setting all_pages=True depaginates the response and concurrent_pages sets how many pages can be retrieved in
+        parallel when the total number of pages is known.
+        """
+        all_pages = kwargs.pop('all_pages', False)
+        concurrent_pages = kwargs.pop('concurrent_pages', 1)
+        url = self._follows_url(query, json_obj, url_template_values, join_url)
         text_only = False
         if 'text_only' in kwargs and kwargs.get('text_only'):
             text_only = kwargs.pop('text_only')
         # Now query the url
-        response = self._req(method, url, **kwargs)
         if text_only:
-            return response.text
+            return self._req(method, url, **kwargs).text
 
-        json_response = response.json()
         # Depaginate the call if requested
         if all_pages is True:
             # This depagination code will iterate over all the pages available until the pages comes back  without a
             # next page. It stores the embedded elements in the initial query's json response
-            content = json_response
-            while 'next' in content.get('_links'):
-                content = self._req(method, content.get('_links').get('next').get('href'), **kwargs).json()
-                for key in content.get('_embedded'):
-                    json_response['_embedded'][key].extend(content.get('_embedded').get(key))
+            pages = self._follows_pages(url, method, concurrent_pages=concurrent_pages, **kwargs)
+            json_response = next(pages)
+            for content in pages:
+                for key, elements in content.get('_embedded', {}).items():
+                    json_response.setdefault('_embedded', {}).setdefault(key, []).extend(elements)
             # Remove the pagination information as it is not relevant to the depaginated response
             if 'page' in json_response: json_response.pop('page')
             if 'first' in json_response['_links']: json_response['_links'].pop('first')
             if 'last' in json_response['_links']: json_response['_links'].pop('last')
             if 'next' in json_response['_links']: json_response['_links'].pop('next')
-        return json_response
+            return json_response
+        return self._req(method, url, **kwargs).json()
 
     def follows_link(self, key, json_obj=None, method='GET', url_template_values=None, join_url=None, **kwargs):
         """
@@ -146,6 +293,30 @@ class HALCommunicator(AppLogger):
                             json_obj=json_obj, method=method, url_template_values=url_template_values,
                             join_url=join_url, **kwargs)
 
+    def follows_iter(self, query, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                     embedded_key=None, concurrent_pages=1, **kwargs):
+        """
+        Same function as follows with all_pages=True but yields the embedded elements as each page is retrieved
+        instead of accumulating all of them in memory. If embedded_key is specified, only the elements stored
+        under that key (i.e. 'samples') are returned.
+        """
+        url = self._follows_url(query, json_obj, url_template_values, join_url)
+        for content in self._follows_pages(url, method, concurrent_pages=concurrent_pages, **kwargs):
+            for key, elements in content.get('_embedded', {}).items():
+                if embedded_key is None or key == embedded_key:
+                    yield from elements
+
+    def follows_link_iter(self, key, json_obj=None, method='GET', url_template_values=None, join_url=None,
+                          embedded_key=None, concurrent_pages=1, **kwargs):
+        """
+        Same function as follows_iter but construct the query_string from a single keyword surrounded by '_links'
+        and 'href'.
+        """
+        return self.follows_iter(('_links', key, 'href'),
+                                 json_obj=json_obj, method=method, url_template_values=url_template_values,
+                                 join_url=join_url, embedded_key=embedded_key, concurrent_pages=concurrent_pages,
+                                 **kwargs)
+
     @cached_property
     def root(self):
         return self._req('GET', self.bsd_url).json()
@@ -157,9 +328,8 @@ class HALCommunicator(AppLogger):
 class WebinHALCommunicator(HALCommunicator):
     """Class to navigate BioSamples API using Webin authentication."""
 
-    @cached_property
-    def token(self):
-        """Retrieve the token from the ENA Webin REST API then cache it for further querying"""
+    def _retrieve_token(self):
+        """Retrieve the token from the ENA Webin REST API"""
         response = requests.post(self.auth_url,
                                  json={"authRealms": ["ENA"], "password": self.password,
                                        "username": self.username})
@@ -174,8 +344,8 @@ class WebinHALCommunicator(HALCommunicator):
 class NoAuthHALCommunicator(HALCommunicator):
     """Class to navigate BioSamples API without authentication."""
 
-    def __init__(self, bsd_url):
-        super(NoAuthHALCommunicator, self).__init__(None, bsd_url, None, None)
+    def __init__(self, bsd_url, response_cache=None):
+        super(NoAuthHALCommunicator, self).__init__(None, bsd_url, None, None, response_cache=response_cache)
 
     @cached_property
     def token(self):
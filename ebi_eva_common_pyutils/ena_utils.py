@@ -1,35 +1,197 @@
+import copy
+import os
+import threading
+
 import requests
 from lxml import etree
 from retry import retry
+from retry.api import retry_call
 
+ENA_BROWSER_XML_URL = 'https://www.ebi.ac.uk/ena/browser/api/xml/'
 
-@retry(tries=3, delay=2, backoff=1.2, jitter=(1, 3))
-def download_xml_from_ena(ena_url) -> etree.XML:
-    """Download and parse XML from ENA"""
+
+def _stream_from_ena(ena_url) -> requests.Response:
+    """Send the request to ENA and return the response without reading its content"""
     try:  # catches any kind of request error, including non-20X status code
-        response = requests.get(ena_url)
+        response = requests.get(ena_url, stream=True)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         raise e
-    root = etree.XML(bytes(response.text, encoding='utf-8'))
+    # Let urllib3 decompress the content if needed while it is read
+    response.raw.decode_content = True
+    return response
+
+
+@retry(tries=3, delay=2, backoff=1.2, jitter=(1, 3))
+def download_xml_from_ena(ena_url) -> etree.XML:
+    """Download and parse XML from ENA"""
+    # Parse directly from the byte stream rather than holding the text of the document
+    with _stream_from_ena(ena_url) as response:
+        root = etree.parse(response.raw).getroot()
     return root
 
 
+def iter_xml_records_from_ena(accessions, record_tag, batch_size=100):
+    """
+    Download the XML of many accessions from the ENA browser API with one request per batch of accessions and yield
+    the record elements with the tag record_tag (i.e. ASSEMBLY or taxon) as they are parsed.
+    Each element is cleared once the next one is requested so any information needed must be extracted straight away.
+    """
+    accessions = [str(accession) for accession in accessions]
+    for i in range(0, len(accessions), batch_size):
+        ena_url = ENA_BROWSER_XML_URL + ','.join(accessions[i:i + batch_size])
+        with retry_call(_stream_from_ena, fargs=(ena_url,), tries=3, delay=2, backoff=1.2, jitter=(1, 3)) as response:
+            for _, element in etree.iterparse(response.raw, events=('end',), tag=record_tag):
+                parent = element.getparent()
+                # Only return the records directly under the root element (taxon also appears in the lineage)
+                if parent is None or parent.getparent() is not None:
+                    continue
+                yield element
+                element.clear()
+                while element.getprevious() is not None:
+                    del parent[0]
+
+
+class ENARecordCache:
+    """
+    Cache of the XML records retrieved from the ENA browser API, keyed by accession, so that each record is only
+    downloaded once per process. If a cache_dir is set, the records are also stored on disk and reused by later
+    processes.
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._records = {}
+        self._lock = threading.Lock()
+        self._accession_locks = {}
+
+    def _cache_path(self, accession):
+        return os.path.join(self.cache_dir, f'{accession}.xml')
+
+    def __contains__(self, accession):
+        return str(accession) in self._records
+
+    def _store(self, accession, root):
+        self._records[accession] = root
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            cache_path = self._cache_path(accession)
+            with open(cache_path + f'.{os.getpid()}.tmp', 'wb') as open_file:
+                open_file.write(etree.tostring(root))
+            os.replace(cache_path + f'.{os.getpid()}.tmp', cache_path)
+
+    def get(self, accession):
+        """Return the root of the XML document for this accession, downloading it only if it is not cached."""
+        accession = str(accession)
+        if accession in self._records:
+            return self._records[accession]
+        with self._lock:
+            accession_lock = self._accession_locks.setdefault(accession, threading.Lock())
+        # Only one thread downloads a given accession
+        with accession_lock:
+            if accession not in self._records:
+                if self.cache_dir and os.path.isfile(self._cache_path(accession)):
+                    self._records[accession] = etree.parse(self._cache_path(accession)).getroot()
+                else:
+                    self._store(accession, download_xml_from_ena(ENA_BROWSER_XML_URL + accession))
+        return self._records[accession]
+
+    def prefetch(self, accessions, record_tag, batch_size=100):
+        """
+        Download the records of all the accessions not already cached using one request per batch of accessions.
+        The records are identified by their accession or taxId attribute. The records returned for accessions
+        requested without a version are versioned so they are stored under both accessions.
+        """
+        missing_accessions = [str(accession) for accession in dict.fromkeys(accessions)
+                              if str(accession) not in self._records]
+        if self.cache_dir:
+            for accession in list(missing_accessions):
+                if os.path.isfile(self._cache_path(accession)):
+                    self.get(accession)
+                    missing_accessions.remove(accession)
+        versionless_accessions = {accession for accession in missing_accessions if '.' not in accession}
+        for element in iter_xml_records_from_ena(missing_accessions, record_tag, batch_size=batch_size):
+            accession = element.get('accession') or element.get('taxId')
+            # Rebuild a document containing only this record so it looks like a single accession response
+            root = etree.Element(element.getparent().tag)
+            root.append(copy.deepcopy(element))
+            self._store(accession, root)
+            requested_accession = accession.split('.')[0]
+            if requested_accession != accession and requested_accession in versionless_accessions:
+                self._store(requested_accession, root)
+
+    def clear(self):
+        self._records.clear()
+
+    def assembly_element(self, assembly_accession):
+        xml_assembly = self.get(assembly_accession).xpath('/ASSEMBLY_SET/ASSEMBLY')
+        if len(xml_assembly) == 0:
+            raise ValueError(f'Assembly {assembly_accession} not found in ENA')
+        return xml_assembly[0]
+
+    def assembly_alias(self, assembly_accession):
+        return self.assembly_element(assembly_accession).get('alias')
+
+    def assembly_taxonomy_id(self, assembly_accession):
+        return int(self.assembly_element(assembly_accession).xpath('TAXON/TAXON_ID')[0].text)
+
+    def assembly_patch_count(self, assembly_accession):
+        """Number of patches of the assembly or 0 if ENA does not report any"""
+        xml_patches = self.assembly_element(assembly_accession).xpath("ASSEMBLY_ATTRIBUTES/ASSEMBLY_ATTRIBUTE"
+                                                                      "[TAG='count-patches']/VALUE")
+        if len(xml_patches) == 0:
+            return 0
+        return int(xml_patches[0].text)
+
+    def taxon_names(self, taxonomy_id):
+        """Tuple of scientific name and optional common name of the taxonomy"""
+        xml_taxon = self.get(taxonomy_id).xpath('/TAXON_SET/taxon')
+        if len(xml_taxon) == 0:
+            raise ValueError(f'Taxonomy {taxonomy_id} not found in ENA')
+        return xml_taxon[0].get('scientificName'), xml_taxon[0].get('commonName')
+
+
+# Shared by all the modules retrieving records from ENA. Set ena_record_cache.cache_dir to also keep them on disk.
+ena_record_cache = ENARecordCache()
+
+
 def get_assembly_name_and_taxonomy_id(assembly_accession):
-    xml_root = download_xml_from_ena(f'https://www.ebi.ac.uk/ena/browser/api/xml/{assembly_accession}')
-    xml_assembly = xml_root.xpath('/ASSEMBLY_SET/ASSEMBLY')
-    if len(xml_assembly) == 0:
-        raise ValueError(f'Assembly {assembly_accession} not found in ENA')
-    assembly_name = xml_assembly[0].get('alias')
-    taxonomy_id = int(xml_assembly[0].xpath('TAXON/TAXON_ID')[0].text)
-    return assembly_name, taxonomy_id
+    return ena_record_cache.assembly_alias(assembly_accession), ena_record_cache.assembly_taxonomy_id(assembly_accession)
+
+
+def get_assembly_names_and_taxonomy_ids(assembly_accessions, batch_size=100):
+    """
+    Batch version of get_assembly_name_and_taxonomy_id that returns a dict of assembly accession to a tuple of
+    assembly name and taxonomy id. Assemblies not found in ENA are absent from the result.
+    """
+    ena_record_cache.prefetch(assembly_accessions, 'ASSEMBLY', batch_size=batch_size)
+    results = {}
+    for assembly_accession in assembly_accessions:
+        if assembly_accession not in ena_record_cache:
+            continue
+        try:
+            results[assembly_accession] = get_assembly_name_and_taxonomy_id(assembly_accession)
+        except ValueError:
+            pass
+    return results
 
 
 def get_scientific_name_and_common_name(taxonomy_id):
-    xml_root = download_xml_from_ena(f'https://www.ebi.ac.uk/ena/browser/api/xml/{taxonomy_id}')
-    xml_taxon = xml_root.xpath('/TAXON_SET/taxon')
-    if len(xml_taxon) == 0:
-        raise ValueError(f'Taxonomy {taxonomy_id} not found in ENA')
-    scientific_name = xml_taxon[0].get('scientificName')
-    optional_common_name = xml_taxon[0].get('commonName')
-    return scientific_name, optional_common_name
+    return ena_record_cache.taxon_names(taxonomy_id)
+
+
+def get_scientific_names_and_common_names(taxonomy_ids, batch_size=100):
+    """
+    Batch version of get_scientific_name_and_common_name that returns a dict of taxonomy id to a tuple of
+    scientific name and optional common name. Taxonomies not found in ENA are absent from the result.
+    """
+    ena_record_cache.prefetch(taxonomy_ids, 'taxon', batch_size=batch_size)
+    results = {}
+    for taxonomy_id in taxonomy_ids:
+        if taxonomy_id not in ena_record_cache:
+            continue
+        try:
+            results[taxonomy_id] = get_scientific_name_and_common_name(taxonomy_id)
+        except ValueError:
+            pass
+    return results
@@ -0,0 +1,150 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import threading
+from collections import namedtuple
+from email.utils import formatdate
+
+from retry import retry
+
+from ebi_eva_common_pyutils.logger import AppLogger
+from ebi_eva_common_pyutils.network_utils import get_session
+
+ASSEMBLY_SUMMARY_URLS = {
+    'genbank': 'https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/assembly_summary_genbank.txt',
+    'refseq': 'https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/assembly_summary_refseq.txt'
+}
+
+# The fields of an assembly summary row that are kept in the index. paired_accession is the GCF accession of a GCA
+# assembly and vice versa or None if it does not have one.
+AssemblySummary = namedtuple('AssemblySummary', ['assembly_accession', 'paired_accession', 'assembly_name', 'taxid',
+                                                 'species_taxid', 'organism_name'])
+
+
+class NCBIAssemblySummaryIndex(AppLogger):
+    """
+    In-memory index of the assemblies listed in NCBI's assembly_summary_genbank.txt and assembly_summary_refseq.txt
+    so that assembly names, taxonomies and GCA/GCF pairs can be resolved without querying eutils.
+    The summary files loaded are remembered so that refresh only reloads the ones that changed on disk.
+    """
+
+    def __init__(self, summary_paths=None):
+        self._assemblies = {}
+        # paired accession -> accession, so that the pairs can be resolved from either side with only one file loaded
+        self._reverse_pairs = {}
+        # summary path -> (modification time, size, accessions loaded from this file)
+        self._sources = {}
+        self._lock = threading.Lock()
+        for summary_path in summary_paths or []:
+            self.load(summary_path)
+
+    def __contains__(self, assembly_accession):
+        return assembly_accession in self._assemblies
+
+    def __len__(self):
+        return len(self._assemblies)
+
+    @staticmethod
+    def _parse(summary_path):
+        headers = None
+        with open(summary_path) as open_file:
+            for line in open_file:
+                if line.startswith('#'):
+                    # The last comment line contains the header. Older files start it with "# " newer ones with "#"
+                    headers = line.lstrip('#').strip().split('\t')
+                    continue
+                if headers is None:
+                    raise ValueError(f'Could not find the header in assembly summary {summary_path}')
+                record = dict(zip(headers, line.rstrip('\n').split('\t')))
+                paired_accession = record.get('gbrs_paired_asm')
+                yield AssemblySummary(
+                    assembly_accession=record['assembly_accession'],
+                    paired_accession=paired_accession if paired_accession and paired_accession != 'na' else None,
+                    assembly_name=record.get('asm_name'),
+                    taxid=int(record['taxid']),
+                    species_taxid=int(record['species_taxid']),
+                    organism_name=record.get('organism_name')
+                )
+
+    def load(self, summary_path):
+        """Add all the assemblies of an assembly summary file to the index. Returns the number of assemblies."""
+        stat = os.stat(summary_path)
+        assemblies = {summary.assembly_accession: summary for summary in self._parse(summary_path)}
+        with self._lock:
+            _, _, previous_accessions = self._sources.get(summary_path, (None, None, set()))
+            for assembly_accession in previous_accessions - assemblies.keys():
+                summary = self._assemblies.pop(assembly_accession, None)
+                if summary and summary.paired_accession:
+                    self._reverse_pairs.pop(summary.paired_accession, None)
+            self._assemblies.update(assemblies)
+            self._reverse_pairs.update((summary.paired_accession, summary.assembly_accession)
+                                       for summary in assemblies.values() if summary.paired_accession)
+            self._sources[summary_path] = (stat.st_mtime, stat.st_size, set(assemblies))
+        self.info('Loaded %s assemblies from %s', len(assemblies), summary_path)
+        return len(assemblies)
+
+    def refresh(self):
+        """Reload the summary files that were modified since they were loaded. Returns the list of reloaded files."""
+        reloaded = []
+        for summary_path, (mtime, size, _) in list(self._sources.items()):
+            stat = os.stat(summary_path)
+            if (stat.st_mtime, stat.st_size) != (mtime, size):
+                self.load(summary_path)
+                reloaded.append(summary_path)
+        return reloaded
+
+    def get(self, assembly_accession):
+        """Return the AssemblySummary of an assembly accession or None if it is not in the index."""
+        return self._assemblies.get(assembly_accession)
+
+    def get_paired_accession(self, assembly_accession):
+        summary = self.get(assembly_accession)
+        if summary and summary.paired_accession:
+            return summary.paired_accession
+        return self._reverse_pairs.get(assembly_accession)
+
+    def get_assembly_name(self, assembly_accession):
+        summary = self.get(assembly_accession)
+        return summary.assembly_name if summary else None
+
+    def get_taxonomy_id(self, assembly_accession):
+        summary = self.get(assembly_accession)
+        return summary.taxid if summary else None
+
+
+@retry(tries=3, delay=2, backoff=1.2, jitter=(1, 3))
+def download_assembly_summary(database, output_dir):
+    """
+    Download the assembly summary of the database (genbank or refseq) into output_dir unless the local copy is
+    already up to date. Returns the path to the file.
+    """
+    summary_path = os.path.join(output_dir, os.path.basename(ASSEMBLY_SUMMARY_URLS[database]))
+    headers = {}
+    if os.path.isfile(summary_path):
+        headers['If-Modified-Since'] = formatdate(os.path.getmtime(summary_path), usegmt=True)
+    with get_session().get(ASSEMBLY_SUMMARY_URLS[database], headers=headers, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code == 304:
+            return summary_path
+        os.makedirs(output_dir, exist_ok=True)
+        with open(summary_path + '.tmp', 'wb') as open_file:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                open_file.write(chunk)
+    os.replace(summary_path + '.tmp', summary_path)
+    return summary_path
+
+
+# Consulted by the ncbi_utils and assembly_utils functions before querying eutils. It is empty until summary files
+# are loaded into it.
+ncbi_assembly_summary_index = NCBIAssemblySummaryIndex()
@@ -1,9 +1,16 @@
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import requests
 from retry import retry
 
 from ebi_eva_common_pyutils.logger import logging_config as log_cfg
+from ebi_eva_common_pyutils.ncbi_assembly_summary import ncbi_assembly_summary_index
+from ebi_eva_common_pyutils.network_utils import get_session
 
 
 logger = log_cfg.get_logger(__name__)
@@ -15,27 +22,78 @@ efetch_url = eutils_url + 'efetch.fcgi'
 ensembl_url = 'http://rest.ensembl.org/info/assembly'
 
 
+_eutils_rate_lock = threading.Lock()
+_eutils_next_request_time = 0.0
+
+
+def _wait_for_eutils_rate_limit(api_key=None):
+    """
+    Space the eutils requests made by all the threads of the process so that they stay within the NCBI rate limit:
+    3 requests per second without an api_key and 10 with one.
+    """
+    global _eutils_next_request_time
+    interval = 1 / (10 if api_key else 3)
+    with _eutils_rate_lock:
+        now = time.monotonic()
+        request_time = max(now, _eutils_next_request_time)
+        _eutils_next_request_time = request_time + interval
+    time.sleep(request_time - now)
+
+
 @retry(tries=3, delay=2, backoff=1.2, jitter=(1, 3))
-def get_ncbi_assembly_dicts_from_term(term, api_key=None):
-    """Function to return NCBI assembly objects in the form of a list of dictionaries based on a search term."""
-    payload = {'db': 'Assembly', 'term': '"{}"'.format(term), 'retmode': 'JSON'}
+def _eutils_json_request(url, payload, api_key=None):
+    payload = dict(payload, retmode='JSON')
     if api_key:
         payload['api_key'] = api_key
-    req = requests.get(esearch_url, params=payload)
+    _wait_for_eutils_rate_limit(api_key)
+    req = get_session().get(url, params=payload)
     req.raise_for_status()
-    data = req.json()
-    assembly_dicts = []
-    if data:
-        assembly_id_list = data.get('esearchresult').get('idlist')
-        payload = {'db': 'Assembly', 'id': ','.join(assembly_id_list), 'retmode': 'JSON'}
-        if api_key:
-            payload['api_key'] = api_key
-        req = requests.get(esummary_url, params=payload)
-        req.raise_for_status()
-        summary_list = req.json()
-        for assembly_id in summary_list.get('result', {}).get('uids', []):
-            assembly_dicts.append(summary_list.get('result').get(assembly_id))
-    return assembly_dicts
+    return req.json()
+
+
+def iter_ncbi_summaries_from_term(db, term, api_key=None, page_size=500, max_workers=3):
+    """
+    Search the NCBI database db for the term and yield all the esummary documents of the results.
+    The search results are kept on the NCBI history server so they can be retrieved in pages of page_size, with up to
+    max_workers pages retrieved concurrently. The documents are yielded in the search order as soon as their page
+    is retrieved. All the eutils requests of the process share the same rate limit so max_workers only allows the
+    pages to be retrieved while the previous ones are still being transferred.
+    """
+    search = _eutils_json_request(esearch_url, {'db': db, 'term': '"{}"'.format(term), 'usehistory': 'y',
+                                                'retmax': 0}, api_key=api_key)
+    search_result = search.get('esearchresult', {}) if search else {}
+    count = int(search_result.get('count', 0))
+    if not count:
+        return
+
+    def get_summary_page(retstart):
+        payload = {'db': db, 'query_key': search_result.get('querykey'), 'WebEnv': search_result.get('webenv'),
+                   'retstart': retstart, 'retmax': page_size}
+        return _eutils_json_request(esummary_url, payload, api_key=api_key)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        retstarts = iter(range(0, count, page_size))
+        # Only keep a bounded number of pages in flight so that the first results are not delayed by the last ones
+        for retstart in islice(retstarts, max_workers * 2):
+            pending.append(executor.submit(get_summary_page, retstart))
+        while pending:
+            summary_list = pending.popleft().result()
+            for retstart in islice(retstarts, 1):
+                pending.append(executor.submit(get_summary_page, retstart))
+            for uid in summary_list.get('result', {}).get('uids', []):
+                yield summary_list.get('result').get(uid)
+
+
+def iter_ncbi_assembly_dicts_from_term(term, api_key=None, page_size=500, max_workers=3):
+    """Function to yield all the NCBI assembly objects in the form of dictionaries based on a search term."""
+    return iter_ncbi_summaries_from_term('Assembly', term, api_key=api_key, page_size=page_size,
+                                         max_workers=max_workers)
+
+
+def get_ncbi_assembly_dicts_from_term(term, api_key=None):
+    """Function to return NCBI assembly objects in the form of a list of dictionaries based on a search term."""
+    return list(iter_ncbi_assembly_dicts_from_term(term, api_key=api_key))
 
 
 @retry(tries=3, delay=2, backoff=1.2, jitter=(1, 3))
@@ -44,6 +102,7 @@ def get_ncbi_taxonomy_dicts_from_term(term, api_key=None):
     payload = {'db': 'Taxonomy', 'term': '"{}"'.format(term), 'retmode': 'JSON'}
     if api_key:
         payload['api_key'] = api_key
+    _wait_for_eutils_rate_limit(api_key)
     req = requests.get(esearch_url, params=payload)
     req.raise_for_status()
     data = req.json()
@@ -61,6 +120,7 @@ def get_ncbi_taxonomy_dicts_from_ids(taxonomy_ids, api_key=None):
     payload = {'db': 'Taxonomy', 'id': ','.join(taxonomy_ids), 'retmode': 'JSON'}
     if api_key:
         payload['api_key'] = api_key
+    _wait_for_eutils_rate_limit(api_key)
     req = requests.get(esummary_url, params=payload)
     req.raise_for_status()
     summary_list = req.json()
@@ -70,6 +130,8 @@ def get_ncbi_taxonomy_dicts_from_ids(taxonomy_ids, api_key=None):
 
 
 def get_ncbi_assembly_name_from_term(term, api_key=None):
+    if term in ncbi_assembly_summary_index:
+        return ncbi_assembly_summary_index.get_assembly_name(term)
     assembl_dicts = get_ncbi_assembly_dicts_from_term(term, api_key=api_key)
     assembly_names = set([d.get('assemblyname') for d in assembl_dicts])
     if len(assembly_names) > 1:
@@ -86,6 +148,7 @@ def retrieve_species_scientific_name_from_tax_id_ncbi(taxid, api_key=None):
     payload = {'db': 'Taxonomy', 'id': taxid}
     if api_key:
         payload['api_key'] = api_key
+    _wait_for_eutils_rate_limit(api_key)
     r = requests.get(efetch_url, params=payload)
     match = re.search('<Rank>(.+?)</Rank>', r.text, re.MULTILINE)
     rank = None
@@ -100,11 +163,14 @@ def retrieve_species_scientific_name_from_tax_id_ncbi(taxid, api_key=None):
 
 def get_species_name_from_ncbi(assembly_acc, api_key=None):
     # We first need to search for the species associated with the assembly
-    assembly_dicts = get_ncbi_assembly_dicts_from_term(assembly_acc, api_key=api_key)
-    taxids = set([assembly_dict.get('taxid')
-        for assembly_dict in assembly_dicts
-        if assembly_dict.get('assemblyaccession') == assembly_acc or
-           assembly_dict.get('synonym', {}).get('genbank') == assembly_acc])
+    if assembly_acc in ncbi_assembly_summary_index:
+        taxids = {ncbi_assembly_summary_index.get_taxonomy_id(assembly_acc)}
+    else:
+        assembly_dicts = get_ncbi_assembly_dicts_from_term(assembly_acc, api_key=api_key)
+        taxids = set([assembly_dict.get('taxid')
+            for assembly_dict in assembly_dicts
+            if assembly_dict.get('assemblyaccession') == assembly_acc or
+               assembly_dict.get('synonym', {}).get('genbank') == assembly_acc])
 
     # This is a search so could retrieve multiple results
     if len(taxids) != 1:
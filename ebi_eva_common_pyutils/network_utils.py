@@ -11,16 +11,51 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import errno
+import fcntl
+import json
+import os
+import re
+import signal
+import tempfile
+import threading
 import time
+from contextlib import contextmanager
 
 import requests
 import subprocess
+from requests.adapters import HTTPAdapter
 from retry import retry
 
 from ebi_eva_common_pyutils.logger import logging_config as log_cfg
 
 logger = log_cfg.get_logger(__name__)
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return the module level session so that connections to the same host are pooled between requests."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _session_method(method):
+    """Send the requests made with the requests module functions (requests.get, requests.post...) through the
+    pooled session. Any other callable is used as is."""
+    if getattr(method, '__module__', None) == 'requests.api' and hasattr(requests.Session, method.__name__):
+        return getattr(get_session(), method.__name__)
+    return method
+
 
 def is_port_in_use(port):
     import socket
@@ -28,29 +63,332 @@ def is_port_in_use(port):
         return s.connect_ex(('localhost', port)) == 0
 
 
-def get_available_local_port(try_starting_with_port):
-    for i in range(0, 20):
-        port_to_try = try_starting_with_port + i
-        logger.info("Attempting to forward remote mongo port to local port {0}...".format(port_to_try))
-        if is_port_in_use(port_to_try):
-            logger.info("Port {0} already in use...".format(port_to_try))
-        else:
-            return port_to_try
-    logger.error("Could not forward to any local port!")
-
-
-def forward_remote_port_to_local_port(remote_host: str, remote_port: int, local_port: int) -> int:
-    port_forward_command = 'ssh -N -L{0}:localhost:{1} {2}'.format(local_port, remote_port, remote_host)
-    logger.info("Forwarding port to local port using command: " + port_forward_command)
-    proc = subprocess.Popen(port_forward_command.split(" "))
-    time.sleep(5)
-    # Ensure that the process is still running
-    poll = proc.poll()
-    if poll is not None:
-        # The process already completed which mean it most likely crashed
+def get_free_local_port():
+    """Let the kernel assign a free local port by binding to port 0."""
+    import socket
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def get_available_local_port(try_starting_with_port=None):
+    """
+    Return a free local port, preferably one of the 20 ports starting with try_starting_with_port.
+    If none is provided or all of them are in use, the port is assigned by the kernel.
+    """
+    if try_starting_with_port is not None:
+        for i in range(0, 20):
+            port_to_try = try_starting_with_port + i
+            logger.info("Attempting to forward remote mongo port to local port {0}...".format(port_to_try))
+            if is_port_in_use(port_to_try):
+                logger.info("Port {0} already in use...".format(port_to_try))
+            else:
+                return port_to_try
+        logger.warning("Could not forward to any local port starting with {0}!".format(try_starting_with_port))
+    return get_free_local_port()
+
+
+def wait_for_port(port: int, timeout: float = 30, interval: float = 0.1, proc: subprocess.Popen = None):
+    """
+    Wait until the local port accepts connections. If the process expected to open the port is provided, fail as
+    soon as it terminates. Raises TimeoutError if the port is still not open after timeout seconds.
+    """
+    deadline = time.time() + timeout
+    while not is_port_in_use(port):
+        if proc is not None and proc.poll() is not None:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        if time.time() > deadline:
+            raise TimeoutError(f'Local port {port} did not open within {timeout} seconds')
+        time.sleep(interval)
+
+
+def _port_forward_args(remote_host: str, remote_port: int, local_port: int):
+    return ['-L{0}:localhost:{1}'.format(local_port, remote_port), remote_host]
+
+
+def _start_port_forwarding(remote_host: str, remote_port: int, local_port: int, timeout: float = 30,
+                           grace_period: float = 0.5):
+    """
+    Start ssh to forward the remote port to the local port and wait for the port to open. ssh is given grace_period
+    seconds after that to exit on a forwarding failure so that the port is known to be opened by this ssh process.
+    """
+    if is_port_in_use(local_port):
+        # Another process listens on the port and would be mistaken for the tunnel
+        raise OSError(errno.EADDRINUSE, f'Local port {local_port} is already in use')
+    port_forward_command = ['ssh', '-N', '-o', 'ExitOnForwardFailure=yes'] + \
+        _port_forward_args(remote_host, remote_port, local_port)
+    logger.info("Forwarding port to local port using command: " + ' '.join(port_forward_command))
+    proc = subprocess.Popen(port_forward_command)
+    try:
+        wait_for_port(local_port, timeout=timeout, proc=proc)
+        time.sleep(grace_period)
+        if proc.poll() is not None:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    except (subprocess.CalledProcessError, TimeoutError):
+        # The process either crashed or could not open the port in time
         logger.error(f'Port Forwarding {remote_host}:{remote_port} -> {local_port} failed!')
-        raise subprocess.CalledProcessError(proc.returncode, proc.args)
-    return proc.pid
+        _stop_process(proc)
+        raise
+    return proc
+
+
+def _stop_process(proc: subprocess.Popen, timeout: float = 10):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def _start_port_forwarding_on_free_port(remote_host: str, remote_port: int, local_port: int = None,
+                                        timeout: float = 30, tries: int = 3):
+    """
+    Start the port forwarding to the provided local port or to a port assigned by the kernel. In the latter case,
+    another process can take the port before ssh binds it so a new port is tried when ssh fails.
+    Returns the ssh process and the local port.
+    """
+    if local_port:
+        return _start_port_forwarding(remote_host, remote_port, local_port, timeout=timeout), local_port
+    for attempt in range(1, tries + 1):
+        local_port = get_free_local_port()
+        try:
+            return _start_port_forwarding(remote_host, remote_port, local_port, timeout=timeout), local_port
+        except subprocess.CalledProcessError:
+            if attempt == tries:
+                raise
+        except OSError as e:
+            # Another process took the port first. Ports that do not open in time (TimeoutError) are not retried.
+            if attempt == tries or e.errno != errno.EADDRINUSE:
+                raise
+
+
+def forward_remote_port_to_local_port(remote_host: str, remote_port: int, local_port: int, timeout: float = 30) -> int:
+    """Forward the remote port to the local port and return the pid of the ssh process once the port is open."""
+    return _start_port_forwarding(remote_host, remote_port, local_port, timeout=timeout).pid
+
+
+class SSHTunnel:
+    """ssh process forwarding a remote port to a local port, shared by all the users of the same remote port."""
+
+    def __init__(self, remote_host: str, remote_port: int, local_port: int, proc: subprocess.Popen):
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.local_port = local_port
+        self.proc = proc
+        self.ref_count = 0
+
+    def is_alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        logger.info(f'Closing port forwarding {self.remote_host}:{self.remote_port} -> {self.local_port}')
+        _stop_process(self.proc)
+
+
+# Open tunnels indexed by remote host and port
+_tunnels = {}
+_tunnels_lock = threading.Lock()
+# Remote hosts and ports of the tunnels being started, which are waited for by the other callers
+_starting_tunnels = set()
+_tunnels_started = threading.Condition(_tunnels_lock)
+
+
+def open_ssh_tunnel(remote_host: str, remote_port: int, local_port: int = None, timeout: float = 30) -> SSHTunnel:
+    """
+    Return a tunnel forwarding the remote port to a local port, reusing the one already open for this remote host and
+    port if there is one. Each call must be matched by a call to close_ssh_tunnel.
+    Raises a ValueError if local_port is provided and the existing tunnel forwards to another local port.
+    """
+    key = (remote_host, remote_port)
+    with _tunnels_lock:
+        # Another thread is starting the tunnel to this remote port
+        while key in _starting_tunnels:
+            _tunnels_started.wait()
+        tunnel = _tunnels.get(key)
+        if tunnel is not None and tunnel.is_alive():
+            if local_port and tunnel.local_port != local_port:
+                raise ValueError(f'{remote_host}:{remote_port} is already forwarded to local port '
+                                 f'{tunnel.local_port}, not {local_port}')
+            tunnel.ref_count += 1
+            return tunnel
+        _starting_tunnels.add(key)
+    # ssh is started without the lock so that the other tunnels can be opened and closed meanwhile
+    tunnel = None
+    try:
+        proc, local_port = _start_port_forwarding_on_free_port(remote_host, remote_port, local_port, timeout)
+        tunnel = SSHTunnel(remote_host, remote_port, local_port, proc)
+        tunnel.ref_count += 1
+    finally:
+        with _tunnels_lock:
+            if tunnel is not None:
+                _tunnels[key] = tunnel
+            _starting_tunnels.discard(key)
+            _tunnels_started.notify_all()
+    return tunnel
+
+
+def close_ssh_tunnel(tunnel: SSHTunnel):
+    """Release the tunnel and stop the port forwarding once it is not used anymore."""
+    with _tunnels_lock:
+        tunnel.ref_count -= 1
+        if tunnel.ref_count > 0:
+            return
+        if _tunnels.get((tunnel.remote_host, tunnel.remote_port)) is tunnel:
+            del _tunnels[(tunnel.remote_host, tunnel.remote_port)]
+    tunnel.close()
+
+
+class TunnelPool:
+    """
+    Pool of SSH tunnels shared by all the processes running on the node. Each tunnel is recorded in a registry
+    directory along with the processes using it so that a new caller reuses the forwarded port of an existing tunnel
+    instead of forwarding the same remote port again. The last process to release a tunnel stops it.
+    Access to the registry is serialised with a file lock, which is not held while ssh starts. A tunnel is only
+    stopped by another process after checking that its pid still runs the ssh command of the tunnel.
+    """
+
+    def __init__(self, registry_dir: str = None):
+        self.registry_dir = registry_dir or os.path.join(tempfile.gettempdir(), f'eva_ssh_tunnels_{os.getuid()}')
+        os.makedirs(self.registry_dir, exist_ok=True)
+        # ssh processes started by this process, kept so they can be reaped
+        self._processes = {}
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.registry_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_path(self, remote_host, remote_port):
+        return os.path.join(self.registry_dir, f'{remote_host}_{remote_port}.json')
+
+    def _read_entry(self, remote_host, remote_port):
+        entry_path = self._entry_path(remote_host, remote_port)
+        if not os.path.isfile(entry_path):
+            return None
+        with open(entry_path) as open_file:
+            entry = json.load(open_file)
+        # Forget the processes that terminated without releasing the tunnel
+        entry['users'] = {pid: count for pid, count in entry['users'].items() if _is_process_alive(int(pid))}
+        return entry
+
+    def _write_entry(self, remote_host, remote_port, entry):
+        entry_path = self._entry_path(remote_host, remote_port)
+        with open(entry_path + '.tmp', 'w') as open_file:
+            json.dump(entry, open_file)
+        os.replace(entry_path + '.tmp', entry_path)
+
+    def _is_running(self, remote_host, remote_port, entry):
+        return entry is not None and is_port_in_use(entry['local_port']) and \
+            _is_port_forwarding_process(entry['pid'], remote_host, remote_port, entry['local_port'])
+
+    def _add_user(self, remote_host, remote_port, entry):
+        pid = str(os.getpid())
+        entry['users'][pid] = entry['users'].get(pid, 0) + 1
+        self._write_entry(remote_host, remote_port, entry)
+        return entry['local_port']
+
+    def acquire(self, remote_host: str, remote_port: int, timeout: float = 30) -> int:
+        """Return the local port forwarded to the remote port, starting a tunnel only if none is running."""
+        with self._locked():
+            entry = self._read_entry(remote_host, remote_port)
+            if self._is_running(remote_host, remote_port, entry):
+                logger.info(f'Reusing port forwarding {remote_host}:{remote_port} -> {entry["local_port"]}')
+                return self._add_user(remote_host, remote_port, entry)
+        # The registry is not locked while ssh starts so that the other tunnels can be acquired and released meanwhile
+        proc, local_port = _start_port_forwarding_on_free_port(remote_host, remote_port, timeout=timeout)
+        with self._locked():
+            entry = self._read_entry(remote_host, remote_port)
+            if self._is_running(remote_host, remote_port, entry):
+                # Another process started a tunnel to the same remote port in the meantime
+                logger.info(f'Reusing port forwarding {remote_host}:{remote_port} -> {entry["local_port"]}')
+                _stop_process(proc)
+            else:
+                self._processes[proc.pid] = proc
+                entry = {'pid': proc.pid, 'local_port': local_port, 'users': {}}
+            return self._add_user(remote_host, remote_port, entry)
+
+    def release(self, remote_host: str, remote_port: int):
+        """Release the tunnel for this process and stop it if no other process uses it."""
+        pid = str(os.getpid())
+        with self._locked():
+            entry = self._read_entry(remote_host, remote_port)
+            if entry is None:
+                return
+            if pid in entry['users']:
+                entry['users'][pid] -= 1
+                if entry['users'][pid] <= 0:
+                    del entry['users'][pid]
+            if entry['users']:
+                self._write_entry(remote_host, remote_port, entry)
+                return
+            logger.info(f'Closing port forwarding {remote_host}:{remote_port} -> {entry["local_port"]}')
+            proc = self._processes.pop(entry['pid'], None)
+            if proc is not None:
+                _stop_process(proc)
+            elif _is_port_forwarding_process(entry['pid'], remote_host, remote_port, entry['local_port']):
+                # The pid is only signalled if it still is the ssh process of the tunnel and not a process that
+                # reused it
+                os.kill(entry['pid'], signal.SIGTERM)
+            os.remove(self._entry_path(remote_host, remote_port))
+
+    @contextmanager
+    def tunnel(self, remote_host: str, remote_port: int, timeout: float = 30):
+        """Context manager providing the local port forwarded to the remote port."""
+        local_port = self.acquire(remote_host, remote_port, timeout=timeout)
+        try:
+            yield local_port
+        finally:
+            self.release(remote_host, remote_port)
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_args(pid: int):
+    """Command line arguments of the process or None if it does not exist."""
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as open_file:
+            return open_file.read().decode(errors='replace').split('\0')[:-1]
+    except FileNotFoundError:
+        if os.path.isdir('/proc'):
+            return None
+    # No procfs, i.e. on macOS
+    result = subprocess.run(['ps', '-p', str(pid), '-o', 'args='], stdout=subprocess.PIPE, universal_newlines=True)
+    return result.stdout.split() if result.returncode == 0 else None
+
+
+def _is_port_forwarding_process(pid: int, remote_host: str, remote_port: int, local_port: int) -> bool:
+    """Whether the process is alive and forwards the remote port to the local port."""
+    args = _process_args(pid)
+    return args is not None and all(arg in args for arg in _port_forward_args(remote_host, remote_port, local_port))
+
+
+@contextmanager
+def ssh_tunnel(remote_host: str, remote_port: int, local_port: int = None, timeout: float = 30):
+    """
+    Context manager providing the local port forwarded to the remote port:
+
+        with ssh_tunnel('mongo-host', 27017) as local_port:
+            client = pymongo.MongoClient(port=local_port)
+    """
+    tunnel = open_ssh_tunnel(remote_host, remote_port, local_port, timeout=timeout)
+    try:
+        yield tunnel.local_port
+    finally:
+        close_ssh_tunnel(tunnel)
 
 
 @retry(exceptions=(ConnectionError, requests.RequestException), logger=logger,
@@ -58,7 +396,133 @@ def forward_remote_port_to_local_port(remote_host: str, remote_port: int, local_
 def json_request(url: str, payload: dict = None, method=requests.get) -> dict:
     """Makes a request of a specified type (by default GET) with the specified URL and payload, attempts to parse the
     result as a JSON string and return it as a dictionary, on failure raises an exception."""
-    result = method(url, data=payload)
+    result = _session_method(method)(url, data=payload)
     result.raise_for_status()
     return result.json()
 
+
+@retry(exceptions=(ConnectionError, requests.RequestException), logger=logger,
+       tries=4, delay=2, backoff=1.2, jitter=(1, 3))
+def _streamed_request(url: str, payload: dict = None, method=requests.get) -> requests.Response:
+    result = _session_method(method)(url, data=payload, stream=True)
+    result.raise_for_status()
+    return result
+
+
+def json_request_iter(url: str, payload: dict = None, method=requests.get, chunk_size=65536):
+    """Same as json_request but for a JSON document that is an array: yields each element of the array as it is
+    downloaded so that the whole document is never held in memory. Only the initial request is retried."""
+    with _streamed_request(url, payload, method) as result:
+        if result.encoding is None:
+            result.encoding = 'utf-8'
+        yield from iter_json_array(result.iter_content(chunk_size=chunk_size, decode_unicode=True))
+
+
+_json_string_special = re.compile(r'["\\]')
+_json_structural = re.compile(r'["{}\[\]]')
+_json_scalar_end = re.compile(r'[\s,\]]')
+
+
+def _scan_json_value(buffer, start, scan_state, end_of_stream):
+    """
+    Look for the end of the JSON value starting at start in buffer without decoding it. scan_state holds the position
+    reached, the nesting depth and whether it is in a string so that the scan resumes where it stopped when more text
+    is appended. Returns the end of the value or None if the text received so far does not contain it.
+    """
+    position, depth, in_string = scan_state
+    if buffer[start] not in '{["':
+        # Numbers and literals end with the first delimiter, or the document
+        match = _json_scalar_end.search(buffer, position)
+        if match:
+            return match.start()
+        scan_state[0] = len(buffer)
+        return len(buffer) if end_of_stream else None
+    while True:
+        match = (_json_string_special if in_string else _json_structural).search(buffer, position)
+        if not match:
+            position = len(buffer)
+            break
+        char = match.group()
+        position = match.end()
+        if char == '\\':
+            if position == len(buffer):
+                # The escaped character is in the next chunk
+                position -= 1
+                break
+            position += 1
+        elif char == '"':
+            in_string = not in_string
+            if not in_string and depth == 0:
+                return position
+        elif char in '{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return position
+    scan_state[:] = [position, depth, in_string]
+    return None
+
+
+def iter_json_array(text_chunks):
+    """
+    Incrementally parse a JSON array provided as chunks of text and yield its elements.
+    The end of each element is found by scanning the text once so that the elements are only decoded when they are
+    complete, however many chunks they span. Raises a ValueError if the document is not a well-formed array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    # What is expected next: the opening bracket, the first element or the closing bracket, an element after a
+    # comma or a separator after an element
+    expected = '['
+    scan_state = None
+    chunks = iter(text_chunks)
+    end_of_stream = False
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == '[':
+                if char != '[':
+                    raise ValueError('The JSON document is not an array')
+                expected = 'first'
+                position += 1
+                continue
+            if expected == 'separator':
+                if char == ']':
+                    return
+                if char != ',':
+                    raise ValueError(f'Expected , or ] between the array elements, found {char!r}')
+                expected = 'element'
+                position += 1
+                continue
+            if char == ']' and expected == 'first':
+                return
+            if char in ',]':
+                raise ValueError(f'Missing array element before {char!r}')
+            if scan_state is None:
+                scan_state = [position, 0, False]
+            end = _scan_json_value(buffer, position, scan_state, end_of_stream)
+            if end is not None:
+                element, decoded_end = decoder.raw_decode(buffer, position)
+                if decoded_end != end:
+                    raise ValueError(f'Invalid JSON value: {buffer[position:end]}')
+                yield element
+                position = end
+                expected = 'separator'
+                scan_state = None
+                continue
+        if end_of_stream:
+            raise ValueError('Incomplete JSON array')
+        # Discard what has been parsed then read more text
+        if position:
+            buffer = buffer[position:]
+            if scan_state is not None:
+                scan_state[0] -= position
+            position = 0
+        try:
+            buffer += next(chunks)
+        except StopIteration:
+            end_of_stream = True
\ No newline at end of file
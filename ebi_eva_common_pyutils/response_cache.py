@@ -0,0 +1,146 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import hashlib
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import closing
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+CachedResponse = namedtuple('CachedResponse', ['url', 'etag', 'last_modified', 'content_type', 'body', 'stored_at'])
+
+
+class HTTPResponseCache(AppLogger):
+    """
+    On-disk cache of HTTP GET responses that can be revalidated with the server using their ETag or Last-Modified
+    headers. It is backed by a SQLite database so it can be shared between processes.
+    Entries are scoped by an identity (i.e. the user the request was made for) so that responses retrieved with one
+    set of credentials are never served to another. When the cache grows above max_size bytes, the least recently
+    used entries are evicted.
+    Responses younger than max_age seconds are served without contacting the server.
+    """
+
+    def __init__(self, cache_path, max_size=500 * 1024 * 1024, max_age=0):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS response ('
+                         'key TEXT PRIMARY KEY, url TEXT NOT NULL, etag TEXT, last_modified TEXT, content_type TEXT, '
+                         'body BLOB NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL, '
+                         'accessed_at REAL NOT NULL)')
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.cache_path, timeout=60, isolation_level=None))
+
+    @staticmethod
+    def cache_key(identity, url):
+        return hashlib.sha256(f'{identity}\n{url}'.encode('utf-8')).hexdigest()
+
+    def get(self, identity, url):
+        """Return the CachedResponse stored for this identity and url or None."""
+        key = self.cache_key(identity, url)
+        with self._connect() as conn:
+            row = conn.execute('SELECT url, etag, last_modified, content_type, body, stored_at FROM response '
+                               'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE response SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return CachedResponse(*row)
+
+    def is_fresh(self, cached_response):
+        """Whether the cached response can be used without revalidation"""
+        return time.time() - cached_response.stored_at < self.max_age
+
+    def put(self, identity, url, response):
+        """
+        Store a successful response to a request made to url if it can be revalidated later.
+        Returns True if the response was stored.
+        """
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (etag or last_modified):
+            return False
+        body = response.content
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR REPLACE INTO response '
+                '(key, url, etag, last_modified, content_type, body, size, stored_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.cache_key(identity, url), url, etag, last_modified,
+                 response.headers.get('Content-Type'), body, len(body), now, now)
+            )
+            self._evict(conn)
+            conn.execute('COMMIT')
+        return True
+
+    def touch(self, identity, url):
+        """Mark the cached response as revalidated by the server."""
+        with self._connect() as conn:
+            now = time.time()
+            conn.execute('UPDATE response SET stored_at = ?, accessed_at = ? WHERE key = ?',
+                         (now, now, self.cache_key(identity, url)))
+
+    def _evict(self, conn):
+        total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM response').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        keys_to_evict = []
+        for key, size in conn.execute('SELECT key, size FROM response ORDER BY accessed_at'):
+            if total_size <= self.max_size:
+                break
+            keys_to_evict.append((key,))
+            total_size -= size
+        conn.executemany('DELETE FROM response WHERE key = ?', keys_to_evict)
+        self.debug('Evicted %s responses from the cache', len(keys_to_evict))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM response')
+
+    @staticmethod
+    def conditional_headers(cached_response):
+        """Headers to send so the server only returns the document if it changed"""
+        headers = {}
+        if cached_response.etag:
+            headers['If-None-Match'] = cached_response.etag
+        if cached_response.last_modified:
+            headers['If-Modified-Since'] = cached_response.last_modified
+        return headers
+
+    @staticmethod
+    def to_response(cached_response):
+        """Create a requests.Response from the cached content"""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = cached_response.url
+        response._content = cached_response.body
+        response.headers = CaseInsensitiveDict()
+        if cached_response.content_type:
+            response.headers['Content-Type'] = cached_response.content_type
+        if cached_response.etag:
+            response.headers['ETag'] = cached_response.etag
+        if cached_response.last_modified:
+            response.headers['Last-Modified'] = cached_response.last_modified
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+        return response
@@ -0,0 +1,172 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import os
+import sqlite3
+import time
+from contextlib import closing
+from csv import DictReader, excel_tab
+
+from ebi_eva_common_pyutils.logger import AppLogger
+from ebi_eva_common_pyutils.variation.contig_utils import get_chromosome_name_for_contig_accession, \
+    get_chromosome_names_for_contig_accessions, is_wgs_accession_format
+
+
+class ChromosomeNameCache(AppLogger):
+    """
+    Persistent cache of the chromosome names resolved from ENA for Genbank contig accessions.
+    It is backed by a SQLite database so it can be shared between processes running on the same file system.
+    Contigs resolved to a chromosome name (positive results) and contigs for which ENA successfully returned a record
+    without any (negative results) are kept for different amounts of time. A ttl of None means the entry never
+    expires. Negative results are returned as None, like WGS contigs which are never sent to ENA.
+    """
+
+    def __init__(self, cache_path, positive_ttl=None, negative_ttl=7 * 24 * 3600):
+        self.cache_path = cache_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS chromosome_name ('
+                         'contig_accession TEXT PRIMARY KEY, chromosome_name TEXT NOT NULL, '
+                         'resolved_at REAL NOT NULL)')
+
+    def _connect(self):
+        # A new connection per operation makes the cache usable from several threads and processes
+        return closing(sqlite3.connect(self.cache_path, timeout=60, isolation_level=None))
+
+    def _is_expired(self, chromosome_name, resolved_at, now):
+        ttl = self.positive_ttl if chromosome_name else self.negative_ttl
+        return ttl is not None and now - resolved_at > ttl
+
+    def get(self, contig_accession):
+        """
+        Return a tuple (found, chromosome_name) for the provided contig accession. A chromosome name of None means
+        that ENA could not provide one.
+        """
+        return self.get_many([contig_accession]).get(contig_accession, (False, None))
+
+    def get_many(self, contig_accessions):
+        """Return a dict of contig accession to (found, chromosome_name) for all the non-expired entries."""
+        contig_accessions = list(dict.fromkeys(contig_accessions))
+        now = time.time()
+        results = {}
+        with self._connect() as conn:
+            # Stay well below the maximum number of SQLite host parameters
+            for i in range(0, len(contig_accessions), 500):
+                chunk = contig_accessions[i:i + 500]
+                rows = conn.execute(
+                    'SELECT contig_accession, chromosome_name, resolved_at FROM chromosome_name '
+                    'WHERE contig_accession IN ({})'.format(','.join('?' * len(chunk))), chunk
+                )
+                for contig_accession, chromosome_name, resolved_at in rows:
+                    if not self._is_expired(chromosome_name, resolved_at, now):
+                        # Negative results are stored as empty strings
+                        results[contig_accession] = (True, chromosome_name or None)
+        return results
+
+    def set_many(self, chromosome_names):
+        """Store a dict of contig accession to chromosome name. Use None or an empty string for a negative result."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT OR REPLACE INTO chromosome_name (contig_accession, chromosome_name, resolved_at) '
+                'VALUES (?, ?, ?)',
+                [(contig_accession, chromosome_name or '', now)
+                 for contig_accession, chromosome_name in chromosome_names.items()]
+            )
+            conn.execute('COMMIT')
+
+    def set(self, contig_accession, chromosome_name):
+        self.set_many({contig_accession: chromosome_name})
+
+    def get_chromosome_name_for_contig_accession(self, contig_accession):
+        """Cached version of contig_utils.get_chromosome_name_for_contig_accession"""
+        if is_wgs_accession_format(contig_accession):
+            return None
+        found, chromosome_name = self.get(contig_accession)
+        if not found:
+            # Failed requests raise so only the records without chromosome name are cached as negative results
+            chromosome_name = get_chromosome_name_for_contig_accession(contig_accession) or None
+            self.set(contig_accession, chromosome_name)
+        return chromosome_name
+
+    def get_chromosome_names_for_contig_accessions(self, contig_accessions, max_workers=10, tries=3):
+        """
+        Cached version of contig_utils.get_chromosome_names_for_contig_accessions: only the contigs missing from the
+        cache are sent to ENA. Accessions that failed to resolve are returned as errors and not cached. Contigs
+        without chromosome name are resolved to None.
+        """
+        contig_accessions = list(dict.fromkeys(contig_accessions))
+        cached = self.get_many(contig_accessions)
+        chromosome_names = {contig_accession: chromosome_name
+                            for contig_accession, (_, chromosome_name) in cached.items()}
+        errors = {}
+        missing_accessions = [contig_accession for contig_accession in contig_accessions
+                              if contig_accession not in cached]
+        if missing_accessions:
+            self.debug('%s contig accessions found in cache, %s to resolve',
+                       len(chromosome_names), len(missing_accessions))
+            resolved, errors = get_chromosome_names_for_contig_accessions(missing_accessions, max_workers=max_workers,
+                                                                          tries=tries)
+            # WGS contigs resolved to None without querying ENA are not cached
+            self.set_many({contig_accession: chromosome_name for contig_accession, chromosome_name in resolved.items()
+                           if chromosome_name is not None})
+            chromosome_names.update({contig_accession: chromosome_name or None
+                                     for contig_accession, chromosome_name in resolved.items()})
+        return chromosome_names, errors
+
+    def load_assembly_report(self, assembly_report_path):
+        """
+        Pre-load the cache with the chromosomes listed in an NCBI assembly report so they do not need to be
+        resolved through ENA. Returns the number of contigs loaded.
+        """
+        chromosome_names = {}
+        with open(assembly_report_path) as open_file:
+            headers = None
+            for line in open_file:
+                if line.lower().startswith("# sequence-name") and "sequence-role" in line.lower():
+                    headers = line.strip().split('\t')
+                    break
+            if headers is None:
+                raise ValueError(f'Could not find the header in assembly report {assembly_report_path}')
+            for record in DictReader(open_file, fieldnames=headers, dialect=excel_tab):
+                if (record.get('Sequence-Role') == 'assembled-molecule'
+                        and record.get('Assigned-Molecule-Location/Type') == 'Chromosome'
+                        and record.get('GenBank-Accn', 'na') != 'na'
+                        and record.get('Assigned-Molecule', 'na') != 'na'):
+                    chromosome_names[record['GenBank-Accn']] = record['Assigned-Molecule']
+        self.set_many(chromosome_names)
+        self.info('Loaded %s chromosome names from %s', len(chromosome_names), assembly_report_path)
+        return len(chromosome_names)
+
+    def export(self, output_path, include_negative=False):
+        """Write all the non-expired entries of the cache to a tab separated file. Returns the number of rows."""
+        now = time.time()
+        nb_rows = 0
+        with self._connect() as conn, open(output_path, 'w', newline='') as open_output:
+            writer = csv.writer(open_output, delimiter='\t')
+            writer.writerow(['contig_accession', 'chromosome_name'])
+            for contig_accession, chromosome_name, resolved_at in conn.execute(
+                    'SELECT contig_accession, chromosome_name, resolved_at FROM chromosome_name '
+                    'ORDER BY contig_accession'):
+                if self._is_expired(chromosome_name, resolved_at, now):
+                    continue
+                if chromosome_name or include_negative:
+                    writer.writerow([contig_accession, chromosome_name])
+                    nb_rows += 1
+        return nb_rows
@@ -13,8 +13,15 @@
 # limitations under the License.
 
 import re
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 from retry import retry
+from retry.api import retry_call
+
+from ebi_eva_common_pyutils.logger import logging_config as log_cfg
+
+logger = log_cfg.get_logger(__name__)
 
 
 # TODO: Might be a good idea to re-visit this after a production implementation
@@ -29,8 +36,18 @@ def resolve_contig_accession_to_chromosome_name(contig_accession, line_limit=100
     :param line_limit: number of lines to parse in the EMBL Flatfile result to find the chromosome before giving up
     :return: Chromosome name (ex: 12 when given an accession CM003032.1)
     """
+    return _resolve_contig_accession_to_chromosome_name(contig_accession, line_limit)
+
+
+def _resolve_contig_accession_to_chromosome_name(contig_accession, line_limit=100):
+    """Same as resolve_contig_accession_to_chromosome_name but without the retry so callers can set their own."""
     ENA_TEXT_API_URL = "https://www.ebi.ac.uk/ena/browser/api/text/{0}?lineLimit={1}&annotationOnly=true"
     response = requests.get(ENA_TEXT_API_URL.format(contig_accession, line_limit))
+    # Transient errors must not be mistaken for a record without chromosome name but an unknown accession is one
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    if response.status_code >= 400:
+        return ""
     response_lines = response.content.decode("utf-8").split("\n")
     num_lines = len(response_lines)
 
@@ -111,3 +128,46 @@ def get_chromosome_name_for_contig_accession(contig_accession):
         resolve_contig_accession_to_chromosome_name(contig_accession, 1000) or \
         resolve_contig_accession_to_chromosome_name(contig_accession, 10000) or \
         resolve_contig_accession_to_chromosome_name(contig_accession, 100000)
+
+
+def get_chromosome_names_for_contig_accessions(contig_accessions, max_workers=10, tries=3):
+    """
+    Given many Genbank contig accessions, get the corresponding chromosome names by querying ENA concurrently.
+    WGS accessions are not sent to ENA and are resolved to None like in get_chromosome_name_for_contig_accession.
+    Each accession is retried independently so a single failing accession does not hold back the others.
+
+    :param contig_accessions: iterable of Genbank contig accessions (ex: [CM003032.1, CM003033.1])
+    :param max_workers: maximum number of concurrent requests to ENA
+    :param tries: number of attempts for each request before giving up on an accession
+    :return: tuple of two dicts: contig accession to chromosome name and contig accession to the error raised
+    """
+    chromosome_names = {}
+    errors = {}
+    accessions_to_resolve = []
+    for contig_accession in dict.fromkeys(contig_accessions):
+        if is_wgs_accession_format(contig_accession):
+            chromosome_names[contig_accession] = None
+        else:
+            accessions_to_resolve.append(contig_accession)
+
+    def resolve(contig_accession):
+        chromosome_name = ""
+        for line_limit in (1000, 10000, 100000):
+            chromosome_name = retry_call(_resolve_contig_accession_to_chromosome_name,
+                                         fargs=(contig_accession, line_limit), tries=tries, delay=1, backoff=1.2,
+                                         jitter=(0, 1))
+            if chromosome_name:
+                break
+        return chromosome_name
+
+    if accessions_to_resolve:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {contig_accession: executor.submit(resolve, contig_accession)
+                       for contig_accession in accessions_to_resolve}
+            for contig_accession, future in futures.items():
+                try:
+                    chromosome_names[contig_accession] = future.result()
+                except Exception as e:
+                    logger.warning(f'Failed to resolve chromosome name for {contig_accession}: {str(e)}')
+                    errors[contig_accession] = e
+    return chromosome_names, errors
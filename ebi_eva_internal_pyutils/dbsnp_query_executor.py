@@ -0,0 +1,144 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ebi_eva_common_pyutils.logger import AppLogger
+from ebi_eva_internal_pyutils.metadata_utils import get_dbsnp_connect_kwargs_for_species
+from ebi_eva_internal_pyutils.pg_connection_pool import PGConnectionPool
+from ebi_eva_internal_pyutils.pg_utils import iter_result_batches_for_query
+
+# Outcome of the query on one species database: error is set if it failed
+SpeciesQueryReport = namedtuple('SpeciesQueryReport', ['database_name', 'pg_host', 'pg_port', 'rows', 'seconds',
+                                                       'error'])
+
+_DONE = object()
+
+
+class DbsnpQueryExecutor(AppLogger):
+    """
+    Run the same query on the dbSNP mirror database of many species concurrently.
+    species_info is a list of dicts as returned by metadata_utils.get_species_info. Several databases are hosted on
+    the same PostgreSQL instance so at most max_connections_per_host queries run on each host at any time.
+    The rows are streamed from server-side cursors and yielded as they arrive, tagged with the species database
+    name. A failure on one database is recorded in its report and does not stop the others. The connections are
+    opened in pools owned by each run, which are closed when it ends.
+    The species tables live in a schema named after the species database name so the query can also be a function
+    taking the species dict and returning the query for this species.
+    """
+
+    def __init__(self, species_info, max_workers=20, max_connections_per_host=4, batch_size=2000, queue_size=50):
+        self.species_info = list(species_info)
+        self.max_workers = max_workers
+        self.max_connections_per_host = max_connections_per_host
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.reports = {}
+
+    def _get_pool(self, species_db_info, pools, pools_lock):
+        """Pool of connections to the dbSNP database of the species, created on first use and shared by the run"""
+        connect_kwargs = get_dbsnp_connect_kwargs_for_species(species_db_info)
+        key = (connect_kwargs['host'], connect_kwargs['port'], connect_kwargs['dbname'])
+        with pools_lock:
+            if key not in pools:
+                pools[key] = PGConnectionPool(max_size=self.max_connections_per_host, **connect_kwargs)
+            return pools[key]
+
+    def _query_species(self, species_db_info, query, host_slots, pools, pools_lock, results, stop):
+        database_name = species_db_info.get('database_name')
+        host = (species_db_info.get('pg_host'), species_db_info.get('pg_port'))
+        nb_rows = 0
+        error = None
+        start_time = time.time()
+        try:
+            with host_slots[host]:
+                # The consumer might have stopped reading while waiting for the host
+                if stop.is_set():
+                    return
+                start_time = time.time()
+                species_query = query(species_db_info) if callable(query) else query
+                with self._get_pool(species_db_info, pools, pools_lock).connection() as pg_conn:
+                    for rows in iter_result_batches_for_query(pg_conn, species_query, batch_size=self.batch_size):
+                        if not self._put(results, (database_name, rows), stop):
+                            return
+                        nb_rows += len(rows)
+        except Exception as e:
+            self.error('Query failed on %s: %s', database_name, str(e))
+            error = e
+        finally:
+            self.reports[database_name] = SpeciesQueryReport(database_name, host[0], host[1], nb_rows,
+                                                             time.time() - start_time, error)
+            self._put(results, (database_name, _DONE), stop)
+
+    @staticmethod
+    def _put(results, item, stop):
+        """Wait for space in the queue unless the consumer stopped reading. Returns False if it did."""
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self, query):
+        """
+        Run the query on all the species databases and yield tuples (database_name, row) as they arrive.
+        The per-database reports are available in the reports attribute, keyed by database name.
+        """
+        self.reports = {}
+        host_slots = {}
+        for species_db_info in self.species_info:
+            host = (species_db_info.get('pg_host'), species_db_info.get('pg_port'))
+            host_slots.setdefault(host, threading.BoundedSemaphore(self.max_connections_per_host))
+        pools = {}
+        pools_lock = threading.Lock()
+        results = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        remaining = len(self.species_info)
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._query_species, species_db_info, query, host_slots, pools, pools_lock,
+                                       results, stop)
+                       for species_db_info in self.species_info]
+            try:
+                while remaining:
+                    try:
+                        database_name, rows = results.get(timeout=1)
+                    except queue.Empty:
+                        # Every worker reports its end so this only happens if one died before it could
+                        if all(future.done() for future in futures) and results.empty():
+                            raise RuntimeError(f'{remaining} species queries ended without reporting their results')
+                        continue
+                    if rows is _DONE:
+                        remaining -= 1
+                        continue
+                    for row in rows:
+                        yield database_name, row
+            finally:
+                # Do not start the remaining queries and release the workers waiting on a full queue if the results
+                # are not all consumed
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                # Close the connections of the run once the workers have stopped using them
+                executor.shutdown(wait=True)
+                for pool in pools.values():
+                    pool.close()
+        failed = [report.database_name for report in self.reports.values() if report.error]
+        self.info('Query run on %s databases in %.1fs, %s failed%s', len(self.species_info), time.time() - start_time,
+                  len(failed), ': ' + ', '.join(map(str, failed)) if failed else '')
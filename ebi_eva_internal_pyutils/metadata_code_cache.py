@@ -0,0 +1,114 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+from collections import Counter
+
+from ebi_eva_common_pyutils.logger import AppLogger
+from ebi_eva_internal_pyutils.pg_utils import get_all_results_for_query
+
+TAXONOMY = 'taxonomy'
+ASSEMBLY = 'assembly'
+
+_preload_queries = {
+    TAXONOMY: 'SELECT DISTINCT taxonomy_id, taxonomy_code FROM taxonomy',
+    ASSEMBLY: 'SELECT DISTINCT assembly_accession, assembly_code FROM assembly'
+}
+
+
+class MetadataCodeCache(AppLogger):
+    """
+    In-process cache of the taxonomy codes and assembly codes registered in the metadata database.
+    Codes found in the database are remembered once looked up. After preload, the whole tables are in memory and
+    taxonomies or assemblies without a code are also answered without querying the database.
+    Entries are kept separately for each database, identified by the connection's dsn.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        # (database, kind) -> {key: code}
+        self._codes = {}
+        # (database, kind) loaded completely by preload
+        self._complete = set()
+        # (database, kind) -> keys with several codes, that are left for the database query to report
+        self._ambiguous = {}
+        self.hits = Counter()
+        self.misses = Counter()
+
+    @staticmethod
+    def _database(metadata_connection_handle):
+        return getattr(metadata_connection_handle, 'dsn', None) or id(metadata_connection_handle)
+
+    def get(self, metadata_connection_handle, kind, key):
+        """Return a tuple (found, code). A code of None means that there is no code for this key in the database."""
+        cache_key = (self._database(metadata_connection_handle), kind)
+        key = str(key)
+        with self._lock:
+            codes = self._codes.get(cache_key, {})
+            if self.enabled and key not in self._ambiguous.get(cache_key, ()):
+                if key in codes:
+                    self.hits[kind] += 1
+                    return True, codes[key]
+                if cache_key in self._complete:
+                    self.hits[kind] += 1
+                    return True, None
+            self.misses[kind] += 1
+            return False, None
+
+    def set(self, metadata_connection_handle, kind, key, code):
+        if not self.enabled or code is None:
+            return
+        with self._lock:
+            self._codes.setdefault((self._database(metadata_connection_handle), kind), {})[str(key)] = code
+
+    def invalidate(self, metadata_connection_handle, kind, key):
+        """Forget the code of a key so that the next lookup queries the database."""
+        cache_key = (self._database(metadata_connection_handle), kind)
+        with self._lock:
+            self._codes.get(cache_key, {}).pop(str(key), None)
+            # The key might now be in the database so the absence of the other keys cannot be trusted either
+            self._complete.discard(cache_key)
+
+    def preload(self, metadata_connection_handle):
+        """Load all the taxonomy codes and assembly codes with one query per table."""
+        database = self._database(metadata_connection_handle)
+        for kind, query in _preload_queries.items():
+            codes = {}
+            ambiguous = set()
+            for key, code in get_all_results_for_query(metadata_connection_handle, query):
+                key = str(key)
+                if key in codes and codes[key] != code:
+                    ambiguous.add(key)
+                codes[key] = code
+            with self._lock:
+                self._codes[(database, kind)] = codes
+                self._ambiguous[(database, kind)] = ambiguous
+                self._complete.add((database, kind))
+            self.info('Preloaded %s %s codes', len(codes), kind)
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+            self._complete.clear()
+            self._ambiguous.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self):
+        """Number of hits and misses for each kind of code"""
+        return {kind: {'hits': self.hits[kind], 'misses': self.misses[kind]} for kind in (TAXONOMY, ASSEMBLY)}
+
+
+# Shared by the metadata_utils lookups
+metadata_code_cache = MetadataCodeCache()
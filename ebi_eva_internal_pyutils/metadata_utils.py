@@ -13,16 +13,22 @@
 # limitations under the License.
 import datetime
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlsplit
 
 import psycopg2
+from psycopg2.extras import execute_values
 
 from ebi_eva_common_pyutils.assembly_utils import is_patch_assembly
 from ebi_eva_internal_pyutils.config_utils import get_metadata_creds_for_profile
-from ebi_eva_common_pyutils.ena_utils import get_scientific_name_and_common_name
+from ebi_eva_common_pyutils.ena_utils import get_scientific_name_and_common_name, ena_record_cache
 from ebi_eva_common_pyutils.logger import logging_config
 from ebi_eva_common_pyutils.ncbi_utils import get_ncbi_assembly_name_from_term
-from ebi_eva_internal_pyutils.pg_utils import get_result_cursor, get_all_results_for_query, execute_query
+from ebi_eva_internal_pyutils.metadata_code_cache import metadata_code_cache, TAXONOMY, ASSEMBLY
+from ebi_eva_internal_pyutils.pg_connection_pool import get_pg_connection_pool
+from ebi_eva_internal_pyutils.pg_utils import get_result_cursor, get_all_results_for_query, execute_query, \
+    pooled_pg_connection_handle, get_all_results_for_prepared_query
 from ebi_eva_common_pyutils.taxonomy.taxonomy import get_scientific_name_from_ensembl
 
 logger = logging_config.get_logger(__name__)
@@ -34,6 +40,19 @@ def get_metadata_connection_handle(profile, settings_xml_file):
     return psycopg2.connect(urlsplit(pg_url).path, user=pg_user, password=pg_pass)
 
 
+def pooled_metadata_connection_handle(profile, settings_xml_file, max_size=10):
+    """
+    Same as get_metadata_connection_handle but check out the connection from a process-wide pool for this profile.
+    The settings file is only read when the pool is created. Use as a context manager: the connection is returned to
+    the pool on exit.
+    """
+    def connect_kwargs():
+        pg_url, pg_user, pg_pass = get_metadata_creds_for_profile(profile, settings_xml_file)
+        return {'dsn': urlsplit(pg_url).path, 'user': pg_user, 'password': pg_pass}
+    pool = get_pg_connection_pool(('metadata', profile, settings_xml_file), connect_kwargs, max_size=max_size)
+    return pool.connection()
+
+
 def get_db_conn_for_species(species_db_info):
     db_name = "dbsnp_{0}".format(species_db_info["dbsnp_build"])
     pg_conn = psycopg2.connect("dbname='{0}' user='{1}' host='{2}'  port={3}".
@@ -41,6 +60,23 @@ def get_db_conn_for_species(species_db_info):
     return pg_conn
 
 
+def get_dbsnp_connect_kwargs_for_species(species_db_info):
+    """Keyword arguments of psycopg2.connect for the dbSNP mirror database of the species."""
+    return {'dbname': "dbsnp_{0}".format(species_db_info["dbsnp_build"]), 'user': 'dbsnp',
+            'host': species_db_info["pg_host"], 'port': species_db_info["pg_port"]}
+
+
+def pooled_db_conn_for_species(species_db_info, max_size=10):
+    """
+    Same as get_db_conn_for_species but check out the connection from a process-wide pool for the dbSNP host.
+    Use as a context manager: the connection is returned to the pool on exit.
+    """
+    connect_kwargs = get_dbsnp_connect_kwargs_for_species(species_db_info)
+    pool = get_pg_connection_pool(('dbsnp', connect_kwargs['host'], connect_kwargs['port'], connect_kwargs['dbname']),
+                                  connect_kwargs, max_size=max_size)
+    return pool.connection()
+
+
 def get_species_info(metadata_connection_handle, dbsnp_species_name="all"):
     get_species_info_query = "SELECT DISTINCT database_name, scientific_name, dbsnp_build, pg_host, pg_port " \
                              "FROM dbsnp_ensembl_species.import_progress a " \
@@ -60,40 +96,82 @@ def get_species_info(metadata_connection_handle, dbsnp_species_name="all"):
 
 # Get connection information for each Postgres instance of the dbSNP mirror
 def get_dbsnp_mirror_db_info(pg_metadata_dbname, pg_metadata_user, pg_metadata_host):
-    with psycopg2.connect("dbname='{0}' user='{1}' host='{2}'".format(pg_metadata_dbname, pg_metadata_user,
-                                                                      pg_metadata_host)) as pg_conn:
+    with pooled_pg_connection_handle(pg_metadata_dbname, pg_metadata_user, pg_metadata_host) as pg_conn:
         dbsnp_mirror_db_info_query = "SELECT * FROM dbsnp_ensembl_species.dbsnp_build_instance"
         dbsnp_mirror_db_info = [{"dbsnp_build": result[0], "pg_host": result[1], "pg_port": result[2]}
                                 for result in get_all_results_for_query(pg_conn, dbsnp_mirror_db_info_query)]
     return dbsnp_mirror_db_info
 
 
+# Hot path lookups, prepared once per connection. The ANY($1) forms take a list so that many values are looked up in
+# a single round trip and single lookups share the same plan.
+_TAXONOMY_CODES_QUERY = 'SELECT DISTINCT t.taxonomy_id, t.taxonomy_code FROM taxonomy t WHERE t.taxonomy_id = ANY($1)'
+_ASSEMBLY_CODES_QUERY = ('SELECT DISTINCT assembly_accession, assembly_code FROM assembly '
+                         'WHERE assembly_accession = ANY($1)')
+_ASSEMBLY_SETS_QUERY = ('SELECT acc.assembly_accession, asm.taxonomy_id, acc.assembly_set_id '
+                        'FROM evapro.accessioned_assembly acc '
+                        'JOIN assembly_set asm on acc.assembly_set_id = asm.assembly_set_id '
+                        'WHERE acc.assembly_accession = ANY($1)')
+_TAXONOMIES_QUERY = 'SELECT taxonomy_id FROM evapro.taxonomy WHERE taxonomy_id = ANY($1)'
+
+
+def _get_codes_from_metadata(metadata_connection_handle, kind, keys, statement_name, query, convert_key):
+    codes = {}
+    missing_keys = []
+    for key in dict.fromkeys(keys):
+        found, code = metadata_code_cache.get(metadata_connection_handle, kind, key)
+        if not found:
+            missing_keys.append(key)
+        elif code:
+            codes[key] = code
+    if missing_keys:
+        rows = get_all_results_for_prepared_query(metadata_connection_handle, statement_name, query,
+                                                  ([convert_key(key) for key in missing_keys],))
+        options_per_key = {}
+        for key, code in rows:
+            options_per_key.setdefault(str(key), []).append(code)
+        for key in missing_keys:
+            options = options_per_key.get(str(key), [])
+            if len(options) > 1:
+                raise ValueError(f'More than one possible code for {kind} {key} found: {", ".join(options)}')
+            if options:
+                codes[key] = options[0]
+                metadata_code_cache.set(metadata_connection_handle, kind, key, options[0])
+    return codes
+
+
+def get_taxonomy_codes_from_metadata(metadata_connection_handle, taxonomies):
+    """
+    Batch version of get_taxonomy_code_from_metadata returning a dict of taxonomy id to taxonomy code for the
+    taxonomies that have one. The taxonomies that are not cached are retrieved with a single query.
+    """
+    return _get_codes_from_metadata(metadata_connection_handle, TAXONOMY, taxonomies, 'metadata_taxonomy_codes',
+                                    _TAXONOMY_CODES_QUERY, int)
+
+
 def get_taxonomy_code_from_metadata(metadata_connection_handle, taxonomy):
     """
     Retrieve an existing taxonomy code registered in the metadata database.
+    The codes are cached in memory, see metadata_code_cache.
+    """
+    return get_taxonomy_codes_from_metadata(metadata_connection_handle, [taxonomy]).get(taxonomy)
+
+
+def get_assembly_codes_from_metadata(metadata_connection_handle, assemblies):
+    """
+    Batch version of get_assembly_code_from_metadata returning a dict of assembly accession to assembly code for the
+    assemblies that have one. The assemblies that are not cached are retrieved with a single query.
     """
-    query = f"SELECT DISTINCT t.taxonomy_code FROM taxonomy t WHERE t.taxonomy_id = {taxonomy}"
-    rows = get_all_results_for_query(metadata_connection_handle, query)
-    if len(rows) == 0:
-        return None
-    elif len(rows) > 1:
-        options = ', '.join(rows)
-        raise ValueError(f'More than one possible code for taxonomy {taxonomy} found: {options}')
-    return rows[0][0]
+    return _get_codes_from_metadata(metadata_connection_handle, ASSEMBLY, assemblies, 'metadata_assembly_codes',
+                                    _ASSEMBLY_CODES_QUERY, str)
 
 
 def get_assembly_code_from_metadata(metadata_connection_handle, assembly):
     """
     Retrieve an existing assembly code registered in the metadata database.
+    The codes are cached in memory, see metadata_code_cache.
     """
-    query = f"SELECT DISTINCT assembly_code FROM assembly WHERE assembly_accession='{assembly}'"
-    rows = get_all_results_for_query(metadata_connection_handle, query)
-    if len(rows) == 0:
-        return None
-    elif len(rows) > 1:
-        options = ', '.join([row for row, in rows])
-        raise ValueError(f'More than one possible code for assembly {assembly} found: {options}')
-    return rows[0][0]
+    return get_assembly_codes_from_metadata(metadata_connection_handle, [assembly]).get(assembly)
 
 
 def build_variant_warehouse_database_name(taxonomy_code, assembly_code):
@@ -121,13 +199,17 @@ def get_assembly_code(metadata_connection_handle, assembly, ncbi_api_key=None):
     assembly_code = get_assembly_code_from_metadata(metadata_connection_handle, assembly)
     if not assembly_code:
         assembly_name = get_ncbi_assembly_name_from_term(assembly, api_key=ncbi_api_key)
-        # If the assembly is a patch assembly ex: GRCh37.p8, drop the trailing patch i.e., just return grch37
-        if is_patch_assembly(assembly):
-            assembly_name = re.sub('\\.p[0-9]+$', '', assembly_name.lower())
-        assembly_code = re.sub('[^0-9a-zA-Z]+', '', assembly_name.lower())
+        assembly_code = build_assembly_code(assembly, assembly_name)
     return assembly_code
 
 
+def build_assembly_code(assembly, assembly_name):
+    # If the assembly is a patch assembly ex: GRCh37.p8, drop the trailing patch i.e., just return grch37
+    if is_patch_assembly(assembly):
+        assembly_name = re.sub('\\.p[0-9]+$', '', assembly_name.lower())
+    return re.sub('[^0-9a-zA-Z]+', '', assembly_name.lower())
+
+
 def build_taxonomy_code(scientific_name):
     """Given a scientific name like "Zea mays", the corresponding taxonomy code should be zmays"""
     return scientific_name[0].lower() + re.sub('[^0-9a-zA-Z]+', '', ''.join(scientific_name.split()[1:])).lower()
@@ -178,6 +260,106 @@ def insert_new_assembly_and_taxonomy(metadata_connection_handle, assembly_access
     metadata_connection_handle.commit()
 
 
+def insert_new_assemblies_and_taxonomies(metadata_connection_handle, assemblies_and_taxonomies, eva_species_names=None,
+                                         in_accessioning=True, ncbi_api_key=None, max_workers=5):
+    """
+    Batch version of insert_new_assembly_and_taxonomy that adds many assemblies and their taxonomies to EVAPRO.
+    The assemblies and taxonomies already present are retrieved with one query each and the names are only
+    resolved in NCBI and ENA for the ones that are missing, concurrently. All the rows are inserted in a single
+    transaction.
+
+    :param metadata_connection_handle: Metadata DB connection
+    :param assemblies_and_taxonomies: iterable of tuples of assembly accession and taxonomy id
+    :param eva_species_names: optional dict of taxonomy id to EVA species name for the taxonomies to add
+    :param in_accessioning: Flag that these assemblies are in the accessioning data store.
+    :param ncbi_api_key: optional NCBI api key, which raises the eutils rate limit from 3 to 10 requests per second
+    :param max_workers: number of assemblies and taxonomies resolved concurrently. The eutils requests of all the
+    workers share the rate limit of the process so more workers do not send more requests per second to NCBI.
+    :return: dict of (assembly accession, taxonomy id) to assembly_set_id
+    """
+    assemblies_and_taxonomies = list(dict.fromkeys((assembly, int(taxonomy))
+                                                   for assembly, taxonomy in assemblies_and_taxonomies))
+    eva_species_names = eva_species_names or {}
+    assembly_accessions = list(dict.fromkeys(assembly for assembly, _ in assemblies_and_taxonomies))
+    taxonomy_ids = list(dict.fromkeys(taxonomy for _, taxonomy in assemblies_and_taxonomies))
+
+    assembly_set_ids = get_assembly_sets_from_metadata(metadata_connection_handle, assembly_accessions)
+    existing_taxonomies = get_taxonomies_in_evapro(metadata_connection_handle, taxonomy_ids)
+    existing_assembly_codes = get_assembly_codes_from_metadata(metadata_connection_handle, assembly_accessions)
+
+    missing = [(assembly, taxonomy) for assembly, taxonomy in assemblies_and_taxonomies
+               if (assembly, taxonomy) not in assembly_set_ids]
+    missing_assemblies = list(dict.fromkeys(assembly for assembly, _ in missing))
+    missing_taxonomies = list(dict.fromkeys(taxonomy for _, taxonomy in missing
+                                            if taxonomy not in existing_taxonomies))
+    logger.info(f'{len(assemblies_and_taxonomies) - len(missing)} assemblies already in EVAPRO, '
+                f'{len(missing)} to add with {len(missing_taxonomies)} new taxonomies')
+
+    # Resolve the names of the missing assemblies and taxonomies concurrently
+    def resolve_assembly(assembly):
+        assembly_name = get_ncbi_assembly_name_from_term(assembly, api_key=ncbi_api_key)
+        assembly_code = existing_assembly_codes.get(assembly) or build_assembly_code(assembly, assembly_name)
+        return assembly_name, assembly_code
+
+    # ENA records of the patch counts and taxonomy names are retrieved in batches
+    ena_record_cache.prefetch(missing_assemblies, 'ASSEMBLY')
+    ena_record_cache.prefetch(missing_taxonomies, 'taxon')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        assembly_names_and_codes = dict(zip(missing_assemblies, executor.map(resolve_assembly, missing_assemblies)))
+        taxonomy_names = dict(zip(missing_taxonomies,
+                                  executor.map(get_scientific_name_and_common_name, missing_taxonomies)))
+
+    taxonomy_rows = []
+    for taxonomy in missing_taxonomies:
+        scientific_name, common_name = taxonomy_names[taxonomy]
+        # If a common name cannot be found then we should use the scientific name
+        eva_species_name = eva_species_names.get(taxonomy) or common_name or scientific_name
+        taxonomy_rows.append((taxonomy, common_name, scientific_name, build_taxonomy_code(scientific_name),
+                              eva_species_name))
+    try:
+        with metadata_connection_handle.cursor() as cursor:
+            if taxonomy_rows:
+                execute_values(cursor, 'INSERT INTO evapro.taxonomy(taxonomy_id, common_name, scientific_name, '
+                                       'taxonomy_code, eva_name) VALUES %s', taxonomy_rows)
+            if missing:
+                # RETURNING does not guarantee the order of the values so the ids are matched on the inserted columns
+                inserted_ids = defaultdict(list)
+                for assembly_set_id, *inserted_row in execute_values(
+                        cursor, 'INSERT INTO evapro.assembly_set(taxonomy_id, assembly_name, assembly_code) VALUES %s '
+                                'RETURNING assembly_set_id, taxonomy_id, assembly_name, assembly_code',
+                        [(taxonomy,) + assembly_names_and_codes[assembly] for assembly, taxonomy in missing],
+                        fetch=True):
+                    inserted_ids[tuple(inserted_row)].append(assembly_set_id)
+                for assembly, taxonomy in missing:
+                    assembly_set_ids[(assembly, taxonomy)] = \
+                        inserted_ids[(taxonomy,) + assembly_names_and_codes[assembly]].pop()
+                execute_values(
+                    cursor, 'INSERT INTO evapro.accessioned_assembly('
+                            'assembly_set_id, assembly_accession, assembly_chain, assembly_version) VALUES %s',
+                    [(assembly_set_ids[(assembly, taxonomy)], assembly, assembly.split('.')[0], assembly.split('.')[1])
+                     for assembly, taxonomy in missing]
+                )
+            # Only insert assembly accessions which are NOT already in the assembly_accessioning_store_status table
+            execute_values(
+                cursor, 'INSERT INTO evapro.assembly_accessioning_store_status '
+                        'SELECT * FROM (VALUES %s) AS temp(assembly_accession, loaded) '
+                        'WHERE assembly_accession NOT IN '
+                        '(SELECT assembly_accession FROM evapro.assembly_accessioning_store_status)',
+                [(assembly, bool(in_accessioning)) for assembly in assembly_accessions]
+            )
+        metadata_connection_handle.commit()
+    except Exception:
+        metadata_connection_handle.rollback()
+        raise
+    for taxonomy in missing_taxonomies:
+        metadata_code_cache.invalidate(metadata_connection_handle, TAXONOMY, taxonomy)
+        logger.info('New taxonomy {} added'.format(taxonomy))
+    for assembly in missing_assemblies:
+        metadata_code_cache.invalidate(metadata_connection_handle, ASSEMBLY, assembly)
+    logger.info(f'{len(missing)} new assemblies added')
+    return {pair: assembly_set_ids[pair] for pair in assemblies_and_taxonomies}
+
+
 def ensure_taxonomy_is_in_evapro(metadata_connection_handle, taxonomy, eva_species_name=None):
     if is_taxonomy_in_evapro(metadata_connection_handle, taxonomy):
         logger.debug('Taxonomy {} is already in the database'.format(taxonomy))
@@ -207,6 +389,7 @@ def insert_assembly_in_evapro(metadata_connection_handle, taxonomy_id, assembly_
                 'assembly_set_id, assembly_accession, assembly_chain, assembly_version) VALUES (%s,%s,%s,%s)',
                 (assembly_set_id, assembly_accession, assembly_chain, assembly_version))
 
+    metadata_code_cache.invalidate(metadata_connection_handle, ASSEMBLY, assembly_accession)
     logger.info('New assembly added with assembly_set_id: {0}'.format(assembly_set_id))
     return assembly_set_id
 
@@ -225,26 +408,33 @@ def update_accessioning_status(metadata_connection_handle, assembly_accession, i
     cur.execute(assembly_accessioning_store_insert_query)
 
 
+def get_assembly_sets_from_metadata(metadata_connection_handle, assembly_accessions):
+    """Return a dict of (assembly accession, taxonomy id) to assembly_set_id for the provided assembly accessions."""
+    rows = get_all_results_for_prepared_query(metadata_connection_handle, 'metadata_assembly_sets',
+                                              _ASSEMBLY_SETS_QUERY, (list(assembly_accessions),))
+    assembly_set_ids = {}
+    for assembly_accession, taxonomy, assembly_set_id in rows:
+        if assembly_set_ids.get((assembly_accession, taxonomy), assembly_set_id) != assembly_set_id:
+            raise ValueError('Inconsistent database state: several assembly_set_ids for the same taxonomy ({}) and '
+                             'assembly accession ({})'.format(taxonomy, assembly_accession))
+        assembly_set_ids[(assembly_accession, taxonomy)] = assembly_set_id
+    return assembly_set_ids
+
+
 def get_assembly_set_from_metadata(metadata_connection_handle, taxonomy, assembly_accession):
-    query = (f"SELECT acc.assembly_set_id "
-             f"FROM evapro.accessioned_assembly acc "
-             f"JOIN assembly_set asm on acc.assembly_set_id = asm.assembly_set_id "
-             f"WHERE assembly_accession='{assembly_accession}' AND taxonomy_id={taxonomy}")
-    rows = get_all_results_for_query(metadata_connection_handle, query)
-
-    if len(rows) == 1:
-        return rows[0][0]
-    elif len(rows) == 0:
-        return None
-    else:
-        raise ValueError('Inconsistent database state: several assembly_set_ids for the same taxonomy ({}) and '
-                         'assembly accession ({}): {}'.format(taxonomy, assembly_accession, rows))
+    assembly_set_ids = get_assembly_sets_from_metadata(metadata_connection_handle, [assembly_accession])
+    return assembly_set_ids.get((assembly_accession, int(taxonomy)))
+
+
+def get_taxonomies_in_evapro(metadata_connection_handle, taxonomy_ids):
+    """Return the set of the provided taxonomy ids that are in EVAPRO."""
+    rows = get_all_results_for_prepared_query(metadata_connection_handle, 'metadata_taxonomies', _TAXONOMIES_QUERY,
+                                              ([int(taxonomy_id) for taxonomy_id in taxonomy_ids],))
+    return {taxonomy_id for taxonomy_id, in rows}
 
 
 def is_taxonomy_in_evapro(metadata_connection_handle, taxonomy_id):
-    taxonomy_query = 'SELECT taxonomy_id FROM evapro.taxonomy WHERE taxonomy_id={}'.format(taxonomy_id)
-    taxonomy_ids_in_evapro = get_all_results_for_query(metadata_connection_handle, taxonomy_query)
-    return len(taxonomy_ids_in_evapro) > 0
+    return len(get_taxonomies_in_evapro(metadata_connection_handle, [taxonomy_id])) > 0
 
 
 def insert_taxonomy(metadata_connection_handle, taxonomy_id, scientific_name, common_name, taxonomy_code, eva_species_name):
@@ -255,6 +445,7 @@ def insert_taxonomy(metadata_connection_handle, taxonomy_id, scientific_name, co
     cur.execute('INSERT INTO evapro.taxonomy(taxonomy_id, common_name, scientific_name, taxonomy_code, eva_name) '
                 'VALUES (%s, %s, %s, %s, %s)',
                 (taxonomy_id, common_name, scientific_name, taxonomy_code, eva_species_name))
+    metadata_code_cache.invalidate(metadata_connection_handle, TAXONOMY, taxonomy_id)
     logger.info('New taxonomy {} added'.format(taxonomy_id))
 
 
@@ -0,0 +1,172 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+
+class PGConnectionPool(AppLogger):
+    """
+    Thread-safe pool of connections to a single PostgreSQL database. The connection arguments are the ones accepted
+    by psycopg2.connect.
+    Connections are only opened when needed and at most max_size are open at any time: checking out a connection
+    when they are all in use waits for one to be returned, for up to checkout_timeout seconds.
+    Unlike psycopg2's ThreadedConnectionPool, which closes the connections returned above its minimum size and
+    raises when it is exhausted, all the returned connections are kept open for reuse.
+    Connections that have been idle for more than health_check_interval seconds are tested before being handed out
+    and replaced if they are no longer usable.
+    """
+
+    def __init__(self, *connect_args, max_size=10, checkout_timeout=None, health_check_interval=30,
+                 **connect_kwargs):
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_args = connect_args
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        # Connections ready to be checked out with the time they were returned to the pool
+        self._idle = deque()
+        self._in_use = set()
+        self.closed = False
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        # Connections used recently are not tested
+        if time.time() - returned_at < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            self.warning('Discarding unusable connection: %s', str(e).strip())
+            return False
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+        if conn is None:
+            conn = psycopg2.connect(*self._connect_args, **self._connect_kwargs)
+        elif not self._is_healthy(conn, returned_at):
+            self._close(conn)
+            conn = psycopg2.connect(*self._connect_args, **self._connect_kwargs)
+        with self._lock:
+            self._in_use.add(conn)
+        return conn
+
+    def getconn(self):
+        """Check out a connection. It must be given back with putconn."""
+        if self.closed:
+            raise PoolError('Connection pool is closed')
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise PoolError(f'No connection available after {self.checkout_timeout} seconds')
+        try:
+            return self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def putconn(self, conn):
+        """Return a connection to the pool, rolling back any transaction left open."""
+        with self._lock:
+            if conn not in self._in_use:
+                raise PoolError('Trying to return a connection that was not checked out from this pool')
+            self._in_use.remove(conn)
+        try:
+            if conn.closed:
+                return
+            if self.closed:
+                self._close(conn)
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.time()))
+        except psycopg2.Error:
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection and returns it to the pool on exit. The transaction is committed
+        if the block succeeds and rolled back if it raises.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+            if not conn.closed:
+                conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Close the idle connections. The ones checked out are closed when they are returned."""
+        with self._lock:
+            self.closed = True
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pg_connection_pool(key, connect_kwargs, max_size=10, **pool_kwargs):
+    """
+    Return the process-wide pool registered under key (i.e. a profile or host), creating it if it does not exist yet.
+    connect_kwargs are the keyword arguments of psycopg2.connect or a function returning them, which is only called
+    when the pool is created so that the credentials are not resolved again for each checkout.
+    """
+    with _pools_lock:
+        if key not in _pools:
+            if callable(connect_kwargs):
+                connect_kwargs = connect_kwargs()
+            _pools[key] = PGConnectionPool(max_size=max_size, **pool_kwargs, **connect_kwargs)
+        return _pools[key]
+
+
+def close_pg_connection_pools():
+    """Close all the connections of all the process-wide pools."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -13,8 +13,20 @@
 # limitations under the License.
 
 import logging
+import threading
+import time
+import uuid
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, NamedTupleCursor
 from ebi_eva_common_pyutils.logger import logging_config as log_cfg
+from ebi_eva_internal_pyutils.pg_connection_pool import get_pg_connection_pool
+from ebi_eva_internal_pyutils.query_metrics import query_metrics
 
 logger = log_cfg.get_logger(__name__)
 
@@ -25,21 +37,104 @@ def get_all_results_for_query(pg_conn, query):
     return results
 
 
+# Names of the statements prepared in the session of each connection with the lock guarding their preparation
+_prepared_statements = weakref.WeakKeyDictionary()
+_prepared_statements_lock = threading.Lock()
+
+
+def get_all_results_for_prepared_query(pg_conn, name, query, params=()):
+    """
+    Execute a query as a server-side prepared statement and return all its results.
+    The query, which uses $1, $2... placeholders for the params, is prepared under name the first time it is used on
+    a connection so that PostgreSQL parses and plans it only once per session. Arrays can be passed as a list
+    parameter to look up many values in one query with "= ANY($1)".
+    """
+    with _prepared_statements_lock:
+        prepared, connection_lock = _prepared_statements.setdefault(pg_conn, (set(), threading.Lock()))
+    with pg_conn.cursor() as pg_cursor:
+        # Threads sharing the connection must not both prepare the statement
+        with connection_lock:
+            if name not in prepared:
+                pg_cursor.execute(f'PREPARE {name} AS {query}')
+                prepared.add(name)
+        if params:
+            statement = 'EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params)))
+        else:
+            statement, params = f'EXECUTE {name}', None
+        with query_metrics.timed(pg_conn, query, params, explain_query=statement) as measure:
+            pg_cursor.execute(statement, params)
+            results = pg_cursor.fetchall()
+            measure['rows'] = len(results)
+        return results
+
+
 def execute_query(pg_conn, query):
     with get_result_cursor(pg_conn, query) as _:
         pg_conn.commit()
 
 
-def get_result_cursor(pg_conn, query):
-    pg_cursor = pg_conn.cursor()
-    pg_cursor.execute(query)
+# Cursor classes returning each row in the requested type
+_cursor_factories = {'tuple': None, 'dict': RealDictCursor, 'namedtuple': NamedTupleCursor}
+
+
+def get_result_cursor(pg_conn, query, server_side=False, itersize=2000, row_type='tuple'):
+    """
+    Execute the query and return the cursor to read its results. The execution time is recorded in query_metrics.
+    With server_side set, the results are kept in a named cursor on the server and retrieved itersize rows at a time
+    while the cursor is iterated, instead of being all transferred when the query is executed.
+    row_type can be 'tuple', 'dict' or 'namedtuple'.
+    """
+    if row_type not in _cursor_factories:
+        raise ValueError(f'Unknown row type {row_type}: should be one of {", ".join(_cursor_factories)}')
+    if server_side:
+        # Named cursors only exist within a transaction unless they are declared WITH HOLD
+        pg_cursor = pg_conn.cursor(name=f'pg_utils_{uuid.uuid4().hex}', cursor_factory=_cursor_factories[row_type],
+                                   withhold=pg_conn.autocommit)
+        pg_cursor.itersize = itersize
+    else:
+        pg_cursor = pg_conn.cursor(cursor_factory=_cursor_factories[row_type])
+    with query_metrics.timed(pg_conn, query) as measure:
+        pg_cursor.execute(query)
+        # Server-side cursors only know the number of rows once they are read
+        if not server_side and isinstance(pg_cursor.rowcount, int) and pg_cursor.rowcount >= 0:
+            measure['rows'] = pg_cursor.rowcount
     return pg_cursor
 
 
+def iter_results_for_query(pg_conn, query, itersize=2000, row_type='tuple'):
+    """
+    Yield the results of the query one row at a time using a server-side cursor so that only itersize rows are held
+    in memory.
+    """
+    with get_result_cursor(pg_conn, query, server_side=True, itersize=itersize, row_type=row_type) as pg_cursor:
+        for row in pg_cursor:
+            yield row
+
+
+def iter_result_batches_for_query(pg_conn, query, batch_size=2000, row_type='tuple'):
+    """Yield the results of the query in lists of up to batch_size rows using a server-side cursor."""
+    with get_result_cursor(pg_conn, query, server_side=True, itersize=batch_size, row_type=row_type) as pg_cursor:
+        while True:
+            rows = pg_cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
 def get_pg_connection_handle(dbname, user, host):
     return psycopg2.connect("dbname='{0}' user='{1}' host='{2}'".format(dbname, user, host))
 
 
+def pooled_pg_connection_handle(dbname, user, host, max_size=10):
+    """
+    Same as get_pg_connection_handle but check out the connection from a process-wide pool.
+    Use as a context manager: the connection is returned to the pool on exit.
+    """
+    pool = get_pg_connection_pool(('pg', host, dbname, user), {'dbname': dbname, 'user': user, 'host': host},
+                                  max_size=max_size)
+    return pool.connection()
+
+
 def index_already_exists_on_table(pg_conn, schema_name, table_name, index_columns):
     index_columns_lower_case = list(map(str.lower, index_columns))
     query = """select unnest(column_names) from (
@@ -91,6 +186,285 @@ def create_index_on_table(pg_conn, schema_name, table_name, index_columns):
         pg_conn.commit()
 
 
+IndexBuildResult = namedtuple('IndexBuildResult', ['table_name', 'index_columns', 'status', 'seconds', 'error'])
+INDEX_EXISTS = 'exists'
+INDEX_CREATED = 'created'
+INDEX_FAILED = 'failed'
+
+# Columns of all the valid indexes of the tables in the schemas. Invalid ones are left by failed concurrent builds.
+_existing_indexes_query = """
+    SELECT nmsp.nspname, t.relname, array_agg(lower(a.attname))
+    FROM pg_index ix
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_namespace nmsp ON nmsp.oid = t.relnamespace
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(ix.indkey)
+    WHERE nmsp.nspname = ANY(%s) AND ix.indisvalid
+    GROUP BY nmsp.nspname, t.relname, i.relname
+"""
+
+# Table, validity and columns of the index with a given name in a schema
+_named_index_query = """
+    SELECT t.relname, ix.indisvalid, array_agg(lower(a.attname))
+    FROM pg_index ix
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_namespace nmsp ON nmsp.oid = i.relnamespace
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(ix.indkey)
+    WHERE nmsp.nspname = %s AND i.relname = %s
+    GROUP BY t.relname, ix.indisvalid
+"""
+
+_create_index_progress_query = """
+    SELECT p.pid, c.relname, p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total
+    FROM pg_stat_progress_create_index p
+    JOIN pg_class c ON c.oid = p.relid
+    WHERE p.pid = ANY(%s)
+"""
+
+
+def _split_table_name(table_name):
+    """Schema and table of an optionally schema qualified table name"""
+    schema_name, _, table_name = table_name.rpartition('.')
+    return schema_name or 'public', table_name
+
+
+@contextmanager
+def _autocommit_connection(pool, backend_pids):
+    """
+    Check out a connection from the pool in autocommit mode, needed by the commands that cannot run in a transaction,
+    and register its backend pid while it is in use so that its progress can be reported.
+    """
+    with pool.connection() as pg_conn:
+        autocommit = pg_conn.autocommit
+        pg_conn.autocommit = True
+        backend_pid = pg_conn.get_backend_pid()
+        backend_pids.add(backend_pid)
+        try:
+            yield pg_conn
+        finally:
+            backend_pids.discard(backend_pid)
+            pg_conn.autocommit = autocommit
+
+
+def _wait_with_progress(pg_conn, futures, progress_query, backend_pids, progress_interval):
+    """
+    Yield the futures as they complete. While waiting, log every progress_interval seconds the progress of the
+    commands run by the backends in backend_pids, read from progress_query with pg_conn.
+    The progress query returns the pid, the table, the phase and the number of blocks then tuples done and to do. The
+    tuples are reported in the phases that do not scan blocks.
+    """
+    pending = set(futures)
+    report_progress = True
+    while pending:
+        done, pending = wait(pending, timeout=progress_interval)
+        yield from done
+        if not pending or not report_progress or not backend_pids:
+            continue
+        try:
+            with pg_conn.cursor() as pg_cursor:
+                pg_cursor.execute(progress_query, (list(backend_pids),))
+                for pid, table_name, phase, blocks_done, blocks_total, tuples_done, tuples_total \
+                        in pg_cursor.fetchall():
+                    if blocks_total:
+                        done = f', {blocks_done}/{blocks_total} blocks ({100 * blocks_done / blocks_total:.0f}%)'
+                    elif tuples_total:
+                        done = f', {tuples_done}/{tuples_total} tuples ({100 * tuples_done / tuples_total:.0f}%)'
+                    else:
+                        done = ''
+                    logger.info('%s (pid %s): %s%s', table_name, pid, phase, done)
+            pg_conn.rollback()
+        except psycopg2.Error as e:
+            # The progress views only exist in recent versions of PostgreSQL
+            logger.warning('Could not retrieve the progress: %s', e)
+            pg_conn.rollback()
+            report_progress = False
+
+
+def get_existing_indexes(pg_conn, schema_names):
+    """Return the set of (schema_name, table_name, frozenset of lower case columns) of the indexes in the schemas."""
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(_existing_indexes_query, (list(schema_names),))
+        return {(schema_name, table_name, frozenset(columns))
+                for schema_name, table_name, columns in pg_cursor.fetchall()}
+
+
+def _index_name(table_name, index_columns):
+    # Same naming as PostgreSQL's default, truncated to the maximum identifier length
+    return '_'.join([table_name] + index_columns + ['idx'])[:63]
+
+
+def _build_index(pool, schema_name, table_name, index_columns, session_settings, backend_pids):
+    """
+    Build the index unless a valid one with the same name and columns already exists. Returns a tuple of the status
+    and the time taken. Raises a ValueError if the name is used by an index on other columns.
+    """
+    index_name = _index_name(table_name, index_columns)
+    drop_query = sql.SQL('DROP INDEX CONCURRENTLY IF EXISTS {}').format(sql.Identifier(schema_name, index_name))
+    query = sql.SQL('CREATE INDEX CONCURRENTLY {} ON {} ({})').format(
+        sql.Identifier(index_name), sql.Identifier(schema_name, table_name),
+        sql.SQL(', ').join(map(sql.Identifier, index_columns))
+    )
+    start_time = time.time()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with _autocommit_connection(pool, backend_pids) as pg_conn, pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(_named_index_query, (schema_name, index_name))
+        named_index = pg_cursor.fetchone()
+        if named_index:
+            indexed_table, is_valid, indexed_columns = named_index
+            if not is_valid:
+                # Left by an interrupted concurrent build
+                logger.warning('Dropping invalid index %s.%s', schema_name, index_name)
+                pg_cursor.execute(drop_query)
+            elif indexed_table != table_name or sorted(indexed_columns) != sorted(index_columns):
+                raise ValueError(f'Index {schema_name}.{index_name} already exists on {indexed_table} '
+                                 f'({", ".join(indexed_columns)})')
+            else:
+                logger.info('Index %s.%s was created since the existing indexes were retrieved', schema_name,
+                            index_name)
+                return INDEX_EXISTS, 0
+        for setting, value in session_settings.items():
+            pg_cursor.execute(sql.SQL('SET {} = %s').format(sql.Identifier(setting)), (str(value),))
+        logger.info('Building index %s on %s.%s (%s)', index_name, schema_name, table_name, ', '.join(index_columns))
+        try:
+            pg_cursor.execute(query)
+        except psycopg2.errors.DuplicateTable:
+            # The name was taken by another build in the meantime: its index must not be dropped
+            raise
+        except psycopg2.Error:
+            # A failed concurrent build leaves an invalid index behind that needs to be removed
+            pg_cursor.execute(drop_query)
+            raise
+        finally:
+            for setting in session_settings:
+                pg_cursor.execute(sql.SQL('RESET {}').format(sql.Identifier(setting)))
+    return INDEX_CREATED, time.time() - start_time
+
+
+def create_indexes_on_tables(pool, index_specs, max_workers=4, maintenance_work_mem='1GB',
+                             max_parallel_maintenance_workers=2, progress_interval=60):
+    """
+    Build the indexes described in index_specs, a list of (table_name, index_columns) where table_name is optionally
+    schema qualified, using CREATE INDEX CONCURRENTLY so that the tables stay writable during the builds.
+    The existing indexes are retrieved with a single catalog query and only the missing ones are built, up to
+    max_workers at a time on connections checked out from pool (a PGConnectionPool), with the session settings
+    maintenance_work_mem and max_parallel_maintenance_workers. One more connection is used to report the progress of
+    the builds every progress_interval seconds, so the pool must hold at least two connections.
+    Invalid indexes left by interrupted builds are rebuilt and a build fails if its index name is already used by an
+    index on other columns.
+    Returns an IndexBuildResult for each spec, in the same order. A failed build does not stop the others.
+    """
+    if pool.max_size < 2:
+        raise ValueError('The pool must hold at least two connections to build indexes while reporting progress')
+    specs = []
+    for table_name, index_columns in index_specs:
+        schema_name, table_name = _split_table_name(table_name)
+        specs.append((schema_name, table_name, tuple(sorted(map(str.lower, index_columns)))))
+    session_settings = {'maintenance_work_mem': maintenance_work_mem,
+                        'max_parallel_maintenance_workers': max_parallel_maintenance_workers}
+    results = {}
+    with pool.connection() as pg_conn:
+        existing_indexes = get_existing_indexes(pg_conn, {schema_name for schema_name, _, _ in specs})
+        pg_conn.rollback()
+        backend_pids = set()
+        futures = {}
+        # The connection used for the progress reports is not available to the builds
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, pool.max_size - 1))) as executor:
+            for spec in dict.fromkeys(specs):
+                schema_name, table_name, index_columns = spec
+                if (schema_name, table_name, frozenset(index_columns)) in existing_indexes:
+                    logger.info('Index on %s column(s) on %s.%s already exists. Skipping...',
+                                ','.join(index_columns), schema_name, table_name)
+                    results[spec] = IndexBuildResult(f'{schema_name}.{table_name}', list(index_columns),
+                                                     INDEX_EXISTS, 0, None)
+                    continue
+                future = executor.submit(_build_index, pool, schema_name, table_name, list(index_columns),
+                                         session_settings, backend_pids)
+                futures[future] = spec
+            for future in _wait_with_progress(pg_conn, futures, _create_index_progress_query, backend_pids,
+                                              progress_interval):
+                schema_name, table_name, index_columns = spec = futures[future]
+                try:
+                    results[spec] = IndexBuildResult(f'{schema_name}.{table_name}', list(index_columns),
+                                                     *future.result(), None)
+                except Exception as e:
+                    logger.error('Could not build index on %s.%s (%s): %s', schema_name, table_name,
+                                 ', '.join(index_columns), e)
+                    results[spec] = IndexBuildResult(f'{schema_name}.{table_name}', list(index_columns),
+                                                     INDEX_FAILED, None, e)
+    return [results[spec] for spec in specs]
+
+
+VacuumResult = namedtuple('VacuumResult', ['table_name', 'dead_tuples', 'status', 'seconds', 'error'])
+VACUUM_DONE = 'done'
+VACUUM_FAILED = 'failed'
+
+_dead_tuples_query = 'SELECT schemaname, relname, n_dead_tup FROM pg_stat_user_tables WHERE schemaname = ANY(%s)'
+
+_vacuum_progress_query = """
+    SELECT p.pid, c.relname, p.phase, p.heap_blks_scanned, p.heap_blks_total, NULL, NULL
+    FROM pg_stat_progress_vacuum p
+    JOIN pg_class c ON c.oid = p.relid
+    WHERE p.pid = ANY(%s)
+"""
+
+
+def get_dead_tuples(pg_conn, schema_names):
+    """Return the number of dead tuples of each table of the schemas, keyed by (schema_name, table_name)."""
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.execute(_dead_tuples_query, (list(schema_names),))
+        return {(schema_name, table_name): dead_tuples for schema_name, table_name, dead_tuples in pg_cursor.fetchall()}
+
+
+def _vacuum_table(pool, schema_name, table_name, options, backend_pids):
+    query = sql.SQL('VACUUM ({}) {}').format(sql.SQL(options), sql.Identifier(schema_name, table_name))
+    start_time = time.time()
+    # VACUUM cannot run inside a transaction
+    with _autocommit_connection(pool, backend_pids) as pg_conn, pg_conn.cursor() as pg_cursor:
+        logger.info('Vacuum analyze %s.%s with options %s', schema_name, table_name, options)
+        pg_cursor.execute(query)
+    return time.time() - start_time
+
+
+def vacuum_analyze_tables(pool, table_names, max_workers=4, parallel_workers=2, progress_interval=60):
+    """
+    Run VACUUM ANALYZE on the tables, optionally schema qualified, up to max_workers at a time on connections checked
+    out from pool (a PGConnectionPool). The tables with the most dead tuples according to pg_stat_user_tables are
+    vacuumed first. From PostgreSQL 13, the indexes of each table are vacuumed by up to parallel_workers workers.
+    One more connection is used to report the progress every progress_interval seconds, so the pool must hold at
+    least two connections.
+    Returns a VacuumResult for each table, in the same order. A failure on one table does not stop the others.
+    """
+    if pool.max_size < 2:
+        raise ValueError('The pool must hold at least two connections to vacuum tables while reporting progress')
+    tables = list(dict.fromkeys(_split_table_name(table_name) for table_name in table_names))
+    results = {}
+    with pool.connection() as pg_conn:
+        dead_tuples = get_dead_tuples(pg_conn, {schema_name for schema_name, _ in tables})
+        pg_conn.rollback()
+        options = 'ANALYZE'
+        if parallel_workers and pg_conn.server_version >= 130000:
+            options = f'PARALLEL {int(parallel_workers)}, ANALYZE'
+        backend_pids = set()
+        futures = {}
+        # The connection used for the progress reports is not available to the vacuums
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, pool.max_size - 1))) as executor:
+            for table in sorted(tables, key=lambda table: dead_tuples.get(table, 0), reverse=True):
+                future = executor.submit(_vacuum_table, pool, *table, options, backend_pids)
+                futures[future] = table
+            for future in _wait_with_progress(pg_conn, futures, _vacuum_progress_query, backend_pids,
+                                              progress_interval):
+                schema_name, table_name = table = futures[future]
+                try:
+                    results[table] = VacuumResult(f'{schema_name}.{table_name}', dead_tuples.get(table),
+                                                  VACUUM_DONE, future.result(), None)
+                except Exception as e:
+                    logger.error('Could not vacuum %s.%s: %s', schema_name, table_name, e)
+                    results[table] = VacuumResult(f'{schema_name}.{table_name}', dead_tuples.get(table),
+                                                  VACUUM_FAILED, None, e)
+    return [results[table] for table in tables]
+
+
 def vacuum_analyze_table(pg_conn, schema_name, table_name, columns=()):
     query = "vacuum analyze {0}.{1}".format(schema_name, table_name)
     if columns:
@@ -105,3 +479,109 @@ def vacuum_analyze_table(pg_conn, schema_name, table_name, columns=()):
         logger.error(ex)
     finally:
         pg_conn.set_isolation_level(isolation_level_pre_analyze)
+
+
+class CopyResult(namedtuple('CopyResult', ['rows', 'seconds'])):
+    """Number of rows copied by a COPY command and the time it took"""
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def _format_csv_value(value):
+    # Unquoted empty values are NULL in the CSV format of COPY while quoted ones are empty strings
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+class _CSVRowsReader:
+    """Read-only file-like object that formats rows as CSV lines when read so the rows are never all in memory."""
+
+    def __init__(self, rows):
+        self._lines = (','.join(_format_csv_value(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _copy_source(query_or_table):
+    """Table identifier or query between parentheses to use in a COPY TO statement"""
+    if isinstance(query_or_table, sql.Composable):
+        return sql.SQL('({})').format(query_or_table)
+    if query_or_table.strip().lower().startswith(('select', 'with', 'values')):
+        return sql.SQL('({})').format(sql.SQL(query_or_table))
+    return sql.Identifier(*query_or_table.split('.'))
+
+
+def copy_from_iterable(pg_conn, table_name, rows, columns=None, copy_format='csv', buffer_size=8192 * 1024,
+                       commit=True):
+    """
+    Load rows into table_name (optionally schema qualified) using COPY FROM STDIN, which is much faster than inserting
+    the rows one by one.
+    rows is either an iterable of tuples, with None for NULL values, or a file-like object already in the copy_format
+    (csv or binary). Only the data needed to fill a buffer of buffer_size is held in memory at any time.
+    The load is committed if commit is set and rolled back if it fails. Returns a CopyResult.
+    """
+    if copy_format not in ('csv', 'binary'):
+        raise ValueError(f'Unsupported copy format {copy_format}: should be csv or binary')
+    if hasattr(rows, 'read'):
+        source = rows
+    elif copy_format == 'csv':
+        source = _CSVRowsReader(rows)
+    else:
+        raise ValueError('Rows can only be provided as an iterable with the csv format')
+    target = sql.Identifier(*table_name.split('.'))
+    if columns:
+        target = sql.SQL('{} ({})').format(target, sql.SQL(', ').join(map(sql.Identifier, columns)))
+    statement = sql.SQL('COPY {} FROM STDIN WITH (FORMAT {})').format(target, sql.SQL(copy_format))
+    start_time = time.time()
+    try:
+        with pg_conn.cursor() as pg_cursor:
+            pg_cursor.copy_expert(statement, source, size=buffer_size)
+            nb_rows = pg_cursor.rowcount if pg_cursor.rowcount >= 0 else getattr(source, 'rows', -1)
+        if commit:
+            pg_conn.commit()
+    except Exception:
+        pg_conn.rollback()
+        raise
+    result = CopyResult(nb_rows, time.time() - start_time)
+    logger.info('Copied %s rows into %s in %.1fs (%.0f rows/s)', result.rows, table_name, result.seconds,
+                result.rows_per_second)
+    return result
+
+
+def copy_to_stream(pg_conn, query_or_table, output, copy_format='csv', header=False, buffer_size=8192 * 1024):
+    """
+    Export the results of a query, or the content of a table, to the file-like object output using COPY TO STDOUT.
+    The rows are written as they are received so the results are never all in memory. Returns a CopyResult.
+    """
+    if copy_format not in ('csv', 'binary'):
+        raise ValueError(f'Unsupported copy format {copy_format}: should be csv or binary')
+    options = 'FORMAT ' + copy_format
+    if header and copy_format == 'csv':
+        options += ', HEADER true'
+    statement = sql.SQL('COPY {} TO STDOUT WITH ({})').format(_copy_source(query_or_table), sql.SQL(options))
+    start_time = time.time()
+    with pg_conn.cursor() as pg_cursor:
+        pg_cursor.copy_expert(statement, output, size=buffer_size)
+        nb_rows = pg_cursor.rowcount
+    result = CopyResult(nb_rows, time.time() - start_time)
+    logger.info('Exported %s rows in %.1fs (%.0f rows/s)', result.rows, result.seconds, result.rows_per_second)
+    return result
@@ -0,0 +1,165 @@
+# Copyright 2026 EMBL - European Bioinformatics Institute
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import threading
+import time
+from collections import namedtuple, deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, sql
+
+from ebi_eva_common_pyutils.logger import AppLogger
+
+# Aggregated measures of all the executions of the queries with the same fingerprint
+QueryStats = namedtuple('QueryStats', ['fingerprint', 'calls', 'total_seconds', 'max_seconds', 'rows'])
+SlowQuery = namedtuple('SlowQuery', ['fingerprint', 'query', 'seconds', 'rows', 'plan'])
+
+_string_literal = re.compile(r"'(?:[^']|'')*'")
+_number_literal = re.compile(r'(?<![\w$])\d+(?:\.\d+)?\b')
+_value_list = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_whitespace = re.compile(r'\s+')
+_data_modifying_keyword = re.compile(r'\b(insert|update|delete|merge|into|truncate|copy|nextval|setval)\b')
+
+
+def fingerprint_query(query):
+    """
+    Normalise a query so that the executions of the same statement with different values share a fingerprint: the
+    literals are replaced by ? and the lists of values by (...).
+    """
+    fingerprint = _string_literal.sub('?', query)
+    fingerprint = _number_literal.sub('?', fingerprint)
+    fingerprint = _value_list.sub('(...)', fingerprint)
+    return _whitespace.sub(' ', fingerprint).strip().lower()
+
+
+def is_read_only_query(query):
+    """
+    Whether the query is a SELECT, possibly with common table expressions, that does not modify any data. Queries
+    that mention a data modifying statement anywhere are considered as modifying data.
+    """
+    fingerprint = fingerprint_query(query)
+    return fingerprint.startswith(('select', 'with')) and not _data_modifying_keyword.search(fingerprint)
+
+
+def _query_text(pg_conn, query):
+    if isinstance(query, sql.Composable):
+        try:
+            return query.as_string(pg_conn)
+        except Exception:
+            return repr(query)
+    return str(query)
+
+
+class QueryMetrics(AppLogger):
+    """
+    In-process registry of the time taken and the number of rows returned by the queries run through pg_utils,
+    aggregated by query fingerprint.
+    Queries taking more than slow_query_threshold seconds are logged and the last max_slow_queries are kept. With
+    explain_slow_queries set, the plan of the slow queries is captured by running them again with
+    EXPLAIN (ANALYZE, BUFFERS), which is only done for read-only queries and always rolled back.
+    """
+
+    def __init__(self, slow_query_threshold=None, explain_slow_queries=False, max_slow_queries=100):
+        self.enabled = True
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self._lock = threading.Lock()
+        # fingerprint -> [calls, total seconds, max seconds, rows]
+        self._stats = {}
+        self.slow_queries = deque(maxlen=max_slow_queries)
+
+    def record(self, pg_conn, query, seconds, rows=None, params=None, explain_query=None):
+        """
+        Record one execution of the query. rows is None if unknown, for instance for server-side cursors.
+        explain_query is the statement to explain if it differs from the query, i.e. for prepared statements.
+        """
+        if not self.enabled:
+            return
+        query_text = _query_text(pg_conn, query)
+        fingerprint = fingerprint_query(query_text)
+        with self._lock:
+            stats = self._stats.setdefault(fingerprint, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] += rows or 0
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            plan = None
+            if self.explain_slow_queries:
+                plan = self._explain(pg_conn, query_text, explain_query or query_text, params)
+            self.slow_queries.append(SlowQuery(fingerprint, query_text, seconds, rows, plan))
+            self.warning('Slow query (%.3fs, %s rows): %s%s', seconds, 'unknown' if rows is None else rows,
+                         query_text, '\n' + plan if plan else '')
+
+    def _explain(self, pg_conn, query, statement, params=None):
+        """
+        Run the statement again with EXPLAIN (ANALYZE, BUFFERS) if the query it executes only reads data. It is run in
+        a savepoint, or a transaction in autocommit mode, which is rolled back so that nothing it does persists and
+        its failure does not abort the transaction of the caller.
+        """
+        if not is_read_only_query(query):
+            return None
+        # The plan cannot be retrieved in a transaction that already failed
+        if pg_conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR:
+            return None
+        if pg_conn.autocommit:
+            start, end = 'BEGIN', 'ROLLBACK'
+        else:
+            start, end = 'SAVEPOINT query_metrics_explain', 'ROLLBACK TO SAVEPOINT query_metrics_explain'
+        was_idle = pg_conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
+        try:
+            with pg_conn.cursor() as pg_cursor:
+                pg_cursor.execute(start)
+                try:
+                    pg_cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + statement, params)
+                    return '\n'.join(line for line, in pg_cursor.fetchall())
+                finally:
+                    pg_cursor.execute(end)
+                    if not pg_conn.autocommit:
+                        pg_cursor.execute('RELEASE SAVEPOINT query_metrics_explain')
+        except psycopg2.Error as e:
+            self.warning('Could not explain slow query: %s', str(e).strip())
+            return None
+        finally:
+            # Do not leave open the transaction started for the savepoint
+            if was_idle and not pg_conn.autocommit:
+                pg_conn.rollback()
+
+    @contextmanager
+    def timed(self, pg_conn, query, params=None, explain_query=None):
+        """
+        Context manager measuring the time taken by the block, which executes the query. The number of rows can be
+        set on the yielded dict under 'rows'. Queries that fail are not recorded.
+        """
+        measure = {'rows': None}
+        start_time = time.perf_counter()
+        yield measure
+        self.record(pg_conn, query, time.perf_counter() - start_time, measure['rows'], params, explain_query)
+
+    def stats(self, limit=None):
+        """QueryStats of the queries executed, the ones that took the most time overall first"""
+        with self._lock:
+            stats = [QueryStats(fingerprint, *values) for fingerprint, values in self._stats.items()]
+        stats.sort(key=lambda query_stats: query_stats.total_seconds, reverse=True)
+        return stats[:limit] if limit else stats
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow_queries.clear()
+
+
+# Shared by the pg_utils functions executing queries
+query_metrics = QueryMetrics()
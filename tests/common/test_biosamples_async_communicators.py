@@ -0,0 +1,82 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ebi_eva_common_pyutils.biosamples_async_communicators import AsyncHALCommunicator, \
+    AsyncWebinHALCommunicator
+
+
+class TestAsyncHALCommunicator(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.requests = []
+        self.nb_failures = 0
+        app = web.Application()
+        app.router.add_get('/auth', self.auth)
+        app.router.add_post('/webin', self.auth)
+        app.router.add_get('/biosamples', self.root)
+        app.router.add_get('/biosamples/samples', self.samples)
+        app.router.add_get('/biosamples/samples/{accession}', self.sample)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.url = str(self.server.make_url(''))
+        self.comm = AsyncHALCommunicator(self.url + '/auth', self.url + '/biosamples', 'user', 'pass')
+
+    async def asyncTearDown(self) -> None:
+        await self.comm.close()
+        await self.server.close()
+
+    async def auth(self, request):
+        return web.Response(text='token')
+
+    async def root(self, request):
+        self.requests.append(request)
+        return web.json_response({'_links': {'samples': {'href': self.url + '/biosamples/samples'}}})
+
+    async def samples(self, request):
+        self.requests.append(request)
+        page = int(request.query.get('page', 0))
+        links = {}
+        if page < 2:
+            links['next'] = {'href': self.url + f'/biosamples/samples?page={page + 1}'}
+        return web.json_response({'_embedded': {'samples': [{'accession': f'SAMEA{page}'}]}, '_links': links,
+                                  'page': {'number': page}})
+
+    async def sample(self, request):
+        self.requests.append(request)
+        accession = request.match_info['accession']
+        if accession == 'SAMEA404':
+            return web.Response(status=404)
+        if accession == 'SAMEA500' and self.nb_failures == 0:
+            self.nb_failures += 1
+            return web.Response(status=500)
+        return web.json_response({'accession': accession})
+
+    async def test_follows_link(self):
+        async with self.comm:
+            self.assertEqual(await self.comm.follows_link('samples', join_url='SAMEA1'), {'accession': 'SAMEA1'})
+        self.assertEqual(self.requests[-1].headers['Authorization'], 'Bearer token')
+
+    async def test_retry_and_not_found(self):
+        async with self.comm:
+            with patch('asyncio.sleep'):
+                self.assertEqual(await self.comm.follows_link('samples', join_url='SAMEA500'),
+                                 {'accession': 'SAMEA500'})
+            with self.assertRaises(ValueError):
+                await self.comm.follows_link('samples', join_url='SAMEA404')
+
+    async def test_follows_all_pages(self):
+        async with self.comm:
+            json_response = await self.comm.follows_link('samples', all_pages=True)
+            self.assertEqual([s['accession'] for s in json_response['_embedded']['samples']],
+                             ['SAMEA0', 'SAMEA1', 'SAMEA2'])
+            self.assertNotIn('page', json_response)
+            accessions = [sample['accession'] async for sample in self.comm.follows_link_iter('samples')]
+            self.assertEqual(accessions, ['SAMEA0', 'SAMEA1', 'SAMEA2'])
+
+    async def test_webin_token(self):
+        async with AsyncWebinHALCommunicator(self.url + '/webin', self.url + '/biosamples', 'user', 'pass') as comm:
+            self.assertEqual(await comm.get_token(), 'token')
+            self.assertEqual(comm.communicator_attributes, {'webinSubmissionAccountId': 'user'})
@@ -1,8 +1,22 @@
+import base64
+import json
+import os
+import time
 from copy import deepcopy
 from unittest import TestCase
 from unittest.mock import Mock, patch, PropertyMock
 
+import requests
+
+from ebi_eva_common_pyutils.biosamples_bulk import BioSamplesBulkProcessor
 from ebi_eva_common_pyutils.biosamples_communicators import HALCommunicator, WebinHALCommunicator, HttpErrorRetry
+from ebi_eva_common_pyutils.response_cache import HTTPResponseCache
+from tests.test_common import TestCommon
+
+
+def make_jwt(expiry):
+    payload = base64.urlsafe_b64encode(json.dumps({'sub': 'user', 'exp': expiry}).encode()).decode().rstrip('=')
+    return 'header.' + payload + '.signature'
 
 
 class TestHALCommunicator(TestCase):
@@ -20,8 +34,32 @@ class TestHALCommunicator(TestCase):
             self.assertEqual(self.comm.token, 'token')
             mocked_get.assert_called_once_with('http://aap.example.org', auth=('user', 'pass'))
 
+    def test_token_refresh(self):
+        expiring_token = make_jwt(time.time() + 60)
+        valid_token = make_jwt(time.time() + 3600)
+        with patch('requests.get', side_effect=[
+            Mock(text=expiring_token, status_code=200), Mock(text=valid_token, status_code=200)
+        ]) as mocked_get:
+            # The first token expires within the refresh margin so it is renewed on the next access
+            self.assertEqual(self.comm.token, expiring_token)
+            self.assertEqual(self.comm.token, valid_token)
+            self.assertEqual(self.comm.token, valid_token)
+            self.assertEqual(mocked_get.call_count, 2)
+
+    def test_req_renews_rejected_token(self):
+        with patch('requests.get', side_effect=[
+            Mock(text='token1', status_code=200), Mock(text='token2', status_code=200)
+        ]), patch.object(self.comm.session, 'request', side_effect=[
+            Mock(status_code=401, request=PropertyMock(url='text')), Mock(status_code=200)
+        ]) as mocked_request, patch('time.sleep'):
+            self.comm._req('GET', 'http://BSD.example.org')
+            self.assertEqual(
+                [c.kwargs['headers']['Authorization'] for c in mocked_request.call_args_list],
+                ['Bearer token1', 'Bearer token2']
+            )
+
     def test_req(self):
-        with patch('requests.request', return_value=Mock(status_code=200)) as mocked_request, \
+        with patch.object(self.comm.session, 'request', return_value=Mock(status_code=200)) as mocked_request, \
                 patch.object(HALCommunicator, 'token', new_callable=PropertyMock(return_value='token')):
             self.comm._req('GET', 'http://BSD.example.org')
             mocked_request.assert_called_once_with(
@@ -31,13 +69,13 @@ class TestHALCommunicator(TestCase):
 
         # 500 should trigger a retry
         with patch.object(HALCommunicator, 'token', new_callable=PropertyMock(return_value='token')), \
-                patch('requests.request') as mocked_request:
+                patch.object(self.comm.session, 'request') as mocked_request:
             mocked_request.return_value = Mock(status_code=500, request=PropertyMock(url='text'))
             self.assertRaises(HttpErrorRetry, self.comm._req, 'GET', 'http://BSD.example.org')
 
         # 404 should fail with a ValueError, but not trigger a retry
         with patch.object(HALCommunicator, 'token', new_callable=PropertyMock(return_value='token')), \
-                patch('requests.request') as mocked_request:
+                patch.object(self.comm.session, 'request') as mocked_request:
             mocked_request.return_value = Mock(status_code=404, request=PropertyMock(url='text'))
             try:
                 self.comm._req('GET', 'http://BSD.example.org')
@@ -112,6 +150,47 @@ class TestHALCommunicator(TestCase):
             self.assertEqual(len(observed_json['_embedded']['samples']), 7)
             self.assertEqual(mocked_req.call_count, 4)
 
+    def test_follows_iter(self):
+        page1 = {'_embedded': {'samples': [{'accession': 'SAMEA1'}, {'accession': 'SAMEA2'}]},
+                 '_links': {'next': {'href': 'url?page=1'}}, 'page': {}}
+        page2 = {'_embedded': {'samples': [{'accession': 'SAMEA3'}]}, '_links': {}, 'page': {}}
+        with patch.object(HALCommunicator, '_req', side_effect=[
+            Mock(json=Mock(return_value=page1)), Mock(json=Mock(return_value=page2))
+        ]) as mocked_req:
+            samples_iter = self.comm.follows_iter('test', {'test': 'url'}, embedded_key='samples')
+            # Nothing is requested until the iterator is consumed
+            mocked_req.assert_not_called()
+            self.assertEqual(next(samples_iter), {'accession': 'SAMEA1'})
+            self.assertEqual(mocked_req.call_count, 1)
+            self.assertEqual([sample['accession'] for sample in samples_iter], ['SAMEA2', 'SAMEA3'])
+            self.assertEqual(mocked_req.call_count, 2)
+            mocked_req.assert_any_call('GET', 'url?page=1')
+
+    def test_follows_concurrent_pages(self):
+        def page(page_number):
+            links = {'self': {'href': f'url?size=1&page={page_number}'}}
+            if page_number < 4:
+                links['next'] = {'href': f'url?size=1&page={page_number + 1}'}
+            return {'_embedded': {'samples': [{'accession': f'SAMEA{page_number}'}]}, '_links': links,
+                    'page': {'size': 1, 'totalElements': 5, 'totalPages': 5, 'number': page_number}}
+
+        def req(method, url, **kwargs):
+            page_number = int(url.split('page=')[1]) if 'page=' in url else 0
+            return Mock(json=Mock(return_value=page(page_number)))
+
+        with patch.object(HALCommunicator, '_req', side_effect=req) as mocked_req:
+            samples = self.comm.follows_iter('test', {'test': 'url'}, embedded_key='samples', concurrent_pages=3)
+            self.assertEqual([sample['accession'] for sample in samples],
+                             ['SAMEA0', 'SAMEA1', 'SAMEA2', 'SAMEA3', 'SAMEA4'])
+            self.assertEqual(mocked_req.call_count, 5)
+            for page_number in range(1, 5):
+                mocked_req.assert_any_call('GET', f'url?size=1&page={page_number}')
+
+        with patch.object(HALCommunicator, '_req', side_effect=req):
+            observed_json = self.comm.follows('test', {'test': 'url'}, all_pages=True, concurrent_pages=2)
+            self.assertEqual([sample['accession'] for sample in observed_json['_embedded']['samples']],
+                             ['SAMEA0', 'SAMEA1', 'SAMEA2', 'SAMEA3', 'SAMEA4'])
+
     def test_follows_link(self):
         json_response = {'json': 'values'}
         # Patches the _req function that returns the Response object with a json function
@@ -137,3 +216,111 @@ class TestWebinHALCommunicator(TestCase):
             print(mocked_post.mock_calls)
             mocked_post.assert_called_once_with('http://webin.example.org',
                                                 json={'authRealms': ['ENA'], 'password': 'pass', 'username': 'user'})
+
+
+class TestBioSamplesBulkProcessor(TestCase):
+
+    def setUp(self) -> None:
+        self.comm = HALCommunicator('http://aap.example.org', 'http://BSD.example.org', 'user', 'pass')
+        self.processor = BioSamplesBulkProcessor(self.comm, max_workers=3, max_in_flight=4)
+
+    def test_fetch_samples(self):
+        def follows_link(key, method='GET', join_url=None, **kwargs):
+            if join_url == 'SAMEA3':
+                raise ValueError('Not found')
+            return {'accession': join_url}
+
+        with patch.object(HALCommunicator, 'follows_link', side_effect=follows_link) as mocked_follows_link:
+            outcomes = list(self.processor.fetch_samples(f'SAMEA{i}' for i in range(10)))
+        self.assertEqual(mocked_follows_link.call_count, 10)
+        self.assertEqual(len(outcomes), 10)
+        successes = sorted(outcome.result['accession'] for outcome in outcomes if outcome.success)
+        self.assertEqual(successes, [f'SAMEA{i}' for i in range(10) if i != 3])
+        failures = [outcome for outcome in outcomes if not outcome.success]
+        self.assertEqual([failure.item for failure in failures], ['SAMEA3'])
+        self.assertIsInstance(failures[0].error, ValueError)
+        self.assertEqual((self.processor.stats.succeeded, self.processor.stats.failed), (9, 1))
+
+    def test_input_consumed_lazily(self):
+        consumed = []
+
+        def accessions():
+            for i in range(10):
+                consumed.append(i)
+                yield f'SAMEA{i}'
+
+        with patch.object(HALCommunicator, 'follows_link', return_value={}):
+            outcomes = self.processor.fetch_samples(accessions())
+            next(outcomes)
+            # Only the samples in flight have been pulled from the input
+            self.assertLessEqual(len(consumed), 5)
+            list(outcomes)
+        self.assertEqual(len(consumed), 10)
+
+    def test_update_and_curate_samples(self):
+        with patch.object(HALCommunicator, 'follows_link', return_value={}) as mocked_follows_link:
+            list(self.processor.update_samples([{'accession': 'SAMEA1', 'name': 'sample1'}]))
+            mocked_follows_link.assert_called_once_with('samples', method='PUT', join_url='SAMEA1',
+                                                        json={'accession': 'SAMEA1', 'name': 'sample1'})
+            mocked_follows_link.reset_mock()
+            list(self.processor.curate_samples([{'sample': 'SAMEA1', 'curation': {}}]))
+            mocked_follows_link.assert_called_once_with('samples', method='POST', join_url='SAMEA1/curationlinks',
+                                                        json={'sample': 'SAMEA1', 'curation': {}})
+
+
+class TestHALCommunicatorResponseCache(TestCommon):
+
+    def setUp(self) -> None:
+        self.cache_path = os.path.join(self.resources_folder, 'response_cache.sqlite')
+        self.cache = HTTPResponseCache(self.cache_path)
+        self.comm = HALCommunicator('http://aap.example.org', 'http://BSD.example.org', 'user', 'pass',
+                                    response_cache=self.cache)
+        self.comm._token = 'token'
+
+    def tearDown(self) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.cache_path + suffix):
+                os.remove(self.cache_path + suffix)
+
+    @staticmethod
+    def response(status_code, content=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers or {})
+        return response
+
+    def test_conditional_get(self):
+        document = b'{"accession": "SAMEA1"}'
+        with patch.object(self.comm.session, 'request', side_effect=[
+            self.response(200, document, {'ETag': '"v1"', 'Content-Type': 'application/hal+json'}),
+            self.response(304)
+        ]) as mocked_request:
+            self.assertEqual(self.comm._req('GET', 'http://BSD.example.org/samples/SAMEA1').json(),
+                             {'accession': 'SAMEA1'})
+            self.assertEqual(self.comm._req('GET', 'http://BSD.example.org/samples/SAMEA1').json(),
+                             {'accession': 'SAMEA1'})
+            self.assertNotIn('If-None-Match', mocked_request.call_args_list[0].kwargs['headers'])
+            self.assertEqual(mocked_request.call_args_list[1].kwargs['headers']['If-None-Match'], '"v1"')
+
+        # Responses are not shared with other users
+        other_comm = HALCommunicator('http://aap.example.org', 'http://BSD.example.org', 'other', 'pass',
+                                     response_cache=self.cache)
+        self.assertIsNone(self.cache.get(other_comm.cache_identity, 'http://BSD.example.org/samples/SAMEA1'))
+
+    def test_fresh_responses_served_locally(self):
+        self.cache.max_age = 3600
+        with patch.object(self.comm.session, 'request', return_value=self.response(
+                200, b'{"_links": {}}', {'Last-Modified': 'Wed, 21 Oct 2025 07:28:00 GMT'})) as mocked_request:
+            self.assertEqual(self.comm.root, {'_links': {}})
+            self.assertEqual(self.comm._req('GET', 'http://BSD.example.org').json(), {'_links': {}})
+            mocked_request.assert_called_once()
+
+    def test_eviction(self):
+        self.cache.max_size = 10
+        self.cache.put('user', 'url1', self.response(200, b'123456', {'ETag': '"1"'}))
+        self.cache.put('user', 'url2', self.response(200, b'123456', {'ETag': '"2"'}))
+        self.assertIsNone(self.cache.get('user', 'url1'))
+        self.assertEqual(self.cache.get('user', 'url2').body, b'123456')
+        # Responses that cannot be revalidated are not stored
+        self.assertFalse(self.cache.put('user', 'url3', self.response(200, b'1')))
@@ -0,0 +1,122 @@
+import os
+import shutil
+from io import BytesIO
+from unittest.mock import patch, MagicMock
+
+from ebi_eva_common_pyutils.assembly_utils import is_patch_assembly
+from ebi_eva_common_pyutils.ena_utils import download_xml_from_ena, get_assembly_names_and_taxonomy_ids, \
+    get_scientific_names_and_common_names, iter_xml_records_from_ena, ena_record_cache, ENARecordCache, \
+    get_assembly_name_and_taxonomy_id, get_scientific_name_and_common_name
+from tests.test_common import TestCommon
+
+
+def mock_response(content):
+    response = MagicMock(raw=BytesIO(content))
+    response.__enter__.return_value = response
+    return response
+
+
+class TestEnaUtils(TestCommon):
+
+    assembly_set = b'''<?xml version="1.0" encoding="UTF-8"?>
+<ASSEMBLY_SET>
+  <ASSEMBLY accession="GCA_000001405.15" alias="GRCh38">
+    <TAXON><TAXON_ID>9606</TAXON_ID><SCIENTIFIC_NAME>Homo sapiens</SCIENTIFIC_NAME></TAXON>
+  </ASSEMBLY>
+  <ASSEMBLY accession="GCA_000002315.5" alias="GRCg6a">
+    <TAXON><TAXON_ID>9031</TAXON_ID><SCIENTIFIC_NAME>Gallus gallus</SCIENTIFIC_NAME></TAXON>
+  </ASSEMBLY>
+</ASSEMBLY_SET>'''
+
+    taxon_set = b'''<?xml version="1.0" encoding="UTF-8"?>
+<TAXON_SET>
+  <taxon scientificName="Homo sapiens" commonName="human" taxId="9606">
+    <lineage><taxon scientificName="Homo" taxId="9605"/></lineage>
+  </taxon>
+  <taxon scientificName="Sclerotinia sclerotiorum 1980 UF-70" taxId="665079">
+    <lineage><taxon scientificName="Sclerotinia" taxId="5179"/></lineage>
+  </taxon>
+</TAXON_SET>'''
+
+    patch_assembly = b'''<?xml version="1.0" encoding="UTF-8"?>
+<ASSEMBLY_SET>
+  <ASSEMBLY accession="GCA_000001405.29" alias="GRCh38.p14">
+    <TAXON><TAXON_ID>9606</TAXON_ID></TAXON>
+    <ASSEMBLY_ATTRIBUTES>
+      <ASSEMBLY_ATTRIBUTE><TAG>count-patches</TAG><VALUE>131</VALUE></ASSEMBLY_ATTRIBUTE>
+    </ASSEMBLY_ATTRIBUTES>
+  </ASSEMBLY>
+</ASSEMBLY_SET>'''
+
+    def setUp(self):
+        ena_record_cache.clear()
+        self.cache_dir = os.path.join(self.resources_folder, 'ena_records')
+
+    def tearDown(self):
+        ena_record_cache.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_download_xml_from_ena(self):
+        with patch('requests.get', return_value=mock_response(self.assembly_set)) as mock_get:
+            root = download_xml_from_ena('https://www.ebi.ac.uk/ena/browser/api/xml/GCA_000001405.15')
+        mock_get.assert_called_once_with('https://www.ebi.ac.uk/ena/browser/api/xml/GCA_000001405.15', stream=True)
+        self.assertEqual(root.xpath('/ASSEMBLY_SET/ASSEMBLY')[0].get('alias'), 'GRCh38')
+
+    def test_iter_xml_records_from_ena(self):
+        with patch('requests.get', side_effect=[mock_response(self.taxon_set), mock_response(self.taxon_set)]) \
+                as mock_get:
+            tax_ids = [element.get('taxId') for element in iter_xml_records_from_ena([9606, 665079, 1], 'taxon',
+                                                                                      batch_size=2)]
+        self.assertEqual(tax_ids, ['9606', '665079', '9606', '665079'])
+        self.assertEqual([c.args[0] for c in mock_get.call_args_list], [
+            'https://www.ebi.ac.uk/ena/browser/api/xml/9606,665079', 'https://www.ebi.ac.uk/ena/browser/api/xml/1'
+        ])
+
+    def test_get_assembly_names_and_taxonomy_ids(self):
+        with patch('requests.get', return_value=mock_response(self.assembly_set)):
+            self.assertEqual(get_assembly_names_and_taxonomy_ids(['GCA_000001405.15', 'GCA_000002315.5']), {
+                'GCA_000001405.15': ('GRCh38', 9606), 'GCA_000002315.5': ('GRCg6a', 9031)
+            })
+
+    def test_get_assembly_names_and_taxonomy_ids_versionless(self):
+        with patch('requests.get', return_value=mock_response(self.assembly_set)) as mock_get:
+            self.assertEqual(get_assembly_names_and_taxonomy_ids(['GCA_000001405', 'GCA_000002315.5']), {
+                'GCA_000001405': ('GRCh38', 9606), 'GCA_000002315.5': ('GRCg6a', 9031)
+            })
+            # The record is found under both accessions without downloading it again
+            self.assertEqual(get_assembly_names_and_taxonomy_ids(['GCA_000001405', 'GCA_000001405.15']), {
+                'GCA_000001405': ('GRCh38', 9606), 'GCA_000001405.15': ('GRCh38', 9606)
+            })
+        mock_get.assert_called_once()
+
+    def test_get_scientific_names_and_common_names(self):
+        with patch('requests.get', return_value=mock_response(self.taxon_set)):
+            self.assertEqual(get_scientific_names_and_common_names([9606, 665079]), {
+                9606: ('Homo sapiens', 'human'), 665079: ('Sclerotinia sclerotiorum 1980 UF-70', None)
+            })
+
+    def test_ena_record_cache_shared_between_modules(self):
+        with patch('requests.get', return_value=mock_response(self.patch_assembly)) as mock_get:
+            self.assertTrue(is_patch_assembly('GCA_000001405.29'))
+            self.assertEqual(get_assembly_name_and_taxonomy_id('GCA_000001405.29'), ('GRCh38.p14', 9606))
+            self.assertEqual(ena_record_cache.assembly_patch_count('GCA_000001405.29'), 131)
+        mock_get.assert_called_once_with('https://www.ebi.ac.uk/ena/browser/api/xml/GCA_000001405.29', stream=True)
+
+    def test_ena_record_cache_on_disk(self):
+        with patch('requests.get', return_value=mock_response(self.taxon_set)) as mock_get:
+            ENARecordCache(cache_dir=self.cache_dir).prefetch([9606, 665079], 'taxon')
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.cache_dir, '9606.xml')))
+
+        # A new cache reuses the records stored on disk without contacting ENA
+        record_cache = ENARecordCache(cache_dir=self.cache_dir)
+        with patch('requests.get') as mock_get:
+            self.assertEqual(record_cache.taxon_names(9606), ('Homo sapiens', 'human'))
+            self.assertEqual(record_cache.taxon_names('665079'), ('Sclerotinia sclerotiorum 1980 UF-70', None))
+        mock_get.assert_not_called()
+
+    def test_get_scientific_names_then_single_taxonomy(self):
+        with patch('requests.get', return_value=mock_response(self.taxon_set)) as mock_get:
+            get_scientific_names_and_common_names([9606, 665079])
+            self.assertEqual(get_scientific_name_and_common_name(9606), ('Homo sapiens', 'human'))
+        self.assertEqual(mock_get.call_count, 1)
@@ -0,0 +1,58 @@
+import os
+import shutil
+from unittest.mock import patch
+
+from ebi_eva_common_pyutils.assembly_utils import retrieve_genbank_equivalent_for_GCF_accession
+from ebi_eva_common_pyutils.ncbi_assembly_summary import NCBIAssemblySummaryIndex, AssemblySummary
+from ebi_eva_common_pyutils.ncbi_utils import get_ncbi_assembly_name_from_term, get_species_name_from_ncbi
+from tests.test_common import TestCommon
+
+
+class TestNCBIAssemblySummaryIndex(TestCommon):
+
+    def setUp(self):
+        self.summary_path = os.path.join(self.resources_folder, 'assembly_summary_genbank.txt')
+        self.index = NCBIAssemblySummaryIndex([self.summary_path])
+
+    def test_get(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.get('GCA_000002315.5'), AssemblySummary(
+            'GCA_000002315.5', 'GCF_000002315.6', 'GRCg6a', 9031, 9031, 'Gallus gallus'
+        ))
+        self.assertIsNone(self.index.get('GCA_000000001.1'))
+        self.assertEqual(self.index.get_assembly_name('GCA_000001405.29'), 'GRCh38.p14')
+        self.assertEqual(self.index.get_taxonomy_id('GCA_000188235.2'), 665079)
+
+    def test_get_paired_accession(self):
+        self.assertEqual(self.index.get_paired_accession('GCA_000001405.29'), 'GCF_000001405.40')
+        # The GCF is only in the refseq summary but the pair is resolved from the genbank one
+        self.assertEqual(self.index.get_paired_accession('GCF_000001405.40'), 'GCA_000001405.29')
+        self.assertIsNone(self.index.get_paired_accession('GCA_000188235.2'))
+
+    def test_refresh(self):
+        summary_copy = os.path.join(self.resources_folder, 'assembly_summary_copy.txt')
+        shutil.copy(self.summary_path, summary_copy)
+        try:
+            index = NCBIAssemblySummaryIndex([summary_copy])
+            self.assertEqual(index.refresh(), [])
+            with open(summary_copy) as open_file:
+                lines = [line for line in open_file if not line.startswith('GCA_000002315.5')]
+            with open(summary_copy, 'w') as open_file:
+                open_file.writelines(lines)
+            self.assertEqual(index.refresh(), [summary_copy])
+            self.assertEqual(len(index), 2)
+            self.assertNotIn('GCA_000002315.5', index)
+            self.assertIsNone(index.get_paired_accession('GCF_000002315.6'))
+        finally:
+            os.remove(summary_copy)
+
+    def test_functions_consult_index(self):
+        with patch('ebi_eva_common_pyutils.ncbi_utils.ncbi_assembly_summary_index', self.index), \
+                patch('ebi_eva_common_pyutils.assembly_utils.ncbi_assembly_summary_index', self.index), \
+                patch('ebi_eva_common_pyutils.ncbi_utils.get_ncbi_assembly_dicts_from_term') as mock_search, \
+                patch('ebi_eva_common_pyutils.ncbi_utils.retrieve_species_scientific_name_from_tax_id_ncbi',
+                      return_value='Gallus gallus'):
+            self.assertEqual(get_ncbi_assembly_name_from_term('GCA_000002315.5'), 'GRCg6a')
+            self.assertEqual(get_species_name_from_ncbi('GCA_000002315.5'), 'gallus_gallus')
+            self.assertEqual(retrieve_genbank_equivalent_for_GCF_accession('GCF_000002315.6'), 'GCA_000002315.5')
+        mock_search.assert_not_called()
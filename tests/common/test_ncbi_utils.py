@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from ebi_eva_common_pyutils.assembly_utils import retrieve_genbank_assembly_accessions_from_ncbi
+from ebi_eva_common_pyutils.ncbi_utils import esearch_url, esummary_url, get_ncbi_assembly_dicts_from_term, \
+    iter_ncbi_assembly_dicts_from_term, _wait_for_eutils_rate_limit
+
+
+def fake_eutils(nb_results):
+    def eutils_json_request(url, payload, api_key=None):
+        if url == esearch_url:
+            assert payload['usehistory'] == 'y'
+            return {'esearchresult': {'count': str(nb_results), 'querykey': '1', 'webenv': 'MCID_1'}}
+        assert url == esummary_url and payload['WebEnv'] == 'MCID_1' and payload['query_key'] == '1'
+        uids = [str(uid) for uid in range(payload['retstart'], min(payload['retstart'] + payload['retmax'],
+                                                                   nb_results))]
+        result = {uid: {'uid': uid, 'synonym': {'genbank': f'GCA_{uid}.1'}} for uid in uids}
+        result['uids'] = uids
+        return {'result': result}
+    return eutils_json_request
+
+
+class TestNcbiUtils(TestCase):
+
+    def test_iter_ncbi_assembly_dicts_from_term(self):
+        with patch('ebi_eva_common_pyutils.ncbi_utils._eutils_json_request', side_effect=fake_eutils(1234)) \
+                as mock_request:
+            assembly_dicts = list(iter_ncbi_assembly_dicts_from_term('Homo sapiens', page_size=100, max_workers=2))
+        # All the results are retrieved, in the search order
+        self.assertEqual([d['uid'] for d in assembly_dicts], [str(uid) for uid in range(1234)])
+        # One search then 13 pages
+        self.assertEqual(mock_request.call_count, 14)
+
+    def test_get_ncbi_assembly_dicts_from_term_no_result(self):
+        with patch('ebi_eva_common_pyutils.ncbi_utils._eutils_json_request', side_effect=fake_eutils(0)) \
+                as mock_request:
+            self.assertEqual(get_ncbi_assembly_dicts_from_term('nothing'), [])
+        mock_request.assert_called_once()
+
+    def test_retrieve_genbank_assembly_accessions_from_ncbi_all_pages(self):
+        with patch('ebi_eva_common_pyutils.ncbi_utils._eutils_json_request', side_effect=fake_eutils(600)):
+            self.assertEqual(len(retrieve_genbank_assembly_accessions_from_ncbi('Bos taurus')), 600)
+
+    def test_wait_for_eutils_rate_limit(self):
+        with patch('ebi_eva_common_pyutils.ncbi_utils.time') as mock_time, \
+                patch('ebi_eva_common_pyutils.ncbi_utils._eutils_next_request_time', 0.0):
+            mock_time.monotonic.return_value = 100.0
+            # The requests of all the threads are spaced by a third of a second without an api_key
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                list(executor.map(lambda _: _wait_for_eutils_rate_limit(), range(3)))
+            _wait_for_eutils_rate_limit(api_key='key')
+            _wait_for_eutils_rate_limit(api_key='key')
+        waits = sorted(round(call.args[0], 2) for call in mock_time.sleep.call_args_list)
+        self.assertEqual(waits, [0, 0.33, 0.67, 1, 1.1])
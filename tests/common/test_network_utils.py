@@ -0,0 +1,239 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch, Mock
+
+import requests
+
+from ebi_eva_common_pyutils import network_utils
+from ebi_eva_common_pyutils.network_utils import iter_json_array, json_request, get_session, json_request_iter, \
+    wait_for_port, ssh_tunnel, forward_remote_port_to_local_port, get_free_local_port, get_available_local_port, \
+    TunnelPool
+from tests.test_common import TestCommon
+
+
+class TestNetworkUtils(TestCase):
+
+    def test_iter_json_array(self):
+        elements = [{'taxonomy_id': 9606, 'name': 'homo [sapiens], "human"'}, 12345, -1.5e3, 'text', None, True, [1, []]]
+        document = json.dumps(elements, indent=2)
+        for chunk_size in (1, 3, 7, len(document)):
+            chunks = [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
+            self.assertEqual(list(iter_json_array(chunks)), elements)
+        self.assertEqual(list(iter_json_array(['  [ ', ' ]'])), [])
+        with self.assertRaises(ValueError):
+            list(iter_json_array(['{"not": "an array"}']))
+        for malformed in ('[1, 2', '[1,,2]', '[1 2]', '[,1]', '[1,]', '[1}', '[tru]'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array([malformed]))
+        # A large element spread over many chunks
+        document = json.dumps([{'sequence': 'ACGT\\"' * 5000}, 'end'])
+        chunks = [document[i:i + 10] for i in range(0, len(document), 10)]
+        self.assertEqual(list(iter_json_array(chunks)), [{'sequence': 'ACGT\\"' * 5000}, 'end'])
+
+    def test_json_request_uses_pooled_session(self):
+        with patch.object(requests.Session, 'get', return_value=Mock(json=Mock(return_value={'a': 1}))) as mock_get:
+            self.assertEqual(json_request('https://example.org/api'), {'a': 1})
+            mock_get.assert_called_once_with('https://example.org/api', data=None)
+        self.assertIs(get_session(), get_session())
+        # Other callables are still supported
+        method = Mock(return_value=Mock(json=Mock(return_value={'b': 2})))
+        self.assertEqual(json_request('https://example.org/api', method=method), {'b': 2})
+
+    def test_json_request_iter(self):
+        response = Mock(encoding='utf-8', iter_content=Mock(return_value=iter(['[{"a"', ': 1}, {"a": 2}]'])))
+        response.__enter__ = Mock(return_value=response)
+        response.__exit__ = Mock(return_value=None)
+        with patch.object(requests.Session, 'get', return_value=response) as mock_get:
+            self.assertEqual(list(json_request_iter('https://example.org/api')), [{'a': 1}, {'a': 2}])
+            mock_get.assert_called_once_with('https://example.org/api', data=None, stream=True)
+
+
+class TestPortForwarding(TestCase):
+
+    def test_wait_for_port(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.bind(('localhost', 0))
+            server.listen()
+            port = server.getsockname()[1]
+            wait_for_port(port, timeout=1)
+        with self.assertRaises(TimeoutError):
+            wait_for_port(port, timeout=0.2)
+        # Fails straight away when the process supposed to open the port has died
+        proc = Mock(poll=Mock(return_value=255), returncode=255, args=['ssh'])
+        with self.assertRaises(subprocess.CalledProcessError):
+            wait_for_port(port, timeout=10, proc=proc)
+
+    def test_forward_remote_port_to_local_port(self):
+        proc = Mock(pid=1234, poll=Mock(return_value=None))
+        with patch('subprocess.Popen', return_value=proc) as mock_popen, \
+                patch('ebi_eva_common_pyutils.network_utils.is_port_in_use', return_value=False), \
+                patch('ebi_eva_common_pyutils.network_utils.wait_for_port') as mock_wait:
+            self.assertEqual(forward_remote_port_to_local_port('remote', 27017, 27018), 1234)
+        mock_popen.assert_called_once_with(
+            ['ssh', '-N', '-o', 'ExitOnForwardFailure=yes', '-L27018:localhost:27017', 'remote']
+        )
+        mock_wait.assert_called_once_with(27018, timeout=30, proc=proc)
+
+    def test_forward_to_port_in_use(self):
+        with patch('subprocess.Popen') as mock_popen, \
+                patch('ebi_eva_common_pyutils.network_utils.is_port_in_use', return_value=True):
+            with self.assertRaises(OSError):
+                forward_remote_port_to_local_port('remote', 27017, 27018)
+        mock_popen.assert_not_called()
+
+    def test_forward_fails_after_port_opened(self):
+        # ssh exits on forwarding failure after something else opened the port
+        proc = Mock(pid=1234, poll=Mock(return_value=255), returncode=255, args=['ssh'])
+        with patch('subprocess.Popen', return_value=proc), \
+                patch('ebi_eva_common_pyutils.network_utils.is_port_in_use', return_value=False), \
+                patch('ebi_eva_common_pyutils.network_utils.wait_for_port'):
+            with self.assertRaises(subprocess.CalledProcessError):
+                forward_remote_port_to_local_port('remote', 27017, 27018)
+
+    def test_ssh_tunnel_reused(self):
+        proc = Mock(poll=Mock(return_value=None))
+        with patch('subprocess.Popen', return_value=proc) as mock_popen, \
+                patch('ebi_eva_common_pyutils.network_utils.is_port_in_use', return_value=False), \
+                patch('ebi_eva_common_pyutils.network_utils.wait_for_port'):
+            with ssh_tunnel('remote', 27017, 27018) as local_port:
+                with ssh_tunnel('remote', 27017) as other_local_port:
+                    self.assertEqual(local_port, other_local_port)
+                # The tunnel does not forward to the requested port
+                with self.assertRaises(ValueError):
+                    with ssh_tunnel('remote', 27017, 27019):
+                        pass
+                proc.terminate.assert_not_called()
+            proc.terminate.assert_called_once()
+            mock_popen.assert_called_once()
+        self.assertEqual(network_utils._tunnels, {})
+
+    def test_ssh_tunnel_opened_concurrently(self):
+        starting = threading.Event()
+        release_start = threading.Event()
+
+        def start_port_forwarding(remote_host, remote_port, local_port, timeout):
+            if remote_port == 27017:
+                starting.set()
+                release_start.wait(10)
+            return Mock(poll=Mock(return_value=None)), remote_port + 1000
+
+        with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                   side_effect=start_port_forwarding) as mock_start, ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(network_utils.open_ssh_tunnel, 'remote', 27017)
+            starting.wait(10)
+            second = executor.submit(network_utils.open_ssh_tunnel, 'remote', 27017)
+            # Another tunnel can be opened and closed while the first one starts
+            other_tunnel = network_utils.open_ssh_tunnel('remote', 5432)
+            network_utils.close_ssh_tunnel(other_tunnel)
+            self.assertFalse(second.done())
+            release_start.set()
+            tunnel = first.result(10)
+            # The second caller waited for the tunnel being started and reused it
+            self.assertIs(second.result(10), tunnel)
+            self.assertEqual(tunnel.ref_count, 2)
+            self.assertEqual(mock_start.call_count, 2)
+            network_utils.close_ssh_tunnel(tunnel)
+            network_utils.close_ssh_tunnel(tunnel)
+        self.assertEqual(network_utils._tunnels, {})
+
+
+class TestTunnelPool(TestCommon):
+
+    def setUp(self) -> None:
+        self.registry_dir = os.path.join(self.resources_folder, 'tunnels')
+        self.pool = TunnelPool(self.registry_dir)
+        # Stand-ins for the port forwarded and the ssh process, with the same forwarding arguments
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('localhost', 0))
+        self.server.listen()
+        self.local_port = self.server.getsockname()[1]
+        self.proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)',
+                                      f'-L{self.local_port}:localhost:27017', 'remote'])
+        # The command line of the child process is only set once it has executed the command
+        while not network_utils._is_port_forwarding_process(self.proc.pid, 'remote', 27017, self.local_port):
+            time.sleep(0.01)
+
+    def tearDown(self) -> None:
+        self.server.close()
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        shutil.rmtree(self.registry_dir)
+
+    def test_get_free_local_port(self):
+        port = get_free_local_port()
+        self.assertGreater(port, 0)
+        self.assertFalse(network_utils.is_port_in_use(port))
+        # The preferred port is in use so the next one or one assigned by the kernel is returned
+        self.assertNotEqual(get_available_local_port(self.local_port), self.local_port)
+        self.assertGreater(get_available_local_port(), 0)
+
+    def test_tunnel_shared_between_processes(self):
+        with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                   return_value=(self.proc, self.local_port)) as mock_start:
+            with self.pool.tunnel('remote', 27017) as local_port:
+                self.assertEqual(local_port, self.local_port)
+                # Another process on the node gets the same tunnel
+                other_pool = TunnelPool(self.registry_dir)
+                self.assertEqual(other_pool.acquire('remote', 27017), self.local_port)
+                with open(os.path.join(self.registry_dir, 'remote_27017.json')) as open_file:
+                    self.assertEqual(json.load(open_file)['users'], {str(os.getpid()): 2})
+                other_pool.release('remote', 27017)
+                self.assertIsNone(self.proc.poll())
+            mock_start.assert_called_once()
+        # The last user stopped the tunnel
+        self.assertIsNotNone(self.proc.poll())
+        self.assertFalse(os.path.exists(os.path.join(self.registry_dir, 'remote_27017.json')))
+
+    def test_tunnel_pid_reused(self):
+        with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                   return_value=(self.proc, self.local_port)):
+            self.pool.acquire('remote', 27017)
+        # The pid recorded in the registry now belongs to an unrelated process
+        unrelated_proc = subprocess.Popen(['sleep', '60'])
+        entry_path = os.path.join(self.registry_dir, 'remote_27017.json')
+        with open(entry_path) as open_file:
+            entry = json.load(open_file)
+        entry['pid'] = unrelated_proc.pid
+        with open(entry_path, 'w') as open_file:
+            json.dump(entry, open_file)
+        try:
+            TunnelPool(self.registry_dir).release('remote', 27017)
+            self.assertIsNone(unrelated_proc.poll())
+            self.assertFalse(os.path.exists(entry_path))
+        finally:
+            unrelated_proc.kill()
+            unrelated_proc.wait()
+
+    def test_tunnel_started_concurrently(self):
+        other_proc = subprocess.Popen(['sleep', '60'])
+
+        def start_port_forwarding(remote_host, remote_port, timeout):
+            # Another process registers its tunnel while this one starts
+            with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                       return_value=(self.proc, self.local_port)):
+                TunnelPool(self.registry_dir).acquire('remote', 27017)
+            return other_proc, get_free_local_port()
+
+        with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                   side_effect=start_port_forwarding):
+            self.assertEqual(self.pool.acquire('remote', 27017), self.local_port)
+        # The tunnel started last is stopped in favour of the registered one
+        self.assertIsNotNone(other_proc.wait(timeout=10))
+        self.assertIsNone(self.proc.poll())
+
+    def test_dead_tunnel_replaced(self):
+        with patch('ebi_eva_common_pyutils.network_utils._start_port_forwarding_on_free_port',
+                   return_value=(self.proc, self.local_port)) as mock_start:
+            self.pool.acquire('remote', 27017)
+            self.server.close()
+            self.pool.acquire('remote', 27017)
+            self.assertEqual(mock_start.call_count, 2)
@@ -1,9 +1,129 @@
+import os
 import unittest
+from unittest.mock import patch, Mock
+
+import requests
 
 from ebi_eva_common_pyutils.assembly_utils import retrieve_genbank_assembly_accessions_from_ncbi
+from ebi_eva_common_pyutils.variation.chromosome_name_cache import ChromosomeNameCache
+from ebi_eva_common_pyutils.variation.contig_utils import get_chromosome_names_for_contig_accessions
+from tests.test_common import TestCommon
 
 
 class TestAssemblyUtils(unittest.TestCase):
     def test_retrieve_genbank_assembly_accessions_from_ncbi(self):
         info = retrieve_genbank_assembly_accessions_from_ncbi('GCA_002263795.2')
         print(info)
+
+
+class TestContigUtils(unittest.TestCase):
+    def test_get_chromosome_names_for_contig_accessions(self):
+        def resolve(contig_accession, line_limit):
+            if contig_accession == 'CM000001.1':
+                return '1'
+            if contig_accession == 'CM000002.1':
+                return 'X' if line_limit == 10000 else ''
+            raise requests.ConnectionError('ENA is down')
+
+        with patch('ebi_eva_common_pyutils.variation.contig_utils._resolve_contig_accession_to_chromosome_name',
+                   side_effect=resolve) as mock_resolve:
+            chromosome_names, errors = get_chromosome_names_for_contig_accessions(
+                ['CM000001.1', 'CM000002.1', 'AABR07050911.1', 'CM000003.1', 'CM000001.1'], tries=2
+            )
+        self.assertEqual(chromosome_names, {'CM000001.1': '1', 'CM000002.1': 'X', 'AABR07050911.1': None})
+        self.assertEqual(list(errors), ['CM000003.1'])
+        self.assertIsInstance(errors['CM000003.1'], requests.ConnectionError)
+        # WGS accession is never sent to ENA and duplicates are only resolved once
+        called_accessions = [c.args[0] for c in mock_resolve.call_args_list]
+        self.assertNotIn('AABR07050911.1', called_accessions)
+        self.assertEqual(called_accessions.count('CM000001.1'), 1)
+        self.assertEqual(called_accessions.count('CM000003.1'), 2)
+
+
+class TestChromosomeNameCache(TestCommon):
+
+    def setUp(self) -> None:
+        self.cache_path = os.path.join(self.resources_folder, 'chromosome_name_cache.sqlite')
+        self.cache = ChromosomeNameCache(self.cache_path)
+
+    def tearDown(self) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.cache_path + suffix):
+                os.remove(self.cache_path + suffix)
+
+    def test_get_chromosome_name_for_contig_accession(self):
+        with patch('ebi_eva_common_pyutils.variation.chromosome_name_cache.get_chromosome_name_for_contig_accession',
+                   side_effect=['12', '']) as mock_resolve:
+            for _ in range(2):
+                self.assertEqual(self.cache.get_chromosome_name_for_contig_accession('CM003032.1'), '12')
+                self.assertIsNone(self.cache.get_chromosome_name_for_contig_accession('CM000001.1'))
+                self.assertIsNone(self.cache.get_chromosome_name_for_contig_accession('AABR07050911.1'))
+            self.assertEqual(mock_resolve.call_count, 2)
+        # Other instances, possibly in other processes, share the same results
+        self.assertEqual(ChromosomeNameCache(self.cache_path).get('CM003032.1'), (True, '12'))
+
+    def test_negative_ttl(self):
+        cache = ChromosomeNameCache(self.cache_path, negative_ttl=-1)
+        cache.set_many({'CM003032.1': '12', 'CM000001.1': ''})
+        self.assertEqual(cache.get('CM003032.1'), (True, '12'))
+        self.assertEqual(cache.get('CM000001.1'), (False, None))
+
+    def test_failed_request_not_cached(self):
+        error_response = Mock(status_code=503, content=b'<html>Service Unavailable</html>')
+        error_response.raise_for_status.side_effect = requests.HTTPError('503 Server Error')
+        with patch('requests.get', return_value=error_response), \
+                patch('ebi_eva_common_pyutils.variation.contig_utils.retry_call',
+                      side_effect=lambda f, fargs, **kwargs: f(*fargs)):
+            chromosome_names, errors = self.cache.get_chromosome_names_for_contig_accessions(['CM000001.1'])
+        self.assertEqual(chromosome_names, {})
+        self.assertIsInstance(errors['CM000001.1'], requests.HTTPError)
+        self.assertEqual(self.cache.get('CM000001.1'), (False, None))
+        # A successful response without chromosome name is a negative result
+        empty_response = Mock(status_code=200, content=b'ID   CM000001; SV 1; linear; genomic DNA\n')
+        with patch('requests.get', return_value=empty_response), \
+                patch('ebi_eva_common_pyutils.variation.contig_utils.retry_call',
+                      side_effect=lambda f, fargs, **kwargs: f(*fargs)):
+            chromosome_names, errors = self.cache.get_chromosome_names_for_contig_accessions(['CM000001.1'])
+        self.assertEqual(chromosome_names, {'CM000001.1': None})
+        self.assertEqual(self.cache.get('CM000001.1'), (True, None))
+        # So is an unknown accession, which is requested once for each line limit without retries
+        not_found_response = Mock(status_code=404, content=b'<html>Not Found</html>')
+        with patch('requests.get', return_value=not_found_response) as mock_get:
+            chromosome_names, errors = self.cache.get_chromosome_names_for_contig_accessions(['CM000002.1'])
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual((chromosome_names, errors), ({'CM000002.1': None}, {}))
+        self.assertEqual(self.cache.get('CM000002.1'), (True, None))
+
+    def test_get_chromosome_names_for_contig_accessions(self):
+        self.cache.set('CM003032.1', '12')
+        with patch('ebi_eva_common_pyutils.variation.chromosome_name_cache.get_chromosome_names_for_contig_accessions',
+                   return_value=({'CM000001.1': '1'}, {'CM000002.1': ValueError()})) as mock_resolve:
+            chromosome_names, errors = self.cache.get_chromosome_names_for_contig_accessions(
+                ['CM003032.1', 'CM000001.1', 'CM000002.1']
+            )
+        mock_resolve.assert_called_once_with(['CM000001.1', 'CM000002.1'], max_workers=10, tries=3)
+        self.assertEqual(chromosome_names, {'CM003032.1': '12', 'CM000001.1': '1'})
+        self.assertEqual(list(errors), ['CM000002.1'])
+        self.assertEqual(self.cache.get('CM000002.1'), (False, None))
+
+    def test_load_assembly_report_and_export(self):
+        assembly_report = os.path.join(self.resources_folder, 'assembly_report_for_cache.txt')
+        export_path = os.path.join(self.resources_folder, 'chromosome_names.tsv')
+        with open(assembly_report, 'w') as open_file:
+            open_file.write('# Assembly name:  Thingy\n')
+            open_file.write('# Sequence-Name\tSequence-Role\tAssigned-Molecule\tAssigned-Molecule-Location/Type\t'
+                            'GenBank-Accn\tRelationship\tRefSeq-Accn\tAssembly-Unit\tSequence-Length\t'
+                            'UCSC-style-name\n')
+            open_file.write('1\tassembled-molecule\t1\tChromosome\tCM000001.1\t=\tNC_000001.1\tPrimary Assembly\t10\tna\n')
+            open_file.write('MT\tassembled-molecule\tMT\tMitochondrion\tCM000002.1\t=\tNC_000002.1\tnon-nuclear\t5\tna\n')
+            open_file.write('scaf1\tunplaced-scaffold\tna\tna\tAABR01000001.1\t=\tna\tPrimary Assembly\t3\tna\n')
+        try:
+            self.assertEqual(self.cache.load_assembly_report(assembly_report), 1)
+            self.assertEqual(self.cache.get('CM000001.1'), (True, '1'))
+            self.assertEqual(self.cache.export(export_path), 1)
+            with open(export_path) as open_file:
+                self.assertEqual(open_file.read(), 'contig_accession\tchromosome_name\nCM000001.1\t1\n')
+        finally:
+            os.remove(assembly_report)
+            if os.path.exists(export_path):
+                os.remove(export_path)
@@ -0,0 +1,107 @@
+import threading
+import time
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from ebi_eva_internal_pyutils.dbsnp_query_executor import DbsnpQueryExecutor
+from tests.test_common import TestCommon
+
+species_info = [
+    {'database_name': 'cow_9913', 'scientific_name': 'Bos taurus', 'dbsnp_build': 150, 'pg_host': 'host1',
+     'pg_port': 5432},
+    {'database_name': 'chicken_9031', 'scientific_name': 'Gallus gallus', 'dbsnp_build': 150, 'pg_host': 'host1',
+     'pg_port': 5432},
+    {'database_name': 'dog_9615', 'scientific_name': 'Canis lupus familiaris', 'dbsnp_build': 150,
+     'pg_host': 'host2', 'pg_port': 5432}
+]
+
+
+class TestDbsnpQueryExecutor(TestCommon):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.queried = []
+        self.max_running = {}
+
+        self.pools = []
+        pools = self.pools
+
+        class MockPool:
+            def __init__(self, max_size, **connect_kwargs):
+                self.max_size = max_size
+                self.connect_kwargs = connect_kwargs
+                self.closed = False
+                pools.append(self)
+
+            @contextmanager
+            def connection(self):
+                yield self.connect_kwargs
+
+            def close(self):
+                self.closed = True
+
+        def iter_batches(connect_kwargs, query, batch_size):
+            host = connect_kwargs['host']
+            database_name = query.split()[3].split('.')[0]
+            self.queried.append(database_name)
+            with self.lock:
+                self.running[host] = self.running.get(host, 0) + 1
+                self.max_running[host] = max(self.max_running.get(host, 0), self.running[host])
+            time.sleep(0.05)
+            with self.lock:
+                self.running[host] -= 1
+            if database_name == 'dog_9615':
+                raise ValueError('relation does not exist')
+            yield [(query, 1), (query, 2)]
+            yield [(query, 3)]
+
+        self.patches = [
+            patch('ebi_eva_internal_pyutils.dbsnp_query_executor.PGConnectionPool', MockPool),
+            patch('ebi_eva_internal_pyutils.dbsnp_query_executor.iter_result_batches_for_query', iter_batches)
+        ]
+        for patcher in self.patches:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patches:
+            patcher.stop()
+
+    def test_run(self):
+        executor = DbsnpQueryExecutor(species_info, max_connections_per_host=1)
+        results = list(executor.run(lambda info: f'SELECT * FROM {info["database_name"]}.b150_snpmapinfo'))
+        self.assertEqual(sorted(results), [
+            ('chicken_9031', ('SELECT * FROM chicken_9031.b150_snpmapinfo', 1)),
+            ('chicken_9031', ('SELECT * FROM chicken_9031.b150_snpmapinfo', 2)),
+            ('chicken_9031', ('SELECT * FROM chicken_9031.b150_snpmapinfo', 3)),
+            ('cow_9913', ('SELECT * FROM cow_9913.b150_snpmapinfo', 1)),
+            ('cow_9913', ('SELECT * FROM cow_9913.b150_snpmapinfo', 2)),
+            ('cow_9913', ('SELECT * FROM cow_9913.b150_snpmapinfo', 3))
+        ])
+        # Both databases of host1 were not queried at the same time
+        self.assertEqual(self.max_running, {'host1': 1, 'host2': 1})
+        self.assertEqual(executor.reports['cow_9913'].rows, 3)
+        self.assertIsNone(executor.reports['cow_9913'].error)
+        self.assertGreater(executor.reports['cow_9913'].seconds, 0)
+        self.assertEqual(executor.reports['dog_9615'].rows, 0)
+        self.assertIsInstance(executor.reports['dog_9615'].error, ValueError)
+        # One pool for each dbSNP database, closed at the end of the run
+        self.assertEqual(sorted((pool.connect_kwargs['host'], pool.max_size) for pool in self.pools),
+                         [('host1', 1), ('host2', 1)])
+        self.assertTrue(all(pool.closed for pool in self.pools))
+
+    def test_run_stopped_early(self):
+        executor = DbsnpQueryExecutor(species_info, max_workers=1, queue_size=1)
+        results = executor.run(lambda info: f'SELECT * FROM {info["database_name"]}.b150_snpmapinfo')
+        database_name, row = next(results)
+        results.close()
+        self.assertEqual(database_name, 'cow_9913')
+        # The queries that had not started yet are not run
+        self.assertEqual(self.queried, ['cow_9913'])
+        self.assertTrue(all(pool.closed for pool in self.pools))
+
+    def test_run_invalid_species(self):
+        executor = DbsnpQueryExecutor([{'scientific_name': 'Bos taurus'}] + species_info[:1])
+        results = list(executor.run(lambda info: f'SELECT * FROM {info["database_name"]}.b150_snpmapinfo'))
+        self.assertEqual(len(results), 3)
+        self.assertIsInstance(executor.reports[None].error, KeyError)
@@ -0,0 +1,58 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from ebi_eva_internal_pyutils.metadata_code_cache import metadata_code_cache
+from ebi_eva_internal_pyutils.metadata_utils import get_taxonomy_code_from_metadata, get_assembly_code_from_metadata, \
+    resolve_existing_variant_warehouse_db_name, insert_taxonomy
+
+
+class TestMetadataCodeCache(TestCase):
+
+    def setUp(self):
+        metadata_code_cache.clear()
+        self.db_handle = MagicMock(dsn='dbname=metadata host=pgsql')
+
+    def tearDown(self):
+        metadata_code_cache.clear()
+
+    def test_lookups_cached(self):
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[(9606, 'hsapiens')]) as mock_query:
+            self.assertEqual(get_taxonomy_code_from_metadata(self.db_handle, 9606), 'hsapiens')
+            self.assertEqual(get_taxonomy_code_from_metadata(self.db_handle, '9606'), 'hsapiens')
+        mock_query.assert_called_once()
+        self.assertEqual(metadata_code_cache.stats()['taxonomy'], {'hits': 1, 'misses': 1})
+
+        # Another database does not share the entries
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[]) as mock_query:
+            self.assertIsNone(get_taxonomy_code_from_metadata(MagicMock(dsn='dbname=other'), 9606))
+            # Missing codes are not cached without a preload
+            self.assertIsNone(get_assembly_code_from_metadata(self.db_handle, 'GCA_000001405.15'))
+            self.assertIsNone(get_assembly_code_from_metadata(self.db_handle, 'GCA_000001405.15'))
+        self.assertEqual(mock_query.call_count, 3)
+
+    def test_preload(self):
+        with patch('ebi_eva_internal_pyutils.metadata_code_cache.get_all_results_for_query', side_effect=[
+            [(9606, 'hsapiens'), (9031, 'ggallus'), (9031, 'chicken')],
+            [('GCA_000001405.15', 'grch38')]
+        ]):
+            metadata_code_cache.preload(self.db_handle)
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[(9031, 'ggallus'), (9031, 'chicken')]) as mock_query:
+            self.assertEqual(resolve_existing_variant_warehouse_db_name(self.db_handle, 'GCA_000001405.15', 9606),
+                             'eva_hsapiens_grch38')
+            self.assertIsNone(get_assembly_code_from_metadata(self.db_handle, 'GCA_000000001.1'))
+            mock_query.assert_not_called()
+            # Taxonomies with several codes are still reported by the database lookup
+            with self.assertRaises(ValueError):
+                get_taxonomy_code_from_metadata(self.db_handle, 9031)
+        self.assertEqual(metadata_code_cache.stats(), {'taxonomy': {'hits': 1, 'misses': 1},
+                                                       'assembly': {'hits': 2, 'misses': 0}})
+
+    def test_invalidated_on_insert(self):
+        with patch('ebi_eva_internal_pyutils.metadata_code_cache.get_all_results_for_query', side_effect=[[], []]):
+            metadata_code_cache.preload(self.db_handle)
+        self.assertEqual(metadata_code_cache.get(self.db_handle, 'taxonomy', 9606), (True, None))
+        insert_taxonomy(self.db_handle, 9606, 'Homo sapiens', 'human', 'hsapiens', 'human')
+        self.assertEqual(metadata_code_cache.get(self.db_handle, 'taxonomy', 9606), (False, None))
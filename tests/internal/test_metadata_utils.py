@@ -3,7 +3,9 @@ from unittest.mock import MagicMock, patch
 
 from ebi_eva_internal_pyutils.metadata_utils import resolve_variant_warehouse_db_name, get_taxonomy_code_from_metadata, \
     get_assembly_code_from_metadata, insert_new_assembly_and_taxonomy, build_taxonomy_code, \
-    ensure_taxonomy_is_in_evapro, insert_assembly_in_evapro, update_accessioning_status, get_assembly_code
+    ensure_taxonomy_is_in_evapro, insert_assembly_in_evapro, update_accessioning_status, get_assembly_code, \
+    insert_new_assemblies_and_taxonomies, get_taxonomy_codes_from_metadata, get_assembly_sets_from_metadata
+from ebi_eva_internal_pyutils.metadata_code_cache import metadata_code_cache
 
 
 class TestMetadata(TestCase):
@@ -17,19 +19,22 @@ class TestMetadata(TestCase):
 
     def test_get_taxonomy_code_from_metadata(self):
         db_handle = MagicMock()
-        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_query', return_value=[('hsapiens',)]):
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[(9096, 'hsapiens')]):
             taxcode = get_taxonomy_code_from_metadata(db_handle, 9096)
             assert taxcode == 'hsapiens'
 
     def test_get_assembly_code(self):
         db_handle = MagicMock()
-        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_query', return_value=[('',)]):
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[('GCA_000001405.9', '')]):
             assembly_code = get_assembly_code(db_handle, 'GCA_000001405.9')
             assert assembly_code == 'grch37'
 
     def test_get_assembly_code_from_metadata(self):
         db_handle = MagicMock()
-        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_query', return_value=[('grch38',)]):
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[('GCA_000001405.15', 'grch38')]):
             assembly_code = get_assembly_code_from_metadata(db_handle, 'GCA_000001405.15')
             assert assembly_code == 'grch38'
 
@@ -75,7 +80,7 @@ class TestMetadata(TestCase):
         db_handle = MagicMock()
         ensure_taxonomy_is_in_evapro(db_handle, 9606)
         # Checks that the taxonomy does not exist then
-        db_handle.cursor().execute.assert_any_call('SELECT taxonomy_id FROM evapro.taxonomy WHERE taxonomy_id=9606')
+        db_handle.cursor().__enter__().execute.assert_any_call('EXECUTE metadata_taxonomies (%s)', ([9606],))
         # Insert the taxonomy with the appropriate species name
         db_handle.cursor().execute.assert_any_call(
             'INSERT INTO evapro.taxonomy(taxonomy_id, common_name, scientific_name, taxonomy_code, eva_name) '
@@ -101,7 +106,7 @@ class TestMetadata(TestCase):
 
     def test_insert_assembly_in_evapro_no_insert(self):
         db_handle = MagicMock()
-        db_handle.cursor().__enter__().fetchall.return_value = (9606,)
+        db_handle.cursor().__enter__().fetchall.return_value = [(9606,)]
         with patch('ebi_eva_internal_pyutils.metadata_utils.insert_taxonomy') as mock_insert:
             ensure_taxonomy_is_in_evapro(db_handle, 9606)
         mock_insert.assert_not_called()
@@ -138,7 +143,8 @@ class TestMetadata(TestCase):
         with patch('ebi_eva_internal_pyutils.metadata_utils.ensure_taxonomy_is_in_evapro') as mock_tax_in_evapro, \
                 patch('ebi_eva_internal_pyutils.metadata_utils.insert_assembly_in_evapro') as mock_insert_assembly, \
                 patch('ebi_eva_internal_pyutils.metadata_utils.update_accessioning_status') as mock_update_status, \
-                patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_query') as mock_get_results:
+                patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                      return_value=[]) as mock_get_results:
             insert_new_assembly_and_taxonomy(db_handle, 'GCA_000001405.15', 9606)
         mock_tax_in_evapro.assert_called_once_with(db_handle, 9606, None)
         mock_insert_assembly.assert_called_once_with(db_handle, 9606, 'GCA_000001405.15', 'GRCh38', 'grch38')
@@ -149,9 +155,77 @@ class TestMetadata(TestCase):
         with patch('ebi_eva_internal_pyutils.metadata_utils.ensure_taxonomy_is_in_evapro') as mock_tax_in_evapro, \
                 patch('ebi_eva_internal_pyutils.metadata_utils.insert_assembly_in_evapro') as mock_insert_assembly, \
                 patch('ebi_eva_internal_pyutils.metadata_utils.update_accessioning_status') as mock_update_status, \
-                patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_query') as mock_get_results:
-            mock_get_results.return_value = ((1,),)
+                patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query') \
+                as mock_get_results:
+            mock_get_results.return_value = (('GCA_000001405.15', 9606, 1),)
             insert_new_assembly_and_taxonomy(db_handle, 'GCA_000001405.15', 9606)
         mock_tax_in_evapro.assert_not_called()
         mock_insert_assembly.assert_not_called()
         mock_update_status.assert_called_once_with(db_handle, 'GCA_000001405.15', True)
+
+    def test_insert_new_assemblies_and_taxonomies(self):
+        db_handle = MagicMock()
+        cursor = db_handle.cursor.return_value.__enter__.return_value
+        cursor.fetchall.side_effect = [
+            # Existing assembly sets
+            [('GCA_000001405.15', 9606, 1)],
+            # Existing taxonomies
+            [(9606,)],
+            # Existing assembly codes
+            [('GCA_000001405.15', 'grch38')]
+        ]
+        # The ids are not returned in the order of the values
+        insert_results = [[(3, 9606, 'GRCh38.p14', 'grch38'), (2, 9031, 'GRCg6a', 'grcg6a')]]
+
+        def execute_values(cur, query, values, fetch=False):
+            return insert_results.pop() if fetch else None
+
+        with patch('ebi_eva_internal_pyutils.metadata_utils.execute_values', side_effect=execute_values) \
+                as mock_execute_values, \
+                patch('ebi_eva_internal_pyutils.metadata_utils.ena_record_cache') as mock_ena_cache, \
+                patch('ebi_eva_internal_pyutils.metadata_utils.get_ncbi_assembly_name_from_term',
+                      side_effect=lambda assembly, api_key: {'GCA_000002315.5': 'GRCg6a',
+                                                             'GCA_000001405.29': 'GRCh38.p14'}[assembly]), \
+                patch('ebi_eva_internal_pyutils.metadata_utils.is_patch_assembly',
+                      side_effect=lambda assembly: assembly == 'GCA_000001405.29'), \
+                patch('ebi_eva_internal_pyutils.metadata_utils.get_scientific_name_and_common_name',
+                      return_value=('Gallus gallus', 'chicken')) as mock_taxonomy_names:
+            assembly_set_ids = insert_new_assemblies_and_taxonomies(
+                db_handle, [('GCA_000001405.15', 9606), ('GCA_000002315.5', 9031), ('GCA_000001405.29', 9606)],
+                eva_species_names={9031: 'red junglefowl'}
+            )
+        self.assertEqual(assembly_set_ids, {('GCA_000001405.15', 9606): 1, ('GCA_000002315.5', 9031): 2,
+                                            ('GCA_000001405.29', 9606): 3})
+        # Only the missing taxonomy is resolved and the ENA records are retrieved in batches
+        mock_taxonomy_names.assert_called_once_with(9031)
+        mock_ena_cache.prefetch.assert_any_call(['GCA_000002315.5', 'GCA_000001405.29'], 'ASSEMBLY')
+        mock_ena_cache.prefetch.assert_any_call([9031], 'taxon')
+
+        insert_calls = [c.args[2] for c in mock_execute_values.call_args_list]
+        self.assertEqual(insert_calls, [
+            [(9031, 'chicken', 'Gallus gallus', 'ggallus', 'red junglefowl')],
+            [(9031, 'GRCg6a', 'grcg6a'), (9606, 'GRCh38.p14', 'grch38')],
+            [(2, 'GCA_000002315.5', 'GCA_000002315', '5'), (3, 'GCA_000001405.29', 'GCA_000001405', '29')],
+            [('GCA_000001405.15', True), ('GCA_000002315.5', True), ('GCA_000001405.29', True)]
+        ])
+        db_handle.commit.assert_called_once()
+
+    def test_get_taxonomy_codes_from_metadata(self):
+        metadata_code_cache.clear()
+        db_handle = MagicMock()
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[(9606, 'hsapiens'), (9031, 'ggallus')]) as mock_query:
+            self.assertEqual(get_taxonomy_codes_from_metadata(db_handle, ['9606', 9031, 1]),
+                             {'9606': 'hsapiens', 9031: 'ggallus'})
+        # All the taxonomies are retrieved in one query
+        mock_query.assert_called_once_with(db_handle, 'metadata_taxonomy_codes',
+                                           'SELECT DISTINCT t.taxonomy_id, t.taxonomy_code FROM taxonomy t '
+                                           'WHERE t.taxonomy_id = ANY($1)', ([9606, 9031, 1],))
+        metadata_code_cache.clear()
+
+    def test_get_assembly_sets_from_metadata(self):
+        db_handle = MagicMock()
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_all_results_for_prepared_query',
+                   return_value=[('GCA_000001405.15', 9606, 1), ('GCA_000001405.15', 9606, 2)]):
+            with self.assertRaises(ValueError):
+                get_assembly_sets_from_metadata(db_handle, ['GCA_000001405.15'])
@@ -0,0 +1,106 @@
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from ebi_eva_internal_pyutils import pg_connection_pool
+from ebi_eva_internal_pyutils.metadata_utils import pooled_metadata_connection_handle
+from ebi_eva_internal_pyutils.pg_connection_pool import PGConnectionPool, get_pg_connection_pool, \
+    close_pg_connection_pools
+from tests.test_common import TestCommon
+
+
+def mock_connection():
+    conn = MagicMock(closed=0)
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+
+class TestPGConnectionPool(TestCommon):
+
+    def setUp(self):
+        self.connect = patch('psycopg2.connect', side_effect=lambda *args, **kwargs: mock_connection())
+        self.mock_connect = self.connect.start()
+
+    def tearDown(self):
+        self.connect.stop()
+        close_pg_connection_pools()
+
+    def test_connection_reused(self):
+        pool = PGConnectionPool(dbname='metadata', host='host', max_size=2)
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            pass
+        self.assertIs(conn1, conn2)
+        self.mock_connect.assert_called_once_with(dbname='metadata', host='host')
+        conn1.commit.assert_called()
+
+    def test_connection_rolled_back_on_error(self):
+        pool = PGConnectionPool(dbname='metadata', max_size=2)
+        with self.assertRaises(ValueError):
+            with pool.connection() as conn:
+                raise ValueError('failure')
+        conn.rollback.assert_called()
+        conn.commit.assert_not_called()
+
+    def test_max_size(self):
+        pool = PGConnectionPool(dbname='metadata', max_size=1, checkout_timeout=0.1)
+        conn = pool.getconn()
+        with self.assertRaises(PoolError):
+            pool.getconn()
+        # Returning the connection from another thread unblocks the checkout
+        threading.Timer(0.05, pool.putconn, args=(conn,)).start()
+        pool.checkout_timeout = 5
+        self.assertIs(pool.getconn(), conn)
+
+    def test_unhealthy_connection_replaced(self):
+        pool = PGConnectionPool(dbname='metadata', max_size=1, health_check_interval=0)
+        with pool.connection() as conn1:
+            pass
+        conn1.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError('closed')
+        with pool.connection() as conn2:
+            pass
+        self.assertIsNot(conn1, conn2)
+        conn1.close.assert_called()
+        self.assertEqual(self.mock_connect.call_count, 2)
+
+    def test_get_pg_connection_pool(self):
+        connect_kwargs = MagicMock(return_value={'dbname': 'metadata'})
+        pool = get_pg_connection_pool(('metadata', 'development'), connect_kwargs)
+        self.assertIs(get_pg_connection_pool(('metadata', 'development'), connect_kwargs), pool)
+        self.assertIsNot(get_pg_connection_pool(('metadata', 'production'), {'dbname': 'metadata'}), pool)
+        # The connection arguments are only resolved once
+        connect_kwargs.assert_called_once()
+        close_pg_connection_pools()
+        self.assertEqual(pg_connection_pool._pools, {})
+
+    def test_close(self):
+        pool = PGConnectionPool(dbname='metadata', max_size=2)
+        idle_conn = pool.getconn()
+        checked_out_conn = pool.getconn()
+        pool.putconn(idle_conn)
+        pool.close()
+        idle_conn.close.assert_called_once()
+        checked_out_conn.close.assert_not_called()
+        pool.putconn(checked_out_conn)
+        checked_out_conn.close.assert_called_once()
+        with self.assertRaises(PoolError):
+            pool.getconn()
+
+    def test_pooled_metadata_connection_handle(self):
+        config_file = os.path.join(self.resources_folder, 'test_config_file.xml')
+        with patch('ebi_eva_internal_pyutils.metadata_utils.get_metadata_creds_for_profile',
+                   return_value=('jdbc:postgresql://pgsql.example.com:5432/testdatabase', 'user', 'pass')) \
+                as mock_creds:
+            with pooled_metadata_connection_handle('test', config_file) as conn1:
+                pass
+            with pooled_metadata_connection_handle('test', config_file) as conn2:
+                pass
+        self.assertIs(conn1, conn2)
+        mock_creds.assert_called_once_with('test', config_file)
+        self.mock_connect.assert_called_once_with(dsn='postgresql://pgsql.example.com:5432/testdatabase',
+                                                  user='user', password='pass')
@@ -0,0 +1,251 @@
+import threading
+import time
+from contextlib import contextmanager
+from io import StringIO
+from unittest import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from ebi_eva_internal_pyutils.pg_utils import get_result_cursor, iter_results_for_query, \
+    iter_result_batches_for_query, copy_from_iterable, copy_to_stream, get_all_results_for_prepared_query, \
+    create_indexes_on_tables, INDEX_EXISTS, INDEX_CREATED, INDEX_FAILED, vacuum_analyze_tables, VACUUM_DONE, \
+    VACUUM_FAILED, _wait_with_progress, _create_index_progress_query
+
+
+def mock_connection(rows, autocommit=False):
+    pg_conn = MagicMock(autocommit=autocommit)
+    pg_cursor = pg_conn.cursor.return_value
+    pg_cursor.__enter__.return_value = pg_cursor
+    pg_cursor.__iter__.side_effect = lambda: iter(rows)
+    batches = [rows[i:i + 2] for i in range(0, len(rows), 2)] + [[]]
+    pg_cursor.fetchmany.side_effect = batches
+    return pg_conn, pg_cursor
+
+
+def mock_pool(catalog_rows, failing_statement=None, server_version=150000, named_indexes=None):
+    """
+    Pool whose first connection returns the catalog_rows and the others run the statements. named_indexes maps the
+    names of the indexes already in the catalog to their table, validity and columns.
+    """
+    connections = []
+    statements = []
+
+    def execute(statement, params=None):
+        statements.append(repr(statement))
+        if failing_statement and failing_statement in repr(statement) and 'DROP' not in repr(statement):
+            raise psycopg2.ProgrammingError('does not exist')
+
+    @contextmanager
+    def connection():
+        pg_conn = MagicMock(autocommit=False, server_version=server_version)
+        pg_cursor = pg_conn.cursor.return_value.__enter__.return_value
+        pg_cursor.fetchall.return_value = catalog_rows if not connections else []
+        pg_cursor.execute.side_effect = execute
+        pg_cursor.fetchone.side_effect = lambda: (named_indexes or {}).get(pg_cursor.execute.call_args[0][1][1])
+        connections.append(pg_conn)
+        yield pg_conn
+
+    pool = MagicMock(max_size=3)
+    pool.connection.side_effect = connection
+    return pool, connections, statements
+
+
+class TestPgUtils(TestCase):
+
+    def test_get_result_cursor(self):
+        pg_conn, pg_cursor = mock_connection([])
+        self.assertIs(get_result_cursor(pg_conn, 'SELECT 1'), pg_cursor)
+        pg_conn.cursor.assert_called_once_with(cursor_factory=None)
+        pg_cursor.execute.assert_called_once_with('SELECT 1')
+
+    def test_get_result_cursor_server_side(self):
+        pg_conn, pg_cursor = mock_connection([], autocommit=True)
+        get_result_cursor(pg_conn, 'SELECT * FROM evapro.taxonomy', server_side=True, itersize=100, row_type='dict')
+        _, kwargs = pg_conn.cursor.call_args
+        self.assertTrue(kwargs['name'].startswith('pg_utils_'))
+        self.assertEqual(kwargs['cursor_factory'], RealDictCursor)
+        self.assertTrue(kwargs['withhold'])
+        self.assertEqual(pg_cursor.itersize, 100)
+        self.assertRaises(ValueError, get_result_cursor, pg_conn, 'SELECT 1', row_type='list')
+
+    def test_iter_results_for_query(self):
+        pg_conn, pg_cursor = mock_connection([(1,), (2,), (3,)])
+        self.assertEqual(list(iter_results_for_query(pg_conn, 'SELECT 1', itersize=10)), [(1,), (2,), (3,)])
+        self.assertEqual(pg_cursor.itersize, 10)
+        pg_cursor.__exit__.assert_called_once()
+
+    def test_iter_result_batches_for_query(self):
+        pg_conn, pg_cursor = mock_connection([(1,), (2,), (3,)])
+        self.assertEqual(list(iter_result_batches_for_query(pg_conn, 'SELECT 1', batch_size=2)),
+                         [[(1,), (2,)], [(3,)]])
+        pg_cursor.fetchmany.assert_called_with(2)
+
+    def test_copy_from_iterable(self):
+        pg_conn = MagicMock()
+        pg_cursor = pg_conn.cursor.return_value.__enter__.return_value
+        copied = []
+
+        def copy_expert(statement, source, size):
+            copied.append((statement, source.read(10) + source.read()))
+            pg_cursor.rowcount = 3
+        pg_cursor.copy_expert.side_effect = copy_expert
+
+        rows = iter([(9606, 'Homo sapiens', 'human'), (9031, 'Gallus "gallus"', None), (1, '', 'x,y')])
+        result = copy_from_iterable(pg_conn, 'evapro.taxonomy', rows,
+                                    columns=['taxonomy_id', 'scientific_name', 'common_name'])
+        statement, data = copied[0]
+        self.assertIn("Identifier('evapro', 'taxonomy')", repr(statement))
+        self.assertIn("Identifier('scientific_name')", repr(statement))
+        self.assertEqual(data, '"9606","Homo sapiens","human"\n'
+                               '"9031","Gallus ""gallus""",\n'
+                               '"1","","x,y"\n')
+        self.assertEqual(result.rows, 3)
+        pg_conn.commit.assert_called_once()
+
+    def test_copy_from_iterable_rollback(self):
+        pg_conn = MagicMock()
+        pg_conn.cursor.return_value.__enter__.return_value.copy_expert.side_effect = psycopg2.DataError('bad row')
+        with self.assertRaises(psycopg2.DataError):
+            copy_from_iterable(pg_conn, 'evapro.taxonomy', [(1,)])
+        pg_conn.rollback.assert_called_once()
+        pg_conn.commit.assert_not_called()
+        self.assertRaises(ValueError, copy_from_iterable, pg_conn, 'evapro.taxonomy', [(1,)], copy_format='binary')
+
+    def test_copy_to_stream(self):
+        pg_conn = MagicMock()
+        pg_cursor = pg_conn.cursor.return_value.__enter__.return_value
+        pg_cursor.rowcount = 2
+        output = StringIO()
+        result = copy_to_stream(pg_conn, 'SELECT * FROM evapro.taxonomy', output, header=True, buffer_size=1024)
+        statement, stream = pg_cursor.copy_expert.call_args[0]
+        self.assertIs(stream, output)
+        self.assertEqual(pg_cursor.copy_expert.call_args[1], {'size': 1024})
+        self.assertIn("SQL('SELECT * FROM evapro.taxonomy')", repr(statement))
+        self.assertIn("HEADER true", repr(statement))
+        self.assertEqual(result.rows, 2)
+
+    def test_get_all_results_for_prepared_query(self):
+        pg_conn = MagicMock()
+        pg_cursor = pg_conn.cursor.return_value.__enter__.return_value
+        pg_cursor.fetchall.return_value = [(9606,)]
+        query = 'SELECT taxonomy_id FROM evapro.taxonomy WHERE taxonomy_id = ANY($1)'
+        for _ in range(2):
+            self.assertEqual(get_all_results_for_prepared_query(pg_conn, 'taxonomies', query, ([9606, 9031],)),
+                             [(9606,)])
+        # Only prepared once on the connection
+        self.assertEqual([c.args for c in pg_cursor.execute.call_args_list], [
+            ('PREPARE taxonomies AS SELECT taxonomy_id FROM evapro.taxonomy WHERE taxonomy_id = ANY($1)',),
+            ('EXECUTE taxonomies (%s)', ([9606, 9031],)),
+            ('EXECUTE taxonomies (%s)', ([9606, 9031],))
+        ])
+        # Threads sharing a connection prepare the statement only once
+        shared_conn = MagicMock()
+        shared_cursor = shared_conn.cursor.return_value.__enter__.return_value
+        shared_cursor.execute.side_effect = lambda *args: time.sleep(0.01)
+        threads = [threading.Thread(target=get_all_results_for_prepared_query,
+                                    args=(shared_conn, 'taxonomies', query, ([9606],))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len([c for c in shared_cursor.execute.call_args_list if c.args[0].startswith('PREPARE')]), 1)
+        # But again on another connection
+        other_conn = MagicMock()
+        get_all_results_for_prepared_query(other_conn, 'taxonomies', query, ([9606],))
+        self.assertEqual(other_conn.cursor.return_value.__enter__.return_value.execute.call_count, 2)
+
+    def test_create_indexes_on_tables(self):
+        pool, connections, statements = mock_pool([('evapro', 'taxonomy', ['taxonomy_id'])],
+                                                  failing_statement="Identifier('bad_column')")
+        results = create_indexes_on_tables(pool, [
+            ('evapro.taxonomy', ['TAXONOMY_ID']),
+            ('evapro.assembly', ['taxonomy_id', 'assembly_accession']),
+            ('evapro.assembly', ['bad_column'])
+        ], maintenance_work_mem='2GB')
+        self.assertEqual([(result.table_name, result.index_columns, result.status) for result in results], [
+            ('evapro.taxonomy', ['taxonomy_id'], INDEX_EXISTS),
+            ('evapro.assembly', ['assembly_accession', 'taxonomy_id'], INDEX_CREATED),
+            ('evapro.assembly', ['bad_column'], INDEX_FAILED)
+        ])
+        self.assertIsInstance(results[2].error, psycopg2.ProgrammingError)
+        # One catalog query for all the specs then one connection per index built
+        self.assertEqual(len(connections), 3)
+        self.assertIn(['evapro'], connections[0].cursor.return_value.__enter__.return_value.execute.call_args[0][1])
+        create_statement = next(statement for statement in statements
+                                if "Identifier('assembly_accession')" in statement)
+        self.assertIn('CREATE INDEX CONCURRENTLY', create_statement)
+        self.assertIn("Identifier('assembly_assembly_accession_taxonomy_id_idx')", create_statement)
+        self.assertTrue(any('DROP INDEX CONCURRENTLY' in statement for statement in statements))
+        self.assertTrue(any("Identifier('maintenance_work_mem')" in statement for statement in statements))
+        for pg_conn in connections[1:]:
+            self.assertFalse(pg_conn.autocommit)
+        # The only connection would be taken by the progress reports
+        pool.max_size = 1
+        self.assertRaises(ValueError, create_indexes_on_tables, pool, [('evapro.assembly', ['taxonomy_id'])])
+
+    def test_create_indexes_on_tables_name_taken(self):
+        pool, connections, statements = mock_pool([], named_indexes={
+            'assembly_taxonomy_id_idx': ('assembly', False, ['taxonomy_id']),
+            'taxonomy_taxonomy_id_idx': ('taxonomy', True, ['scientific_name'])
+        })
+        results = create_indexes_on_tables(pool, [('evapro.assembly', ['taxonomy_id']),
+                                                  ('evapro.taxonomy', ['taxonomy_id'])])
+        # The invalid index left by an interrupted build is dropped before the index is built again
+        self.assertEqual(results[0].status, INDEX_CREATED)
+        drop_statement = next(statement for statement in statements if 'DROP INDEX CONCURRENTLY' in statement)
+        self.assertIn("Identifier('evapro', 'assembly_taxonomy_id_idx')", drop_statement)
+        self.assertFalse(any('IF NOT EXISTS' in statement for statement in statements))
+        # The index with the same name on other columns is not replaced
+        self.assertEqual(results[1].status, INDEX_FAILED)
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertFalse(any("Identifier('taxonomy_taxonomy_id_idx')" in statement for statement in statements))
+
+    def test_vacuum_analyze_tables(self):
+        pool, connections, statements = mock_pool(
+            [('evapro', 'taxonomy', 10), ('evapro', 'assembly', 1000), ('evapro', 'missing', 0)],
+            failing_statement="Identifier('evapro', 'missing')"
+        )
+        # A single worker vacuums the tables in order of dead tuples
+        results = vacuum_analyze_tables(pool, ['evapro.taxonomy', 'evapro.assembly', 'evapro.missing'],
+                                        max_workers=1, parallel_workers=4)
+        self.assertEqual([(result.table_name, result.dead_tuples, result.status) for result in results], [
+            ('evapro.taxonomy', 10, VACUUM_DONE),
+            ('evapro.assembly', 1000, VACUUM_DONE),
+            ('evapro.missing', 0, VACUUM_FAILED)
+        ])
+        self.assertIsInstance(results[2].error, psycopg2.ProgrammingError)
+        vacuum_statements = [statement for statement in statements if 'VACUUM' in statement]
+        self.assertEqual(len(vacuum_statements), 3)
+        self.assertIn("Identifier('evapro', 'assembly')", vacuum_statements[0])
+        self.assertIn("Identifier('evapro', 'taxonomy')", vacuum_statements[1])
+        self.assertIn("SQL('PARALLEL 4, ANALYZE')", vacuum_statements[0])
+        pool.max_size = 1
+        self.assertRaises(ValueError, vacuum_analyze_tables, pool, ['evapro.taxonomy'])
+
+    def test_vacuum_analyze_tables_without_parallel(self):
+        pool, connections, statements = mock_pool([], server_version=120000)
+        results = vacuum_analyze_tables(pool, ['taxonomy'])
+        self.assertEqual(results[0].table_name, 'public.taxonomy')
+        self.assertIsNone(results[0].dead_tuples)
+        vacuum_statement = next(statement for statement in statements if 'VACUUM' in statement)
+        self.assertIn("SQL('ANALYZE')", vacuum_statement)
+
+    def test_wait_with_progress(self):
+        pg_conn = MagicMock()
+        pg_cursor = pg_conn.cursor.return_value.__enter__.return_value
+        pg_cursor.fetchall.return_value = [
+            (123, 'assembly', 'building index: scanning table', 50, 200, 0, 0),
+            (124, 'taxonomy', 'building index: loading tuples in tree', 0, 0, 30, 120)
+        ]
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                patch('ebi_eva_internal_pyutils.pg_utils.logger') as mock_logger:
+            futures = [executor.submit(time.sleep, 0.2)]
+            self.assertEqual(list(_wait_with_progress(pg_conn, futures, _create_index_progress_query, {123, 124},
+                                                      progress_interval=0.05)), futures)
+        logged = {c.args[1]: c.args[4] for c in mock_logger.info.call_args_list}
+        self.assertEqual(logged['assembly'], ', 50/200 blocks (25%)')
+        # Index builds loading tuples report them instead of the blocks
+        self.assertEqual(logged['taxonomy'], ', 30/120 tuples (25%)')
@@ -0,0 +1,107 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+from psycopg2 import extensions
+
+from ebi_eva_internal_pyutils.pg_utils import get_all_results_for_query, get_all_results_for_prepared_query
+from ebi_eva_internal_pyutils.query_metrics import QueryMetrics, fingerprint_query, query_metrics, \
+    is_read_only_query
+
+
+def mock_connection(rows, autocommit=False):
+    pg_conn = MagicMock(autocommit=autocommit)
+    pg_conn.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+    pg_cursor = pg_conn.cursor.return_value
+    pg_cursor.__enter__.return_value = pg_cursor
+    pg_cursor.fetchall.return_value = rows
+    pg_cursor.rowcount = len(rows)
+    return pg_conn, pg_cursor
+
+
+class TestQueryMetrics(TestCase):
+
+    def setUp(self):
+        query_metrics.clear()
+
+    def tearDown(self):
+        query_metrics.clear()
+
+    def test_fingerprint_query(self):
+        self.assertEqual(
+            fingerprint_query("SELECT * FROM evapro.taxonomy\n  WHERE taxonomy_id IN (9606, 9031) AND name = 'it''s'"),
+            'select * from evapro.taxonomy where taxonomy_id in (...) and name = ?'
+        )
+        self.assertEqual(fingerprint_query('select assembly_code from assembly where assembly_accession = $1'),
+                         'select assembly_code from assembly where assembly_accession = $1')
+
+    def test_record(self):
+        metrics = QueryMetrics()
+        pg_conn, _ = mock_connection([])
+        metrics.record(pg_conn, 'SELECT * FROM taxonomy WHERE taxonomy_id = 9606', 0.5, 1)
+        metrics.record(pg_conn, 'SELECT * FROM taxonomy WHERE taxonomy_id = 9031', 1.5, 2)
+        metrics.record(pg_conn, 'SELECT * FROM assembly', 1.0)
+        self.assertEqual(metrics.stats(), [
+            ('select * from taxonomy where taxonomy_id = ?', 2, 2.0, 1.5, 3),
+            ('select * from assembly', 1, 1.0, 1.0, 0)
+        ])
+        self.assertEqual(len(metrics.stats(limit=1)), 1)
+        self.assertEqual(len(metrics.slow_queries), 0)
+
+    def test_is_read_only_query(self):
+        self.assertTrue(is_read_only_query('SELECT * FROM taxonomy'))
+        self.assertTrue(is_read_only_query('WITH t AS (SELECT 1) SELECT * FROM t'))
+        self.assertTrue(is_read_only_query("SELECT * FROM taxonomy WHERE common_name = 'insert'"))
+        self.assertFalse(is_read_only_query('WITH d AS (DELETE FROM taxonomy RETURNING *) SELECT * FROM d'))
+        self.assertFalse(is_read_only_query('SELECT * INTO taxonomy_copy FROM taxonomy'))
+        self.assertFalse(is_read_only_query("SELECT nextval('taxonomy_seq')"))
+        self.assertFalse(is_read_only_query('INSERT INTO taxonomy VALUES (1)'))
+        self.assertFalse(is_read_only_query('EXECUTE taxonomies (1)'))
+
+    def test_slow_query(self):
+        metrics = QueryMetrics(slow_query_threshold=1, explain_slow_queries=True)
+        pg_conn, pg_cursor = mock_connection([('Seq Scan on taxonomy',), ('Buffers: shared hit=1',)])
+        with patch.object(metrics, 'warning') as mock_warning:
+            metrics.record(pg_conn, 'SELECT * FROM taxonomy', 2, 10)
+            metrics.record(pg_conn, 'SELECT * FROM taxonomy', 0.5, 10)
+            metrics.record(pg_conn, 'DELETE FROM taxonomy', 2)
+            metrics.record(pg_conn, 'INSERT INTO taxonomy VALUES ($1)', 2, params=(1,),
+                           explain_query='EXECUTE insert_taxonomy (%s)')
+        self.assertEqual(mock_warning.call_count, 3)
+        # Only the read-only query is explained, in a savepoint that is rolled back
+        self.assertEqual([c.args for c in pg_cursor.execute.call_args_list], [
+            ('SAVEPOINT query_metrics_explain',),
+            ('EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM taxonomy', None),
+            ('ROLLBACK TO SAVEPOINT query_metrics_explain',),
+            ('RELEASE SAVEPOINT query_metrics_explain',)
+        ])
+        # The transaction opened for the savepoint is closed
+        pg_conn.rollback.assert_called_once()
+        self.assertEqual([(slow_query.query, slow_query.plan) for slow_query in metrics.slow_queries], [
+            ('SELECT * FROM taxonomy', 'Seq Scan on taxonomy\nBuffers: shared hit=1'),
+            ('DELETE FROM taxonomy', None),
+            ('INSERT INTO taxonomy VALUES ($1)', None)
+        ])
+
+    def test_slow_query_explain_fails(self):
+        metrics = QueryMetrics(slow_query_threshold=1, explain_slow_queries=True)
+        pg_conn, pg_cursor = mock_connection([], autocommit=True)
+
+        def execute(statement, params=None):
+            if statement.startswith('EXPLAIN'):
+                raise psycopg2.errors.QueryCanceled('canceling statement due to statement timeout')
+        pg_cursor.execute.side_effect = execute
+        with patch.object(metrics, 'warning'):
+            metrics.record(pg_conn, 'SELECT * FROM taxonomy', 2, 10)
+        self.assertIsNone(metrics.slow_queries[0].plan)
+        self.assertEqual([c.args[0] for c in pg_cursor.execute.call_args_list],
+                         ['BEGIN', 'EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM taxonomy', 'ROLLBACK'])
+
+    def test_pg_utils_queries_recorded(self):
+        pg_conn, _ = mock_connection([(9606,), (9031,)])
+        get_all_results_for_query(pg_conn, 'SELECT taxonomy_id FROM taxonomy')
+        get_all_results_for_prepared_query(pg_conn, 'taxonomies', 'SELECT taxonomy_id FROM taxonomy WHERE x = $1',
+                                           ([9606],))
+        stats = {query_stats.fingerprint: query_stats for query_stats in query_metrics.stats()}
+        self.assertEqual(stats['select taxonomy_id from taxonomy'].rows, 2)
+        self.assertEqual(stats['select taxonomy_id from taxonomy where x = $1'].calls, 1)